@@ -0,0 +1,425 @@
+#!/usr/bin/env python3
+"""Micro-benchmarks for the hot paths of q.
+
+Usage: python bench.py [-o RESULTS.json] [--compare BASELINE.json] [NAME_PREFIX ...]
+"""
+
+import argparse
+import atexit
+import dataclasses
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import timeit
+import tracemalloc
+
+from context import Context, ContextFile, Entry, Message, Part, Request, Result, Role
+from enum import Enum
+from gemini import Gemini
+from ingest import read_stream
+from iteration import Iteration, LLMBackend
+from nvidia import NvidiaNim
+from pathlib import Path
+from payload import payloads
+from squeeze import SqueezeStats
+from tools import Tool, ToolDefinition, ToolRegistry
+from typing import Any, Callable, Mapping, Optional, Sequence
+
+
+# Synthetic history sizes, in entries
+SIZES = (10, 100, 1000, 10000, 100000)
+
+# Relative change in time above which a benchmark counts as slower (or faster) than the baseline
+DEFAULT_TOLERANCE = 0.10
+
+
+# A benchmark is a setup function returning the callable to be timed
+BENCHMARKS: dict[str, Callable[[], Callable[[], Any]]] = {}
+
+
+def benchmark(name: str):
+	def register(setup: Callable[[], Callable[[], Any]]):
+		BENCHMARKS[name] = setup
+		return setup
+	return register
+
+
+def make_tools(count: int) -> dict[str, ToolDefinition]:
+	return {
+		f'tool_{i}': ToolDefinition(
+			description=f'Synthetic tool number {i} used to benchmark request building.',
+			parameters={
+				'type': 'object',
+				'properties': {
+					f'arg_{j}': {'type': 'string', 'description': f'Argument {j} of tool {i}'}
+					for j in range(8)
+				},
+				'required': ['arg_0']
+			},
+			instructions=f'Use tool_{i} when asked to.'
+		)
+		for i in range(count)
+	}
+
+
+def make_context(turns: int) -> Context:
+	context = Context('')
+	for i in range(turns):
+		context.add_text(Role.USER, [f'Question number {i}?'])
+		context.add_text(Role.MODEL, [f'Answer number {i}.'])
+	return context
+
+
+def request_building(backend: Any, cached: bool) -> Callable[[], Callable[[], Any]]:
+	def setup() -> Callable[[], Any]:
+		tools = make_tools(200)
+		context = make_context(20)
+
+		def run() -> Any:
+			if not cached:
+				payloads.clear()
+			return backend.prepare_context(context, tools).encode()
+		return run
+	return setup
+
+
+def offline(backend: type) -> Any:
+	return backend('bench-model', fetch=lambda *_: None, lookup_secret=lambda *_: 'key')
+
+
+for _name, _backend in [('gemini', Gemini), ('nvidia', NvidiaNim)]:
+	benchmark(f'{_name}.request.200_tools.cached')(request_building(offline(_backend), cached=True))
+	benchmark(f'{_name}.request.200_tools.uncached')(request_building(offline(_backend), cached=False))
+
+
+def make_history(entries: int) -> Context:
+	'''A tool-heavy transcript with about `entries` entries.'''
+	context = Context('')
+	for i in range(entries // 4):
+		context.add_text(Role.USER, [f'Roll {i} dice and explain the result, please.'])
+		context.append(Entry(role=Role.MODEL, parts=[Request(id=str(i), name='dice', arguments={'number': i, 'sides': 6})]))
+		context.add_results([Result(id=str(i), name='dice', result={'results': [1, 2, 3], 'total': 6})])
+		context.add_text(Role.MODEL, [f'You rolled {i} dice; the total is 6. ' * 4])
+	return context
+
+
+def legacy_to_json(context: Context) -> str:
+	'''The dataclasses.asdict based encoder, kept as a reference point.'''
+	def context_to_dict(o: Any) -> Any:
+		if isinstance(o, Part) or isinstance(o, Entry):
+			return dataclasses.asdict(o)
+		if isinstance(o, Enum):
+			return o.value
+		return o
+
+	return json.dumps(context, default=context_to_dict, indent=4)
+
+
+def temporary_file(data: str) -> Path:
+	fd, path = tempfile.mkstemp(prefix='q_bench_')
+	with os.fdopen(fd, 'w') as f:
+		f.write(data)
+	atexit.register(os.unlink, path)
+	return Path(path)
+
+
+for _size in SIZES:
+	def _setup_encode(size: int = _size) -> Callable[[], Any]:
+		context = make_history(size)
+		return lambda: context.to_json()
+
+	def _setup_decode(size: int = _size) -> Callable[[], Any]:
+		data = make_history(size).to_json()
+		return lambda: Context(data)
+
+	def _setup_last_response(size: int = _size) -> Callable[[], Any]:
+		path = temporary_file(make_history(size).to_json())
+
+		def run() -> Any:
+			with ContextFile(path) as saved:
+				return saved.get_last_response()
+		return run
+
+	benchmark(f'context.to_json.{_size}')(_setup_encode)
+	benchmark(f'context.from_json.{_size}')(_setup_decode)
+	benchmark(f'context.last_response.{_size}')(_setup_last_response)
+
+
+for _size in (1000, 10000):
+	def _setup_encode_legacy(size: int = _size) -> Callable[[], Any]:
+		context = make_history(size)
+		return lambda: legacy_to_json(context)
+
+	def _setup_round_trip(size: int = _size) -> Callable[[], Any]:
+		context = make_history(size)
+		return lambda: Context(context.to_json()).to_json()
+
+	benchmark(f'context.to_json.asdict.{_size}')(_setup_encode_legacy)
+	benchmark(f'context.round_trip.{_size}')(_setup_round_trip)
+
+
+def prepare_context(backend: Any, size: int) -> Callable[[], Callable[[], Any]]:
+	def setup() -> Callable[[], Any]:
+		tools = make_tools(20)
+		context = make_history(size)
+		return lambda: backend.prepare_context(context, tools)
+	return setup
+
+
+def gemini_response(calls: int) -> Any:
+	return {
+		'candidates': [{'content': {'role': 'model', 'parts': [
+			{'text': 'Rolling the dice now.'},
+			*({'functionCall': {'id': str(i), 'name': 'dice', 'args': {'number': i, 'sides': 6}}} for i in range(calls))
+		]}}],
+		'usageMetadata': {'promptTokenCount': 1000, 'candidatesTokenCount': 100, 'totalTokenCount': 1100}
+	}
+
+
+def nvidia_response(calls: int) -> Any:
+	return {
+		'choices': [{'message': {'role': 'assistant', 'content': 'Rolling the dice now.', 'tool_calls': [
+			{'id': f'call_{i}', 'type': 'function', 'function': {'name': 'dice', 'arguments': json.dumps({'number': i, 'sides': 6})}}
+			for i in range(calls)
+		]}}],
+		'usage': {'prompt_tokens': 1000, 'completion_tokens': 100, 'total_tokens': 1100}
+	}
+
+
+for _name, _backend, _response in [('gemini', Gemini, gemini_response), ('nvidia', NvidiaNim, nvidia_response)]:
+	for _size in SIZES:
+		benchmark(f'{_name}.prepare_context.{_size}')(prepare_context(offline(_backend), _size))
+
+	def _setup_parse(backend: Any = offline(_backend), response: Any = _response(50)) -> Callable[[], Any]:
+		return lambda: backend.parse_result(response)
+
+	benchmark(f'{_name}.parse_result.50_calls')(_setup_parse)
+
+
+class ScriptedBackend(LLMBackend[Sequence[Entry], None]):
+	'''Requests `rounds` rounds of `calls` tool calls, then answers; isolates the overhead of Iteration itself.'''
+
+	def __init__(self, rounds: int, calls: int):
+		self.rounds = rounds
+		self.calls = calls
+		self.round = 0
+
+	def prepare_context(self, context: Context, tools: Mapping[str, ToolDefinition] = {}) -> None:
+		return None
+
+	def generate_response(self, context: None, timeout: Optional[float] = None) -> Sequence[Entry]:
+		self.round += 1
+		if self.round > self.rounds:
+			return [Entry(role=Role.MODEL, parts=[Message(text='Done.')])]
+		return [Entry(role=Role.MODEL, parts=[
+			Request(id=f'{self.round}_{i}', name='echo', arguments={'value': i}) for i in range(self.calls)
+		])]
+
+	def parse_result(self, result: Sequence[Entry]) -> Sequence[Entry]:
+		return result
+
+
+class EchoTool(Tool):
+	@staticmethod
+	def definition() -> ToolDefinition:
+		return ToolDefinition(description='Return the value.', parameters={'type': 'object'})
+
+	def execute(self, value: Any) -> Any:
+		return value
+
+
+for _size in (10, 1000, 100000):
+	def _setup_iteration(size: int = _size) -> Callable[[], Any]:
+		history = make_history(size)
+		registry = ToolRegistry(echo=EchoTool)
+
+		def run() -> Any:
+			context = Context('')
+			context[:] = history
+			return Iteration(ScriptedBackend(rounds=5, calls=4), registry).execute(context, lambda role, part: None, ['echo'])
+		return run
+
+	benchmark(f'iteration.execute.5_rounds.{_size}')(_setup_iteration)
+
+
+def make_log(lines: int) -> bytes:
+	'''A service log: bursts of near-identical heartbeats and retries between distinct requests and a few tracebacks.'''
+	out: list[str] = []
+	for i in range(lines):
+		ts = f'2024-05-01T{i // 3600 % 24:02d}:{i // 60 % 60:02d}:{i % 60:02d}.{i % 1000:03d}Z'
+		phase = i // 50 % 4
+		if phase == 0:
+			out.append(f'{ts} INFO  worker-{i % 8} heartbeat ok latency={i % 97}ms session=0x{i * 7919:08x}')
+		elif phase == 1:
+			out.append(f'{ts} WARN  upstream 10.0.{i % 256}.{i % 17} timed out, retrying (attempt {i % 5})')
+		elif phase == 2 and i % 10 == 0:
+			out.append(f'{ts} ERROR Traceback (most recent call last):')
+		else:
+			out.append(f'{ts} INFO  GET /api/{["users", "orders", "items"][i % 3]}/{i} 200 {i % 1500}B')
+	return '\n'.join(out).encode() + b'\n'
+
+
+for _lines in (10000, 100000):
+	def _setup_read(lines: int = _lines) -> Callable[[], Any]:
+		data = make_log(lines)
+		return lambda: read_stream(io.BytesIO(data))
+
+	def _setup_squeeze(lines: int = _lines) -> Callable[[], Any]:
+		data = make_log(lines)
+		return lambda: read_stream(io.BytesIO(data), squeeze=SqueezeStats())
+
+	benchmark(f'ingest.read.{_lines}_lines')(_setup_read)
+	benchmark(f'ingest.squeeze.{_lines}_lines')(_setup_squeeze)
+
+
+def _setup_history_search() -> Callable[[], Any]:
+	import shutil
+	from history import History
+
+	directory = tempfile.mkdtemp()
+	atexit.register(shutil.rmtree, directory, True)
+	history = History(Path(directory) / 'history.sqlite3')
+	words = ['disk', 'network', 'kernel', 'docker', 'python', 'memory', 'cuda', 'git', 'ssh', 'cron']
+	with history.connection:
+		for i in range(100000):
+			prompt = f'question {i} about {words[i % 10]} and {words[(i * 7) % 10]}'
+			answer = f'answer {i} mentioning {words[(i * 3) % 10]}'
+			cursor = history.connection.execute(
+				'INSERT INTO turns (session, created, prompt, answer) VALUES (?, ?, ?, ?)', ('bench', i, prompt, answer)
+			)
+			history.connection.execute(
+				'INSERT INTO turns_fts (rowid, prompt, answer) VALUES (?, ?, ?)', (cursor.lastrowid, prompt, answer)
+			)
+	return lambda: history.search('docker kernel')
+
+
+benchmark('history.search.100000')(_setup_history_search)
+
+
+TOOL_MODULE = '''
+from tools import Tool, ToolDefinition
+
+
+class GeneratedTool(Tool):
+	@staticmethod
+	def definition():
+		return ToolDefinition(description='Generated tool {index}', parameters={{'type': 'object'}})
+
+	def execute(self):
+		return {index}
+
+
+TOOLS = {{'generated_{index}': GeneratedTool}}
+'''
+
+
+for _modules in (10, 100):
+	def _setup_discover(modules: int = _modules) -> Callable[[], Any]:
+		import shutil
+		from plugins import discover
+
+		directory = Path(tempfile.mkdtemp())
+		atexit.register(shutil.rmtree, directory, True)
+		for i in range(modules):
+			(directory / f'generated_{i}.py').write_text(TOOL_MODULE.format(index=i))
+
+		# Startup with a warm manifest: no tool module is imported
+		manifest = directory / 'tools.json'
+		discover(ToolRegistry(), [directory], manifest)
+		return lambda: discover(ToolRegistry(), [directory], manifest)
+
+	benchmark(f'tools.discover.{_modules}_modules')(_setup_discover)
+
+
+def measure(run: Callable[[], Any], repeat: int = 5) -> float:
+	'''Best time per call in seconds.'''
+	timer = timeit.Timer(run)
+	number, _ = timer.autorange()
+	return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def measure_memory(run: Callable[[], Any]) -> int:
+	'''Peak memory in bytes allocated during a single call.'''
+	tracemalloc.start()
+	try:
+		run()
+		_, peak = tracemalloc.get_traced_memory()
+	finally:
+		tracemalloc.stop()
+	return peak
+
+
+def compare(results: Mapping[str, Any], baseline: Mapping[str, Any], tolerance: float) -> dict[str, str]:
+	'''Verdict for each result against the baseline: the relative change in time, flagged beyond `tolerance`.'''
+	verdicts: dict[str, str] = {}
+	for name, result in results.items():
+		if name not in baseline:
+			verdicts[name] = 'new'
+			continue
+
+		change = result['seconds'] / baseline[name]['seconds'] - 1
+		flag = ' slower' if change > tolerance else ' faster' if change < -tolerance else ''
+		verdicts[name] = f'{change:+.1%}{flag}'
+	return verdicts
+
+
+def main() -> int:
+	parser = argparse.ArgumentParser(description='Run the micro-benchmarks.')
+	parser.add_argument('prefixes', nargs='*', metavar='NAME_PREFIX', help='Only run the benchmarks whose name starts with one of these')
+	parser.add_argument('-o', '--output', metavar='PATH', help='Write the results as JSON (use - for stdout), e.g. to be used as a baseline')
+	parser.add_argument('--compare', metavar='PATH', help='Compare the results with a baseline written by --output; exits with 1 if any benchmark got slower')
+	parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help=f'Relative change in time that counts as slower or faster (default: {DEFAULT_TOLERANCE})')
+	parser.add_argument('--list', action='store_true', help='List the benchmarks and exit')
+	args = parser.parse_args()
+
+	selected = [name for name in BENCHMARKS if not args.prefixes or any(name.startswith(p) for p in args.prefixes)]
+	if args.list:
+		print('\n'.join(selected))
+		return 0
+
+	baseline: dict[str, Any] = {}
+	if args.compare:
+		with open(args.compare, 'r') as f:
+			baseline = json.load(f)['results']
+
+	# With the JSON on stdout, the table goes to stderr
+	table = sys.stderr if args.output == '-' else sys.stdout
+	print(f'{"benchmark":50} {"time":>15} {"peak memory":>16}{"  vs baseline" if baseline else ""}', file=table, flush=True)
+
+	results: dict[str, Any] = {}
+	for name in selected:
+		run = BENCHMARKS[name]()
+		results[name] = {'seconds': measure(run), 'peak_bytes': measure_memory(run)}
+
+		line = f'{name:50} {results[name]["seconds"] * 1e6:12.1f} us {results[name]["peak_bytes"] / 1024:12.1f} KiB'
+		if baseline:
+			line += f'  {compare({name: results[name]}, baseline, args.tolerance)[name]}'
+		print(line, file=table, flush=True)
+
+	if args.output:
+		document = {
+			'python': platform.python_version(),
+			'implementation': platform.python_implementation(),
+			'machine': platform.machine(),
+			'results': results
+		}
+		if args.output == '-':
+			json.dump(document, sys.stdout, indent=2)
+			print()
+		else:
+			with open(args.output, 'w') as f:
+				json.dump(document, f, indent=2)
+
+	if baseline:
+		slower = [name for name, verdict in compare(results, baseline, args.tolerance).items() if verdict.endswith('slower')]
+		if slower:
+			print(f'\n{len(slower)} benchmark(s) slower than the baseline: {", ".join(slower)}', file=sys.stderr)
+			return 1
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
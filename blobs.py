@@ -0,0 +1,121 @@
+import hashlib
+import logging
+import os
+import tempfile
+import time
+import zlib
+
+from pathlib import Path
+from typing import Iterator
+
+
+COMPRESSED_SUFFIX = '.z'
+CHUNK_SIZE = 1024 * 1024
+
+
+class BlobStore:
+	"""Content-addressed storage for large payloads kept next to the context files.
+
+	Blobs are named by the SHA-256 digest of their content, so storing the same data twice is a no-op.
+	Compressed blobs carry a `.z` suffix; both forms are readable regardless of the `compress` setting.
+	"""
+
+	def __init__(self, directory: Path, compress: bool = True):
+		self.directory = directory
+		self.compress = compress
+
+	def put(self, data: bytes) -> str:
+		digest = hashlib.sha256(data).hexdigest()
+
+		existing = self.path(digest)
+		if existing is not None:
+			# Refresh the timestamp to protect the blob from a concurrent garbage collection
+			os.utime(existing)
+			logging.debug(f'Blob {digest} already stored')
+			return digest
+
+		self.directory.mkdir(mode=0o700, exist_ok=True)
+		name = digest + COMPRESSED_SUFFIX if self.compress else digest
+		payload = zlib.compress(data, 1) if self.compress else data
+
+		fd, tmp = tempfile.mkstemp(dir=self.directory, prefix='.tmp_')
+		try:
+			with os.fdopen(fd, 'wb') as f:
+				f.write(payload)
+			os.replace(tmp, self.directory / name)
+		except BaseException:
+			os.unlink(tmp)
+			raise
+
+		logging.debug(f'Stored blob {digest} ({len(data)} bytes)')
+		return digest
+
+	def put_file(self, source: Path) -> str:
+		'''Copy a file into the store without compression (so that it can be mapped), streaming it in chunks.'''
+		self.directory.mkdir(mode=0o700, exist_ok=True)
+		hasher = hashlib.sha256()
+
+		fd, tmp = tempfile.mkstemp(dir=self.directory, prefix='.tmp_')
+		try:
+			with os.fdopen(fd, 'wb') as f, open(source, 'rb') as src:
+				while chunk := src.read(CHUNK_SIZE):
+					hasher.update(chunk)
+					f.write(chunk)
+
+			digest = hasher.hexdigest()
+			existing = self.path(digest)
+			if existing is not None and existing.suffix != COMPRESSED_SUFFIX:
+				os.unlink(tmp)
+				os.utime(existing)
+			else:
+				os.replace(tmp, self.directory / digest)
+		except BaseException:
+			if os.path.exists(tmp):
+				os.unlink(tmp)
+			raise
+
+		logging.debug(f'Stored file {source} as blob {digest}')
+		return digest
+
+	def get(self, digest: str) -> bytes:
+		path = self.path(digest)
+		if path is None:
+			raise KeyError(digest)
+
+		data = path.read_bytes()
+		return zlib.decompress(data) if path.suffix == COMPRESSED_SUFFIX else data
+
+	def path(self, digest: str) -> Path | None:
+		# Prefer the uncompressed form, which `put_file` may have added next to a compressed one
+		for name in (digest, digest + COMPRESSED_SUFFIX):
+			path = self.directory / name
+			if path.exists():
+				return path
+		return None
+
+	def digests(self) -> Iterator[str]:
+		if not self.directory.is_dir():
+			return
+		yield from {
+			path.name.removesuffix(COMPRESSED_SUFFIX)
+			for path in self.directory.iterdir()
+			if not path.name.startswith('.')
+		}
+
+	def collect(self, referenced: set[str], grace: float = 3600) -> None:
+		"""Remove blobs that no context references, skipping the ones written in the last `grace` seconds."""
+		threshold = time.time() - grace
+		for digest in list(self.digests()):
+			if digest in referenced:
+				continue
+
+			for path in (self.directory / digest, self.directory / (digest + COMPRESSED_SUFFIX)):
+				try:
+					if path.exists() and path.stat().st_mtime < threshold:
+						path.unlink()
+						logging.info(f'Removed unreferenced blob: {path.name}')
+				except OSError as e:
+					logging.warning(f'Error removing blob {path.name}: {e}')
+
+
+blobs = BlobStore(Path(tempfile.gettempdir()) / 'q_blobs')
@@ -0,0 +1,161 @@
+import json
+import logging
+import subprocess
+import sys
+import time
+
+from context import Attachment, Blob, Context, Entry, Message, Note, Request, Result, Role
+from core import lock_path, write_context
+from deadline import Deadline
+from iteration import LLMBackend
+from locking import file_lock
+from pathlib import Path
+from ratelimit import RateLimiter, estimate_tokens
+from typing import Any, Optional, Sequence
+
+
+# Compact once the context holds more than AFTER turns, keeping the last KEEP ones verbatim
+DEFAULT_KEEP = 4
+DEFAULT_AFTER = 10
+DEFAULT_TIMEOUT = 120.0
+
+# Longer texts are cut in the transcript given to the summarizer
+TRANSCRIPT_PART_LIMIT = 4096
+
+INSTRUCTION = (
+	'Summarize the conversation below for your own later reference. Keep the facts, decisions, names, paths, '
+	'commands, results and open questions; leave out pleasantries. Answer with the summary only.'
+)
+SUMMARY_HEADING = 'Summary of the earlier conversation:\n'
+
+
+def turn_starts(context: Sequence[Entry]) -> list[int]:
+	'''Indices of the entries that open a turn, i.e. the user prompts.'''
+	return [i for i, entry in enumerate(context) if entry.role == Role.USER]
+
+
+def needs_compaction(context: Sequence[Entry], after: int = DEFAULT_AFTER) -> bool:
+	return len(turn_starts(context)) > after
+
+
+def split(context: Sequence[Entry], keep: int = DEFAULT_KEEP) -> tuple[int, int]:
+	'''The range of entries to compact: after the system prompt (an earlier summary included) and before the last `keep` turns.'''
+	start = 0
+	while start < len(context) and context[start].role == Role.SYSTEM and not any(isinstance(p, Note) for p in context[start].parts):
+		start += 1
+
+	starts = turn_starts(context)
+	if keep <= 0:
+		end = len(context)
+	elif len(starts) > keep:
+		end = starts[-keep]
+	else:
+		end = start
+	return start, max(start, end)
+
+
+def transcript(entries: Sequence[Entry]) -> str:
+	lines: list[str] = []
+	for entry in entries:
+		for part in entry.parts:
+			if isinstance(part, Note):
+				lines.append(part.text)
+			elif isinstance(part, (Message, Blob)):
+				lines.append(f'{entry.role.value}: {_cut(part.text)}')
+			elif isinstance(part, Request):
+				lines.append(f'{entry.role.value} called {part.name}({json.dumps(part.arguments)})')
+			elif isinstance(part, Result):
+				lines.append(f'{part.name} returned: {_cut(json.dumps(part.result))}')
+			elif isinstance(part, Attachment):
+				lines.append(f'{entry.role.value}: [attached {part.type.value} image]')
+	return '\n'.join(lines)
+
+
+def summarize(
+	backend: LLMBackend[Any, Any],
+	entries: Sequence[Entry],
+	timeout: Optional[float] = DEFAULT_TIMEOUT,
+	limiter: Optional[RateLimiter] = None
+) -> str:
+	request = Context('')
+	request[:] = [
+		Entry(role=Role.SYSTEM, parts=[Message(text=INSTRUCTION)]),
+		Entry(role=Role.USER, parts=[Message(text=transcript(entries))])
+	]
+
+	deadline = Deadline(timeout)
+	if limiter is not None:
+		limiter.acquire(estimate_tokens(request), deadline)
+
+	response = backend.parse_result(backend.generate_response(backend.prepare_context(request), deadline.remaining()))
+	summary = '\n'.join(p.text for e in response if e.role == Role.MODEL for p in e.parts if isinstance(p, Message)).strip()
+	if not summary:
+		raise ValueError('The backend returned an empty summary')
+	return summary
+
+
+def compact(
+	context_file: Path,
+	backend: LLMBackend[Any, Any],
+	keep: int = DEFAULT_KEEP,
+	timeout: Optional[float] = DEFAULT_TIMEOUT,
+	limiter: Optional[RateLimiter] = None
+) -> bool:
+	'''Replace the old turns of the context file with a summary; returns whether the file was changed.
+
+	The context file is not locked while the backend is summarizing, so that interactive calls are never
+	held up. A turn saved in the meantime is kept: the summary is only applied if the compacted entries are
+	still unchanged, and is discarded otherwise (e.g. after a reset).
+	'''
+	with file_lock(lock_path(context_file, 'compact'), blocking=False) as acquired:
+		if not acquired:
+			logging.info('Another compaction of this context is running.')
+			return False
+
+		snapshot = _load(context_file)
+		start, end = split(snapshot, keep)
+		if end - start < 2:
+			return False
+
+		started = time.monotonic()
+		summary = summarize(backend, snapshot[start:end], timeout, limiter)
+		note = Entry(
+			role=Role.SYSTEM,
+			parts=[Note(text=SUMMARY_HEADING + summary)],
+			meta={'compacted_entries': end - start, 'summary_seconds': round(time.monotonic() - started, 3)}
+		)
+
+		with file_lock(lock_path(context_file)):
+			current = _load(context_file)
+			if current[:end] != snapshot[:end]:
+				logging.info('The context changed during the compaction; discarding the summary.')
+				return False
+
+			current[start:end] = [note]
+			write_context(context_file, current)
+
+	logging.info(f'Compacted {end - start} entries of {context_file}')
+	return True
+
+
+def spawn(context_file: Path) -> None:
+	'''Compact the context in a detached process, so that the current one can exit right away.'''
+	subprocess.Popen(
+		[sys.executable, str(Path(__file__).with_name('main.py')), '--compact', str(context_file)],
+		stdin=subprocess.DEVNULL,
+		stdout=subprocess.DEVNULL,
+		stderr=subprocess.DEVNULL,
+		start_new_session=True
+	)
+	logging.debug(f'Started the compaction of {context_file}')
+
+
+def _load(context_file: Path) -> Context:
+	with open(context_file, 'r') as f:
+		return Context(f.read())
+
+
+def _cut(text: str) -> str:
+	if len(text) <= TRANSCRIPT_PART_LIMIT:
+		return text
+	return text[:TRANSCRIPT_PART_LIMIT] + f' [... {len(text) - TRANSCRIPT_PART_LIMIT} characters omitted]'
@@ -0,0 +1,32 @@
+import json
+import logging
+import os
+
+from pathlib import Path
+from typing import Any
+
+
+CONFIG_DIR = Path(os.environ.get('XDG_CONFIG_HOME') or '~/.config').expanduser() / 'q'
+DATA_DIR = Path(os.environ.get('XDG_DATA_HOME') or '~/.local/share').expanduser() / 'q'
+CACHE_DIR = Path(os.environ.get('XDG_CACHE_HOME') or '~/.cache').expanduser() / 'q'
+
+CONFIG_FILE = CONFIG_DIR / 'config.json'
+
+
+def load_config(path: Path = CONFIG_FILE) -> dict[str, Any]:
+	'''Load the optional JSON configuration file; a missing or invalid file yields an empty configuration.'''
+	try:
+		with open(path, 'r') as f:
+			config = json.load(f)
+	except FileNotFoundError:
+		return {}
+	except (OSError, ValueError) as e:
+		logging.warning(f'Ignoring configuration file {path}: {e}')
+		return {}
+
+	if not isinstance(config, dict):
+		logging.warning(f'Ignoring configuration file {path}: expected a JSON object')
+		return {}
+
+	logging.debug(f'Loaded configuration from {path}')
+	return config
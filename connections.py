@@ -0,0 +1,116 @@
+import http.client
+import select
+import urllib.parse
+import urllib.request
+
+from typing import Any, Callable, Optional
+
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+class PooledResponse:
+	'''A response whose connection goes back to the pool once the body has been read to its end.'''
+
+	def __init__(self, pool: 'ConnectionPool', key: tuple[str, str, int], connection: http.client.HTTPConnection, response: http.client.HTTPResponse):
+		self.pool = pool
+		self.key = key
+		self.connection = connection
+		self.response = response
+
+	def __enter__(self) -> http.client.HTTPResponse:
+		return self.response
+
+	def __exit__(self, *exc_info: Any) -> None:
+		self.close()
+
+	def close(self) -> None:
+		# A response that is read to its end closes itself; one abandoned halfway leaves data on the socket
+		complete = self.response.isclosed()
+		self.response.close()
+		if complete and not self.response.will_close:
+			self.pool.release(self.key, self.connection)
+		else:
+			self.connection.close()
+
+
+class ConnectionPool:
+	"""Keep-alive connections, one idle connection per host, reused by the following requests to it.
+
+	The tool rounds of a call, and the turns of `q -i`, skip the TCP and TLS handshakes this way.
+	"""
+
+	def __init__(self):
+		self.idle: dict[tuple[str, str, int], http.client.HTTPConnection] = {}
+
+	def post(self, url: str, body: bytes | Callable[[], Any], headers: dict[str, str], timeout: Optional[float]) -> PooledResponse:
+		'''Send the request; raises OSError (TimeoutError included) if the connection fails.
+
+		`body` is the bytes to send, or a function that returns the body (bytes or an iterable of chunks)
+		for each attempt, when it can be read only once.
+		'''
+		parts = urllib.parse.urlsplit(url)
+		key = (parts.scheme, parts.hostname or '', parts.port or DEFAULT_PORTS[parts.scheme])
+		path = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+
+		connection = self.idle.pop(key, None)
+		if connection is not None and not _dropped(connection):
+			try:
+				return self._send(key, connection, path, body, headers, timeout)
+			except ConnectionError:
+				# The server closed the idle connection after it was checked, before any response: use a new one
+				pass
+		elif connection is not None:
+			connection.close()
+
+		cls = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+		return self._send(key, cls(key[1], key[2], timeout=timeout), path, body, headers, timeout)
+
+	def _send(
+		self,
+		key: tuple[str, str, int],
+		connection: http.client.HTTPConnection,
+		path: str,
+		body: bytes | Callable[[], Any],
+		headers: dict[str, str],
+		timeout: Optional[float]
+	) -> PooledResponse:
+		connection.timeout = timeout
+		if connection.sock is not None:
+			connection.sock.settimeout(timeout)
+
+		try:
+			connection.request('POST', path, body=body() if callable(body) else body, headers=headers)
+			response = connection.getresponse()
+		except BaseException:
+			connection.close()
+			raise
+		return PooledResponse(self, key, connection, response)
+
+	def release(self, key: tuple[str, str, int], connection: http.client.HTTPConnection) -> None:
+		previous = self.idle.pop(key, None)
+		if previous is not None:
+			previous.close()
+		self.idle[key] = connection
+
+	def close(self) -> None:
+		for connection in self.idle.values():
+			connection.close()
+		self.idle.clear()
+
+
+def proxied(url: str) -> bool:
+	'''Whether the environment sets a proxy for the URL, which only urllib knows how to use.'''
+	parts = urllib.parse.urlsplit(url)
+	return parts.scheme in urllib.request.getproxies() and not urllib.request.proxy_bypass(parts.hostname or '')
+
+
+def _dropped(connection: http.client.HTTPConnection) -> bool:
+	'''Whether an idle connection was closed by the server: its socket reads as ready (end of stream) with nothing asked.'''
+	if connection.sock is None:
+		return True
+	readable, _, _ = select.select([connection.sock], [], [], 0)
+	return bool(readable)
+
+
+pool = ConnectionPool()
@@ -1,9 +1,17 @@
+import codecs
 import os
+import re
+import secrets
+import selectors
 import shlex
+import signal
 import subprocess
 import sys
+import time
 
+from ingest import CHUNK_SIZE, HeadTailBuffer
 from tools import JsonValue, Tool, ToolDefinition
+from typing import Callable, Mapping, Optional, TextIO
 
 
 color = sys.stdout.isatty() and os.environ.get('TERM') not in (None, '', 'dumb')
@@ -18,14 +26,19 @@ class ConsoleCommandTool(Tool):
 	"""Safely execute a shell command after explicit user confirmation.
 
 	Requests the user to approve the command before running. If approved,
-	executes the command and returns structured results including stdout,
-	stderr and exit status.
+	executes the command, echoing its output live, and returns structured
+	results including a bounded sample of stdout and stderr and the exit status.
 	"""
 
 	MAX_TIMEOUT = 60
+	# Bytes of each output stream returned to the model; the middle of longer outputs is dropped
+	MAX_OUTPUT = 16 * 1024
 	DESCRIPTION = 'Execute a shell command after user confirmation (y/n). Returns stdout, stderr, and exit code.'
 	INSTRUCTIONS = 'When the solving user\'s request requires executing a shell command, use the "command" tool immediately, without looking for specific instruction to do so.'
 
+	# Shared by the instances of a session if set, so that the working directory and variables carry over between commands
+	worker: Optional['ShellWorker'] = None
+
 	@staticmethod
 	def definition():
 		return ToolDefinition(
@@ -44,6 +57,7 @@ class ConsoleCommandTool(Tool):
 		)
 
 	def execute(self, command: str) -> JsonValue:
+		started = time.monotonic()
 		command = command.strip()
 		if not command:
 			return {'approved': False, 'error': 'Empty command provided'}
@@ -75,21 +89,22 @@ class ConsoleCommandTool(Tool):
 		except ValueError:
 			pass
 
+		# The invocation's remaining deadline, if any, may be shorter than MAX_TIMEOUT; it includes the time spent confirming
+		limit = self.MAX_TIMEOUT if self.timeout is None else min(self.MAX_TIMEOUT, self.timeout - (time.monotonic() - started))
+
+		print(f'{YELLOW}----------------------------------------{RESET}')
 		try:
-			completed = subprocess.run(
-				args,
-				shell=shell,
-				capture_output=True,
-				text=True,
-				timeout=self.MAX_TIMEOUT
-			)
+			if self.worker is not None:
+				returncode, stdout, stderr = self.worker.run(command, limit, self.MAX_OUTPUT)
+			else:
+				returncode, stdout, stderr = self._run(args, shell, limit)
 		except subprocess.TimeoutExpired:
-			print(f'{RED}Command timed out ({self.MAX_TIMEOUT}s).{RESET}')
+			print(f'{RED}Command timed out ({limit:g}s).{RESET}')
 			return {
 				'approved': True,
 				'command': command,
 				'timeout': True,
-				'error': f'Command timed out after {self.MAX_TIMEOUT} seconds'
+				'error': f'Command timed out after {limit:g} seconds'
 			}
 		except Exception as e:
 			print(f'{RED}Command execution failed: {e}{RESET}')
@@ -99,24 +114,216 @@ class ConsoleCommandTool(Tool):
 				'error': f'Execution failed: {e}'
 			}
 
-		result: JsonValue = {
+		print(f'{YELLOW}----------------------------------------{RESET}\n')
+		print(f'{BLUE}Command result: {returncode}{RESET}')
+
+		result: dict[str, JsonValue] = {
 			'approved': True,
 			'command': command,
-			'returncode': completed.returncode,
-			'stdout': completed.stdout,
-			'stderr': completed.stderr
+			'returncode': returncode,
+			'stdout': stdout.text(),
+			'stderr': stderr.text()
 		}
 
-		print(f'{BLUE}Command result: {completed.returncode}{RESET}')
-		print(f'\n{YELLOW}----------------------------------------{RESET}')
-		print(f'{completed.stdout}')
+		if stdout.dropped:
+			result['stdout_dropped_bytes'] = stdout.dropped
+		if stderr.dropped:
+			result['stderr_dropped_bytes'] = stderr.dropped
+
+		return result
+
+	def _run(self, args: str | list[str], shell: bool, timeout: float) -> tuple[int, HeadTailBuffer, HeadTailBuffer]:
+		"""Run the command, echoing its output live while keeping a bounded sample of each stream.
+
+		Raises `subprocess.TimeoutExpired` (after killing the process) if it runs longer than `timeout` seconds.
+		"""
+		if timeout <= 0:
+			raise subprocess.TimeoutExpired(args, timeout)
+
+		deadline = time.monotonic() + timeout
+		head = self.MAX_OUTPUT // 2
+
+		process = subprocess.Popen(args, shell=shell, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+		assert process.stdout is not None and process.stderr is not None
+
+		stdout = HeadTailBuffer(head, self.MAX_OUTPUT - head)
+		stderr = HeadTailBuffer(head, self.MAX_OUTPUT - head)
+
+		with process:
+			finished = _pump({
+				process.stdout.fileno(): _tee(stdout, sys.stdout),
+				process.stderr.fileno(): _tee(stderr, sys.stderr)
+			}, deadline)
+
+			try:
+				if not finished:
+					raise subprocess.TimeoutExpired(args, timeout)
+				returncode = process.wait(max(deadline - time.monotonic(), 0))
+			except subprocess.TimeoutExpired:
+				process.kill()
+				raise
+
+		return returncode, stdout, stderr
 
-		if completed.stderr:
-			print(f'{RED}----------------------------------------{RESET}\n')
-			print(f'{RED}Command error output:{RESET}')
-			print(f'\n{completed.stderr}')
-			print(f'{RED}----------------------------------------{RESET}\n')
+
+class ShellWorker:
+	"""A shell kept running for the whole session, which runs the commands one after another.
+
+	The working directory, variables and functions carry over from one command to the next. Each command
+	is followed by a line with a random marker and its exit status on stdout (and the marker alone on
+	stderr), which tells where its output ends. Commands read their input from /dev/null, as the shell's
+	stdin carries the commands. If the shell exits (e.g. after `exit`) or a command times out, the next
+	command starts a new shell.
+	"""
+
+	def __init__(self, shell: str = '/bin/sh'):
+		self.shell = shell
+		self.process: Optional[subprocess.Popen[bytes]] = None
+
+	def run(self, command: str, timeout: float, max_output: int) -> tuple[int, HeadTailBuffer, HeadTailBuffer]:
+		"""Run the command, echoing its output live while keeping a bounded sample of each stream.
+
+		Raises `subprocess.TimeoutExpired` (after killing the shell) if it runs longer than `timeout` seconds.
+		"""
+		if timeout <= 0:
+			raise subprocess.TimeoutExpired(command, timeout)
+
+		deadline = time.monotonic() + timeout
+		process = self._start()
+		assert process.stdin is not None and process.stdout is not None and process.stderr is not None
+
+		head = max_output // 2
+		stdout = HeadTailBuffer(head, max_output - head)
+		stderr = HeadTailBuffer(head, max_output - head)
+
+		token = secrets.token_hex(16)
+		out = _Framed(token, _tee(stdout, sys.stdout))
+		err = _Framed(token, _tee(stderr, sys.stderr))
+
+		# `command` keeps a syntax error in the command from ending the shell, as it would for a bare `eval`
+		script = (
+			f'command eval {shlex.quote(command)} </dev/null\n'
+			f"printf '\\n%s %d\\n' {token} $?; printf '\\n%s \\n' {token} >&2\n"
+		)
+		try:
+			process.stdin.write(script.encode())
+			process.stdin.flush()
+		except BrokenPipeError:
+			pass
+
+		finished = _pump({process.stdout.fileno(): out.feed, process.stderr.fileno(): err.feed}, deadline, lambda: out.status is not None and err.status is not None)
+		if not finished:
+			self.close()
+			raise subprocess.TimeoutExpired(command, timeout)
+
+		if out.status:
+			return int(out.status), stdout, stderr
+
+		# The shell exited, taking the command's exit status with it
+		returncode = process.wait(max(deadline - time.monotonic(), 0))
+		self.process = None
+		return returncode, stdout, stderr
+
+	def close(self) -> None:
+		if self.process is None:
+			return
+		try:
+			os.killpg(self.process.pid, signal.SIGKILL)
+		except ProcessLookupError:
+			pass
+		self.process.wait()
+		for stream in (self.process.stdin, self.process.stdout, self.process.stderr):
+			if stream is not None:
+				stream.close()
+		self.process = None
+
+	def _start(self) -> subprocess.Popen[bytes]:
+		if self.process is not None and self.process.poll() is None:
+			return self.process
+
+		self.close()
+		# A session of its own, so that a timeout kills the command's children along with the shell
+		self.process = subprocess.Popen(
+			[self.shell],
+			stdin=subprocess.PIPE,
+			stdout=subprocess.PIPE,
+			stderr=subprocess.PIPE,
+			start_new_session=True
+		)
+		return self.process
+
+
+class _Framed:
+	'''Passes on a stream's output up to the marker line, whose remainder (the exit status on stdout) ends up in `status`.'''
+
+	def __init__(self, token: str, sink: Callable[[bytes], None]):
+		self.marker = b'\n' + token.encode() + b' '
+		self.trailer = re.compile(re.escape(self.marker) + rb'(\d*)\n')
+		self.sink = sink
+		self.pending = b''
+		self.status: Optional[str] = None
+
+	def feed(self, chunk: bytes) -> None:
+		if not chunk:
+			# End of the stream: whatever is held back is output after all
+			self.sink(self.pending)
+			self.pending = b''
+			return
+
+		self.pending += chunk
+		match = self.trailer.search(self.pending)
+		if match:
+			self.sink(self.pending[:match.start()])
+			self.status = match.group(1).decode()
+			self.pending = b''
+			return
+
+		# Hold back what may be the beginning of the marker line
+		keep = 0
+		start = self.pending.find(self.marker)
+		if start >= 0:
+			keep = len(self.pending) - start
 		else:
-			print(f'{YELLOW}----------------------------------------{RESET}\n')
+			for size in range(min(len(self.marker) - 1, len(self.pending)), 0, -1):
+				if self.pending.endswith(self.marker[:size]):
+					keep = size
+					break
 
-		return result
+		self.sink(self.pending[:len(self.pending) - keep])
+		self.pending = self.pending[len(self.pending) - keep:]
+
+
+def _tee(buffer: HeadTailBuffer, echo: TextIO) -> Callable[[bytes], None]:
+	# A character can be split between two reads; the decoder keeps its first bytes until the rest arrives
+	decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+
+	def write(chunk: bytes) -> None:
+		buffer.write(chunk)
+		text = decoder.decode(chunk, final=not chunk)
+		if text:
+			echo.write(text)
+			echo.flush()
+	return write
+
+
+def _pump(sinks: Mapping[int, Callable[[bytes], None]], deadline: float, done: Callable[[], bool] = lambda: False) -> bool:
+	'''Pass the output of each file descriptor to its sink (b'' at the end) until all of them end or `done()`; False on timeout.'''
+	with selectors.DefaultSelector() as selector:
+		for fd in sinks:
+			selector.register(fd, selectors.EVENT_READ)
+
+		while selector.get_map() and not done():
+			remaining = deadline - time.monotonic()
+			if remaining <= 0:
+				return False
+
+			for key, _ in selector.select(remaining):
+				chunk = os.read(key.fd, CHUNK_SIZE)
+				if not chunk:
+					selector.unregister(key.fd)
+				sinks[key.fd](chunk)
+	return True
+
+
+# Tools provided by this module; see plugins.discover
+TOOLS = {'console': ConsoleCommandTool}
@@ -1,11 +1,20 @@
 import dataclasses
 import json
+import mimetypes
+import mmap
+import os
 from enum import Enum
-from typing import Dict, List, Mapping, Protocol, Sequence, Any, Type, TypeVar
+from typing import Dict, Iterator, List, Mapping, Optional, Protocol, Sequence, Any, Type, TypeVar, overload
 from dataclasses import dataclass
+from blobs import blobs
+from pathlib import Path
 from tools import JsonValue
 
 
+# Texts longer than this are moved out of the context file into the blob store
+BLOB_THRESHOLD = 16 * 1024
+
+
 class Role(Enum):
 	USER = 'user'
 	MODEL = 'model'
@@ -16,9 +25,13 @@ class Role(Enum):
 class PartType(Enum):
 	TEXT = 'text/plain'
 	PNG = 'image/png'
+	JPEG = 'image/jpeg'
+	WEBP = 'image/webp'
 	REQUEST = 'application/x-request'
 	RESULT = 'application/x-result'
 	NOTE = 'text/x-note'
+	BLOB = 'application/x-blob'
+	PROGRESS = 'application/x-progress'
 	# ...
 
 
@@ -28,7 +41,16 @@ class PartProtocol(Protocol):
 
 @dataclass(frozen=True)
 class Part:
-	pass
+	# Generic (de)serialization through the dataclass fields; the concrete parts override these
+	# with hand-written single-pass versions, as they are called for every part on every save and load.
+	def encode(self) -> dict[str, Any]:
+		data: dict[str, Any] = {f.name: getattr(self, f.name) for f in dataclasses.fields(self)}
+		data['type'] = data['type'].value
+		return data
+
+	@classmethod
+	def decode(cls, data: Mapping[str, Any]) -> 'Part':
+		return cls(**{k: v for k, v in data.items() if k != 'type'})
 
 
 registry: Dict[str, Type[Part]] = {}
@@ -38,6 +60,22 @@ registry: Dict[str, Type[Part]] = {}
 class Entry:
 	role: Role
 	parts: Sequence[Part]
+	# Local bookkeeping (token usage, timings, ...); never sent to the model
+	meta: Mapping[str, JsonValue] = dataclasses.field(default_factory=dict, compare=False)
+
+	def encode(self) -> dict[str, Any]:
+		data = {'role': self.role.value, 'parts': [p.encode() for p in self.parts]}
+		if self.meta:
+			data['meta'] = self.meta
+		return data
+
+	@staticmethod
+	def decode(data: Mapping[str, Any]) -> 'Entry':
+		return Entry(
+			role=Role(data['role']),
+			parts=[registry[p['type']].decode(p) for p in data['parts']],
+			meta=data.get('meta', {})
+		)
 
 	T = TypeVar('T', bound=PartProtocol)
 	@classmethod
@@ -55,6 +93,27 @@ class Message(Part):
 	text: str
 	type: PartType = PartType.TEXT
 
+	def encode(self) -> dict[str, Any]:
+		return {'type': self.type.value, 'text': self.text}
+
+	@classmethod
+	def decode(cls, data: Mapping[str, Any]) -> 'Message':
+		return cls(data['text'])
+
+
+@Entry.part
+@dataclass(frozen=True)
+class Note(Part):
+	'''Text written by q itself rather than by the user or the model, such as the summary of compacted turns.'''
+	text: str
+	type: PartType = PartType.NOTE
+
+	def encode(self) -> dict[str, Any]:
+		return {'type': self.type.value, 'text': self.text}
+
+	@classmethod
+	def decode(cls, data: Mapping[str, Any]) -> 'Note':
+		return cls(data['text'])
 
 
 @Entry.part
@@ -65,6 +124,12 @@ class Request(Part):
 	arguments: Mapping[str, JsonValue]
 	type: PartType = PartType.REQUEST
 
+	def encode(self) -> dict[str, Any]:
+		return {'type': self.type.value, 'id': self.id, 'name': self.name, 'arguments': self.arguments}
+
+	@classmethod
+	def decode(cls, data: Mapping[str, Any]) -> 'Request':
+		return cls(data['id'], data['name'], data['arguments'])
 
 
 @Entry.part
@@ -75,6 +140,86 @@ class Result(Part):
 	result: JsonValue
 	type: PartType = PartType.RESULT
 
+	def encode(self) -> dict[str, Any]:
+		return {'type': self.type.value, 'id': self.id, 'name': self.name, 'result': self.result}
+
+	@classmethod
+	def decode(cls, data: Mapping[str, Any]) -> 'Result':
+		return cls(data['id'], data['name'], data['result'])
+
+
+@Entry.part
+@dataclass(frozen=True)
+class ToolProgress(Part):
+	'''Progress reported by a running tool; only passed to the output, never kept in the context.'''
+	id: str
+	name: str
+	text: str
+	type: PartType = PartType.PROGRESS
+
+
+@Entry.part
+@dataclass(frozen=True)
+class Blob(Part):
+	'''Text stored in the blob store; the content is loaded only when it is accessed.'''
+	digest: str
+	size: int
+	type: PartType = PartType.BLOB
+
+	def encode(self) -> dict[str, Any]:
+		return {'type': self.type.value, 'digest': self.digest, 'size': self.size}
+
+	@classmethod
+	def decode(cls, data: Mapping[str, Any]) -> 'Blob':
+		return cls(data['digest'], data['size'])
+
+	@classmethod
+	def store(cls, text: str) -> 'Blob':
+		data = text.encode('utf-8')
+		return cls(digest=blobs.put(data), size=len(data))
+
+	@property
+	def text(self) -> str:
+		return blobs.get(self.digest).decode('utf-8')
+
+
+@Entry.part
+@dataclass(frozen=True)
+class Attachment(Part):
+	'''Binary file referenced by path or by blob digest; its content never enters the context file.'''
+	path: str = ''
+	digest: str = ''
+	type: PartType = PartType.PNG
+
+	def encode(self) -> dict[str, Any]:
+		data = {'type': self.type.value, 'path': self.path, 'digest': self.digest}
+		return {k: v for k, v in data.items() if v}
+
+	@classmethod
+	def decode(cls, data: Mapping[str, Any]) -> 'Attachment':
+		return cls(data.get('path', ''), data.get('digest', ''), PartType(data['type']))
+
+	@classmethod
+	def store(cls, path: str | os.PathLike[str]) -> 'Attachment':
+		'''Copy a file into the blob store, so that the context keeps working if the file changes or goes away.'''
+		mime_type, _ = mimetypes.guess_type(path)
+		if mime_type not in ATTACHMENT_TYPES:
+			raise ValueError(f'Unsupported attachment type {mime_type} for {path}')
+		return cls(digest=blobs.put_file(Path(path)), type=PartType(mime_type))
+
+	@property
+	def file(self) -> Path:
+		if self.digest:
+			path = blobs.path(self.digest)
+			if path is None:
+				raise FileNotFoundError(f'Attachment blob {self.digest} is missing')
+			return path
+		return Path(self.path)
+
+
+ATTACHMENT_TYPES = {t.value for t in (PartType.PNG, PartType.JPEG, PartType.WEBP)}
+registry.update({t: Attachment for t in ATTACHMENT_TYPES})
+
 
 class Context(List[Entry]):
 	def __init__(self, context_json: str):
@@ -83,8 +228,9 @@ class Context(List[Entry]):
 		else:
 			self.reset()
 
-	def add_text(self, role: Role, text: Sequence[str]):
-		parts = [Message(text=t) for t in text]
+	def add_text(self, role: Role, text: Sequence[str], attachments: Sequence[Attachment] = ()):
+		parts: list[Part] = [Blob.store(t) if len(t) > BLOB_THRESHOLD else Message(text=t) for t in text]
+		parts.extend(attachments)
 		entry = Entry(role=role, parts=parts)
 		self.append(entry)
 
@@ -105,34 +251,133 @@ class Context(List[Entry]):
 
 	def get_last_response(self) -> str | JsonValue | None:
 		'''Get the last response from the model.'''
-		for entry in reversed(self):
-			if entry.role == Role.MODEL or entry.role == Role.TOOL:
-				for part in entry.parts:
-					if isinstance(part, Message):
-						return part.text
-					elif isinstance(part, Result):
-						return part.result
-		return None
-
-	def to_json(self):
-		def context_to_dict(o: Any) -> Any:
-			if isinstance(o, Part) or isinstance(o, Entry):
-				return dataclasses.asdict(o)
-			if isinstance(o, Enum):
-				return o.value
-			return o
-
-		return json.dumps(self, default=context_to_dict, indent=4)
+		return last_response(self)
+
+	def to_json(self, indent: int | None = None) -> str:
+		"""Serialize the context; pretty-printed if `indent` is given.
+
+		By default each entry is written compactly on its own line, which keeps the result a JSON array
+		while letting `ContextFile` find the entries without parsing the whole file.
+		"""
+		if indent is None:
+			return '[\n' + ',\n'.join(self.encode_line(entry) for entry in self) + '\n]'
+		return json.dumps([entry.encode() for entry in self], indent=indent)
+
+	@staticmethod
+	def encode_line(entry: Entry) -> str:
+		'''An entry as `to_json` writes it, on a line of its own.'''
+		return json.dumps(entry.encode(), separators=(',', ':'))
 
 	def from_json(self, json_str: str):
-		data = json.loads(json_str)
-		self.extend([
-			Entry(
-				role=Role(e['role']),
-				parts=[
-					registry[p['type']](**{k: v for k, v in p.items() if k != 'type'})
-					for p in e['parts']
-				]
-			)
-			for e in data
-		])
+		self.extend([Entry.decode(e) for e in json.loads(json_str)])
+
+
+def last_response(entries: Sequence[Entry]) -> str | JsonValue | None:
+	for entry in reversed(entries):
+		if entry.role == Role.MODEL or entry.role == Role.TOOL:
+			for part in entry.parts:
+				if isinstance(part, Message):
+					return part.text
+				elif isinstance(part, Result):
+					return part.result
+	return None
+
+
+class ContextFile(Sequence[Entry]):
+	"""Read-only view of a saved context that decodes the entries on demand, starting from the tail.
+
+	The entries are located by scanning the mapped file backwards for the line breaks written by
+	`Context.to_json`, so reading the last entries costs the same however long the session is. Files in
+	another layout (written by older versions) are decoded in full.
+	"""
+
+	def __init__(self, path: Path):
+		self.entries: Dict[int, Entry] = {}
+		# Byte ranges of the entry lines found so far, from the last one backwards
+		self.lines: List[tuple[int, int]] = []
+		self.legacy: Optional[List[Entry]] = None
+
+		with open(path, 'rb') as f:
+			size = os.fstat(f.fileno()).st_size
+			self.data: mmap.mmap | bytes = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+
+		if self.data[:2] == b'[\n' and self.data[-2:] == b'\n]':
+			# Position of the line break that ends the next entry line to be found
+			self.cursor: int = len(self.data) - 2
+			try:
+				self._find(1)
+				if self.lines:
+					self._decode(0)
+				return
+			except (ValueError, KeyError, TypeError):
+				self.lines.clear()
+
+		self.legacy = Context(bytes(self.data).decode('utf-8')) if self.data else []
+
+	def __enter__(self) -> 'ContextFile':
+		return self
+
+	def __exit__(self, *_: Any) -> None:
+		self.close()
+
+	def close(self) -> None:
+		if isinstance(self.data, mmap.mmap):
+			self.data.close()
+
+	def __len__(self) -> int:
+		if self.legacy is not None:
+			return len(self.legacy)
+		self._find(None)
+		return len(self.lines)
+
+	@overload
+	def __getitem__(self, index: int) -> Entry: ...
+	@overload
+	def __getitem__(self, index: slice) -> Sequence[Entry]: ...
+	def __getitem__(self, index: int | slice) -> Entry | Sequence[Entry]:
+		if self.legacy is not None:
+			return self.legacy[index]
+		if isinstance(index, slice):
+			return [self[i] for i in range(*index.indices(len(self)))]
+
+		if index < 0:
+			self._find(-index)
+			if -index > len(self.lines):
+				raise IndexError(index)
+			return self._decode(-index - 1)
+
+		length = len(self)
+		if index >= length:
+			raise IndexError(index)
+		return self._decode(length - 1 - index)
+
+	def __reversed__(self) -> Iterator[Entry]:
+		if self.legacy is not None:
+			yield from reversed(self.legacy)
+			return
+		position = 0
+		while True:
+			self._find(position + 1)
+			if position >= len(self.lines):
+				return
+			yield self._decode(position)
+			position += 1
+
+	def get_last_response(self) -> str | JsonValue | None:
+		return last_response(self)
+
+	def _find(self, count: Optional[int]) -> None:
+		'''Locate entry lines backwards until `count` of them are known (all of them if None).'''
+		while (count is None or len(self.lines) < count) and self.cursor > 1:
+			start = self.data.rfind(b'\n', 0, self.cursor) + 1
+			end = self.cursor - 1 if self.data[self.cursor - 1:self.cursor] == b',' else self.cursor
+			if start < end:
+				self.lines.append((start, end))
+			self.cursor = start - 1
+
+	def _decode(self, position: int) -> Entry:
+		entry = self.entries.get(position)
+		if entry is None:
+			start, end = self.lines[position]
+			entry = self.entries[position] = Entry.decode(json.loads(self.data[start:end]))
+		return entry
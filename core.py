@@ -1,18 +1,33 @@
 #!/usr/bin/env python3
 
+import http.client
 import json
 import logging
 import os
+import re
 import subprocess
+import sys
 import tempfile
 import urllib.error
 import urllib.request
 
 from argparse import Namespace
-from context import Context, Message, Part, Request, Result, Role
+from blobs import blobs
+from connections import PooledResponse, pool, proxied
+from context import Attachment, Context, ContextFile, Entry, Message, Part, Request, Result, Role, ToolProgress
+from deadline import Deadline, DeadlineExceeded
+from deferred import WorkQueue
+from ingest import CHUNK_SIZE, DEFAULT_MAX_BYTES, read_file, read_stream
+from history import History, format_hits
 from iteration import Iteration
+from locking import file_lock
+from metrics import metrics
 from pathlib import Path
-from typing import Any, Callable, Optional
+from payload import Payload
+from similarity import SimilarityCache, config_key
+from squeeze import SqueezeStats
+from stats import summarize
+from typing import Any, Callable, Iterator, Optional, Protocol
 
 
 class FetchError(Exception):
@@ -22,25 +37,84 @@ class FetchError(Exception):
 			self.code = code
 
 
-type Fetch = Callable[[str, str, dict[str, str]], str]
+class Fetch(Protocol):
+	def __call__(self, url: str, data: Any, headers: dict[str, str], timeout: Optional[float] = None) -> Any: ...
 
 
-def fetch(url: str, data: Any, headers: dict[str, str]) -> Any:
+class FetchStream(Protocol):
+	def __call__(self, url: str, data: Any, headers: dict[str, str], timeout: Optional[float] = None) -> Iterator[Any]: ...
+
+
+def fetch(url: str, data: Any, headers: dict[str, str], timeout: Optional[float] = None) -> Any:
+	'''POST `data` as JSON and return the decoded JSON response, within `timeout` seconds in total.'''
+	# The socket timeout applies to each read only, so a server that trickles the body could outlast it
+	deadline = Deadline(timeout)
+	with _open(url, data, headers, timeout) as response:
+		try:
+			chunks: list[bytes] = []
+			while chunk := response.read1(CHUNK_SIZE):
+				chunks.append(chunk)
+				deadline.check()
+			body = b''.join(chunks).decode('utf-8')
+		except TimeoutError:
+			raise DeadlineExceeded(f'Request to {url} timed out')
+
+		# TODO: Run debug logging only if enabled, to avoid wasting cycles
+		logging.debug(f"Response Status: {response.status}")
+		logging.debug(f"Response Body: {json.dumps(json.loads(body), indent=2)}")
+
+		return json.loads(body)
+
+
+def fetch_stream(url: str, data: Any, headers: dict[str, str], timeout: Optional[float] = None) -> Iterator[Any]:
+	'''POST `data` as JSON and yield the decoded JSON events of a server-sent event stream, until `[DONE]`, within `timeout` seconds in total.'''
+	deadline = Deadline(timeout)
+	with _open(url, data, headers, timeout) as response:
+		try:
+			for line in response:
+				deadline.check()
+				line = line.strip()
+				if not line.startswith(b'data:'):
+					continue
+
+				event = line[len(b'data:'):].strip()
+				if event == b'[DONE]':
+					break
+
+				logging.debug(f"Response Event: {event.decode('utf-8', errors='replace')}")
+				yield json.loads(event)
+		except TimeoutError:
+			raise DeadlineExceeded(f'Request to {url} timed out')
+
+
+def _open(url: str, data: Any, headers: dict[str, str], timeout: Optional[float]) -> Any:
 	# TODO: Run debug logging only if enabled, to avoid wasting cycles
 	logging.debug(f"Request URL: {url}")
 	logging.debug(f"Request Headers: {json.dumps(headers, indent=2)}")
-	logging.debug(f"Request Data: {json.dumps(data, indent=2)}")
+	logging.debug(f"Request Data: {json.dumps(data, indent=2, default=repr)}")
 
-	request = urllib.request.Request(url, data=json.dumps(data).encode('utf-8'), headers=headers, method='POST')
-	try:
-		with urllib.request.urlopen(request) as response:
-			body = response.read().decode('utf-8')
+	if isinstance(data, Payload):
+		chunks, length = data.stream()
+		headers = {**headers, 'Content-Length': str(length)}
+		encoded = [chunks]
+
+		def request_body() -> Any:
+			# The chunks can be read once; a retry or a redirect encodes the payload again
+			return encoded.pop() if encoded else data.stream()[0]
+	else:
+		body = json.dumps(data).encode('utf-8')
+
+		def request_body() -> Any:
+			return body
 
-			# TODO: Run debug logging only if enabled, to avoid wasting cycles
-			logging.debug(f"Response Status: {response.status}")
-			logging.debug(f"Response Body: {json.dumps(json.loads(body), indent=2)}")
+	if not proxied(url):
+		pooled = _open_pooled(url, request_body, headers, timeout)
+		if pooled is not None:
+			return pooled
 
-			return json.loads(body)
+	request = urllib.request.Request(url, data=request_body(), headers=headers, method='POST')
+	try:
+		return urllib.request.urlopen(request, timeout=timeout)
 	except urllib.error.HTTPError as e:
 		try:
 			error_body = e.read().decode('utf-8', errors='replace')
@@ -48,11 +122,100 @@ def fetch(url: str, data: Any, headers: dict[str, str]) -> Any:
 			error_body = str(e)
 		raise FetchError(error_body, code=e.code)
 	except urllib.error.URLError as e:
+		if isinstance(e.reason, TimeoutError):
+			raise DeadlineExceeded(f'Request to {url} timed out')
 		raise FetchError(str(e))
+	except TimeoutError:
+		raise DeadlineExceeded(f'Request to {url} timed out')
+
+
+def _open_pooled(url: str, body: Callable[[], Any], headers: dict[str, str], timeout: Optional[float]) -> Optional[PooledResponse]:
+	'''Like `urlopen`, over a keep-alive connection from the pool; None for a redirect, which only urllib follows.'''
+	try:
+		pooled = pool.post(url, body, headers, timeout)
+	except TimeoutError:
+		raise DeadlineExceeded(f'Request to {url} timed out')
+	except (OSError, http.client.HTTPException) as e:
+		raise FetchError(f'<urlopen error {e}>')
+
+	if 300 <= pooled.response.status < 400:
+		pooled.close()
+		return None
+
+	if pooled.response.status >= 400:
+		with pooled as response:
+			try:
+				error_body = response.read().decode('utf-8', errors='replace')
+			except Exception:
+				error_body = f'HTTP Error {response.status}: {response.reason}'
+		raise FetchError(error_body, code=pooled.response.status)
+	return pooled
+
+
+def debug_print_response(role: Role, part: Part) -> None:
+	role_str = {
+		Role.SYSTEM: 'SYSTEM',
+		Role.USER: 'USER',
+		Role.MODEL: 'MODEL',
+		Role.TOOL: 'TOOL'
+	}.get(role, 'UNKNOWN')
+
+	if isinstance(part, Message):
+		print(f'[{role_str}] {part.text}')
+	elif isinstance(part, Request):
+		print(f"[{role_str}:{part.id}] {part.name}({', '.join(part.arguments)})")
+	elif isinstance(part, Result):
+		print(f"[{role_str}:{part.id}] {part.name} => {part.result}")
+	elif isinstance(part, ToolProgress):
+		print(f"[{role_str}:{part.id}] {part.name} ... {part.text}")
+	else:
+		logging.warning(f'Unknown part type: {part}')
+		print(f'[{role_str}] {part}')
+
+
+def print_response(role: Role, part: Part) -> None:
+	if role == Role.MODEL and isinstance(part, Message):
+		print(part.text)
+	elif isinstance(part, ToolProgress):
+		# Kept out of stdout, which carries only the answer
+		print(f'[{part.name}] {part.text}', file=sys.stderr)
+
+
+def response_printer() -> Callable[[Role, Part], None]:
+	return debug_print_response if logging.getLogger().isEnabledFor(logging.DEBUG) else print_response
 
 
 # TODO: Use an abstract class to avoid the need to provide type parameters
-def execute_command(context_file: Path, command: Namespace, prompts: list[str], it: Iteration[Any, Any]) -> None:
+def execute_command(
+	context_file: Path,
+	command: Namespace,
+	prompts: list[str],
+	it: Iteration[Any, Any],
+	history: Optional[History] = None,
+	cache: Optional[SimilarityCache] = None,
+	queue: Optional[WorkQueue] = None
+) -> Optional[Context]:
+	'''Run the command; the work that can wait until the answer is printed goes to `queue`, or runs before returning if there is none.'''
+	if command.search:
+		if history is None:
+			logging.warning('The history is not available; enable it with {"history": {"enabled": true}} in the configuration.')
+		else:
+			print(format_hits(history.search(command.search)))
+		return None
+
+	if not (prompts or command.attach or command.reset or command.log or command.stats):
+		# No input: print the last response, decoding only the tail of the context file
+		last_response = None
+		if context_file.exists():
+			with ContextFile(context_file) as saved:
+				last_response = saved.get_last_response()
+		if last_response:
+			print(last_response)
+		else:
+			logging.warning('No previous response found in context.')
+		return None
+
+	deferred = queue if queue is not None else WorkQueue()
 	context_json = ''
 
 	if context_file.exists():
@@ -69,53 +232,110 @@ def execute_command(context_file: Path, command: Namespace, prompts: list[str],
 	if command.log:
 		if command.parse:
 			native_context = it.model.prepare_context(context)  # type: ignore[attr-defined]
-			print(json.dumps(native_context, indent=2))
+			print(json.dumps(native_context, indent=2, default=repr))
 		else:
-			print(context.to_json())
-
-	elif len(prompts) > 0:
-		def debug_print_response(role: Role, part: Part) -> None:
-			role_str = {
-				Role.SYSTEM: 'SYSTEM',
-				Role.USER: 'USER',
-				Role.MODEL: 'MODEL',
-				Role.TOOL: 'TOOL'
-			}.get(role, 'UNKNOWN')
-
-			if isinstance(part, Message):
-				print(f'[{role_str}] {part.text}')
-			elif isinstance(part, Request):
-				print(f"[{role_str}:{part.id}] {part.name}({', '.join(part.arguments)})")
-			elif isinstance(part, Result):
-				print(f"[{role_str}:{part.id}] {part.name} => {part.result}")
-			else:
-				logging.warning(f'Unknown part type: {part}')
-				print(f'[{role_str}] {part}')
-
-		def print_response(role: Role, part: Part) -> None:
-			if role == Role.MODEL and isinstance(part, Message):
-				print(part.text)
-
-		context.add_text(Role.USER, prompts)
-		output = debug_print_response if logging.getLogger().isEnabledFor(logging.DEBUG) else print_response
-		context = it.execute(context, output, command.tools)
-
-	elif not command.reset:
-		# no input, return last response
-		last_response = context.get_last_response()
-		if last_response:
-			print(last_response)
+			print(context.to_json(indent=4))
+
+	elif command.stats:
+		print(summarize(context))
+
+	elif len(prompts) > 0 or command.attach:
+		turn_start = len(context)
+		attachments = [Attachment.store(path) for path in command.attach]
+		context.add_text(Role.USER, prompts, attachments)
+		output = response_printer()
+
+		# Near-duplicate prompts are answered locally; turns with attachments are never cached. The cached answers
+		# are those of the backend the question is routed to.
+		cache_key = None
+		hit = None
+		if cache is not None and not attachments:
+			it.select(context, command.tools)
+			system = [p.text for e in context if e.role == Role.SYSTEM for p in e.parts if isinstance(p, Message)]
+			# A follow-up question ("why?") means something else in another conversation
+			earlier = [[e.role.name, [str(p) for p in e.parts]] for e in context[:turn_start] if e.role != Role.SYSTEM]
+			cache_key = config_key(type(it.model).__name__, getattr(it.model, 'model', None), system, sorted(command.tools or []), earlier)
+			hit = cache.lookup(cache_key, '\n'.join(prompts))
+			metrics.count('q_cache_lookups_total', result='miss' if hit is None else 'hit')
+
+		if hit is not None:
+			answer = Entry(role=Role.MODEL, parts=[Message(text=hit.answer)], meta={'cached': True, 'similarity': round(hit.similarity, 3)})
+			context.append(answer)
+			output(answer.role, answer.parts[0])
 		else:
-			logging.warning('No previous response found in context.')
+			try:
+				context = it.execute(context, output, command.tools, Deadline(command.timeout))
+			except (KeyboardInterrupt, DeadlineExceeded):
+				# Keep the context as it was after the last completed turn
+				logging.info('Interrupted; discarding the incomplete turn.')
+				del context[turn_start:]
+				save_context(context_file, context)
+				raise
+
+			# Only plain text answers are reusable; tool calls may have side effects or random results
+			turn = context[turn_start:]
+			if cache is not None and cache_key is not None and not any(isinstance(p, Request) for e in turn for p in e.parts):
+				text = '\n'.join(p.text for e in turn if e.role == Role.MODEL for p in e.parts if isinstance(p, Message))
+				if text:
+					deferred.defer('cache update', cache.store, cache_key, '\n'.join(prompts), text)
+
+		if history is not None:
+			deferred.defer('history update', history.record, context_file.stem, context[turn_start:])
+
 	else:
 		logging.info('No prompt provided. Skipping inference.')
 
 	# Save the updated context
-	with open(context_file, 'w') as f:
-		f.write(context.to_json())
+	deferred.defer('context save', save_context, context_file, context)
+	if queue is None:
+		deferred.run()
+	return context
+
+
+def lock_path(context_file: Path, purpose: str = 'lock') -> Path:
+	'''Lock file guarding the context file; it can't be the context file itself, as that is replaced on every save.'''
+	return context_file.parent / f'.{context_file.name}.{purpose}'
+
+
+def save_context(context_file: Path, context: Context) -> None:
+	'''Write the context while holding its lock, so that a concurrent compaction can't overwrite the new turn.'''
+	with file_lock(lock_path(context_file)):
+		write_context(context_file, context)
+
+
+def append_context(context_file: Path, context: Context, start: int) -> None:
+	'''Add the entries of `context` from `start` on to the end of the saved context, without rewriting it.
+
+	The whole context is written instead if the file doesn't end with an entry in the one-entry-per-line layout.
+	'''
+	lines = ''.join(',\n' + Context.encode_line(entry) for entry in context[start:])
+	with file_lock(lock_path(context_file)):
+		try:
+			with open(context_file, 'rb+') as f:
+				f.seek(-3, os.SEEK_END)
+				if f.read(3) == b'}\n]':
+					f.seek(-2, os.SEEK_END)
+					f.write(lines.encode('utf-8') + b'\n]')
+					return
+		except (FileNotFoundError, OSError):
+			# Missing, or too short to hold an entry
+			pass
+		write_context(context_file, context)
+
+
+def write_context(context_file: Path, context: Context) -> None:
+	'''Write the context atomically, so that an interruption never leaves a half-written file behind; the caller holds the lock.'''
+	fd, tmp = tempfile.mkstemp(dir=context_file.parent, prefix=f'.{context_file.name}.')
+	try:
+		with os.fdopen(fd, 'w') as f:
+			f.write(context.to_json())
+		os.replace(tmp, context_file)
+	except BaseException:
+		os.unlink(tmp)
+		raise
+
 
 def parse_command_line():
-	import sys
 	import argparse
 
 	parser = argparse.ArgumentParser(description='Ask the LLM oracle.')
@@ -125,15 +345,48 @@ def parse_command_line():
 	parser.add_argument(
 		'-p', '--parse', action='store_true', help='When used with --log, outputs parsed context via backend prepare_context'
 	)
+	parser.add_argument(
+		'--stats', action='store_true', help='Summarize token usage and latency of the current context'
+	)
+	parser.add_argument(
+		'-s', '--search', metavar='TERMS', help='Search the history of all sessions (requires history to be enabled)'
+	)
 	parser.add_argument(
 		'-r', '--reset', action='store_true', help='Reset the context'
 	)
+	parser.add_argument(
+		'-i', '--interactive', action='store_true',
+		help='Ask questions in a loop, keeping the context, backend and connection in memory (see `/help`)'
+	)
 	parser.add_argument(
 		'-d', '--debug', action='store_true', help='Enable debug logging'
 	)
 	parser.add_argument(
 		'-t', '--tools', action='append', metavar='TOOL', help='Enable tools mode and specify tool(s) to use. Can be used multiple times.'
 	)
+	parser.add_argument(
+		'-f', '--file', action='append', metavar='PATH', default=[], help='Append the contents of a file to the prompt. Can be used multiple times.'
+	)
+	parser.add_argument(
+		'--timeout', type=float, metavar='SECONDS', help='Give up if the answer (including all tool rounds) takes longer than this'
+	)
+	parser.add_argument(
+		'-a', '--attach', action='append', metavar='PATH', default=[], help='Attach an image (PNG, JPEG or WebP) to the prompt. Can be used multiple times.'
+	)
+	parser.add_argument(
+		'--max-input', type=int, default=DEFAULT_MAX_BYTES, metavar='BYTES',
+		help=f'Maximum number of bytes kept from each piped or file input; the middle of larger inputs is omitted (default: {DEFAULT_MAX_BYTES}).'
+	)
+	parser.add_argument(
+		'--squeeze', action='store_true',
+		help='Collapse runs of repeated lines, and of lines that differ only in timestamps, numbers or IDs, in piped and file inputs'
+	)
+	parser.add_argument(
+		'--metrics', action='store_true', help='Print the metrics collected across invocations, in the Prometheus text format (requires metrics to be enabled)'
+	)
+	parser.add_argument(
+		'--compact', metavar='CONTEXT_FILE', help=argparse.SUPPRESS
+	)
 	parser.add_argument(
 		'inputs', nargs='*', help='Prompt input for the oracle.'
 	)
@@ -141,13 +394,31 @@ def parse_command_line():
 	args = parser.parse_args()
 	prompt = ' '.join(args.inputs)
 
+	# These print something instead of asking; -r and -a apply to the interactive session
+	if args.interactive and (args.log or args.stats or args.search):
+		parser.error('-i/--interactive can not be combined with -l/--log, --stats or -s/--search')
+	if args.max_input < 0:
+		parser.error('--max-input must be at least 0')
+
 	# Include additional input from stdin if available, to extend the prompt
+	squeeze = SqueezeStats() if args.squeeze else None
+
 	extra_prompt = ''
-	if not sys.stdin.isatty():
-		extra_prompt = str(sys.stdin.read()).strip()
+	if not sys.stdin.isatty() and not args.interactive:
+		extra_prompt = read_stream(sys.stdin.buffer, args.max_input, squeeze).strip()
+
+	file_prompts: list[str] = []
+	for path in args.file:
+		try:
+			file_prompts.append(read_file(path, args.max_input, squeeze).strip())
+		except OSError as e:
+			parser.error(f'{path}: {e.strerror}')
+
+	if squeeze is not None and squeeze.before:
+		print(squeeze, file=sys.stderr)
 
 	# Remove the empty prompts
-	prompts: list[str] = [p for p in [prompt, extra_prompt] if p]
+	prompts: list[str] = [p for p in [prompt, extra_prompt, *file_prompts] if p]
 
 	return args, prompts
 
@@ -163,8 +434,17 @@ def get_process_stime(pid: int) -> Optional[int]:
 		return None
 
 
+# Lock files that may be left next to a context file
+LOCK_PURPOSES = ('lock', 'compact')
+
+BLOB_REFERENCE = re.compile(r'"digest":\s*"([0-9a-f]{64})"')
+
+
 def collect_garbage():
 	temp_dir = tempfile.gettempdir()
+	# Digests referenced by the active contexts, or None if they could not all be read
+	referenced: set[str] | None = set()
+
 	for filename in os.listdir(temp_dir):
 		if not filename.startswith('q_context_') or not filename.endswith('.json'):
 			continue
@@ -182,13 +462,28 @@ def collect_garbage():
 				filepath = os.path.join(temp_dir, filename)
 				os.remove(filepath)
 				logging.info(f'Removed stale context file: {filename}')
+				for purpose in LOCK_PURPOSES:
+					lock = lock_path(Path(filepath), purpose)
+					if lock.exists():
+						lock.unlink()
 			else:
 				logging.debug(f'Found active context file: {filename}; skipping deletion.')
+				try:
+					with open(os.path.join(temp_dir, filename), 'r') as f:
+						references = BLOB_REFERENCE.findall(f.read())
+					if referenced is not None:
+						referenced.update(references)
+				except OSError as e:
+					logging.warning(f'Error reading file {filename}: {e}; skipping blob collection.')
+					referenced = None
 		except ValueError:
 			logging.warning(f'Skipping file with unexpected name format: {filename}')
 		except OSError as e:
 			logging.warning(f'Error removing file {filename}: {e}')
 
+	if referenced is not None:
+		blobs.collect(referenced)
+
 
 def lookup_secret(service_name: str, key_name: str):
 	command = [
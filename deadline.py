@@ -0,0 +1,30 @@
+import time
+
+from typing import Optional
+
+
+class DeadlineExceeded(TimeoutError):
+	pass
+
+
+class Deadline:
+	"""Time budget of a whole invocation; `None` seconds means no limit.
+
+	Each step asks for the remaining budget and passes it down as its own timeout.
+	"""
+
+	def __init__(self, seconds: Optional[float] = None):
+		self.expires = time.monotonic() + seconds if seconds is not None else None
+
+	def remaining(self, cap: Optional[float] = None) -> Optional[float]:
+		'''Seconds left (at most `cap`), or `cap` if there is no deadline. Raises DeadlineExceeded once expired.'''
+		if self.expires is None:
+			return cap
+
+		left = self.expires - time.monotonic()
+		if left <= 0:
+			raise DeadlineExceeded('Deadline exceeded')
+		return left if cap is None else min(left, cap)
+
+	def check(self) -> None:
+		self.remaining()
@@ -0,0 +1,55 @@
+import logging
+import os
+import sys
+
+from typing import Any, Callable, TextIO
+
+
+class WorkQueue:
+	"""Housekeeping that doesn't change the printed answer (saving, garbage collection, caches, history).
+
+	The queued work runs in order once the answer is out and stdout is closed, so that the next command of
+	a pipeline doesn't wait for it. It still runs before the process exits, so nothing is lost.
+	"""
+
+	def __init__(self):
+		self.tasks: list[tuple[str, Callable[..., Any], tuple[Any, ...]]] = []
+
+	def defer(self, name: str, task: Callable[..., Any], *args: Any) -> None:
+		self.tasks.append((name, task, args))
+
+	def run(self) -> bool:
+		'''Run every queued task, even if an earlier one failed; returns whether all of them succeeded.'''
+		ok = True
+		while self.tasks:
+			name, task, args = self.tasks.pop(0)
+			try:
+				task(*args)
+			except Exception:
+				logging.exception(f'Deferred {name} failed')
+				ok = False
+		return ok
+
+
+def close_stdout(stream: TextIO = sys.stdout) -> None:
+	'''Flush and close stdout, so that a reader at the other end of a pipe sees the end of the answer right away.
+
+	The file descriptor is pointed at /dev/null rather than closed, so that a late write can't fail or land in
+	an unrelated file that reuses the descriptor.
+	'''
+	try:
+		stream.flush()
+	except BrokenPipeError:
+		# The reader went away (e.g. `q ... | head -1`); the queued work must run regardless
+		pass
+
+	try:
+		fd = stream.fileno()
+	except (OSError, ValueError):
+		return
+
+	devnull = os.open(os.devnull, os.O_WRONLY)
+	try:
+		os.dup2(devnull, fd)
+	finally:
+		os.close(devnull)
@@ -1,24 +1,89 @@
 import logging
 import random
+import re
+from collections import Counter
+from typing import NamedTuple, Optional
 from tools import JsonValue, Tool, ToolDefinition
 
+
+class DiceGroup(NamedTuple):
+	expression: str
+	number: int
+	sides: int
+	# One of 'kh', 'kl', 'dh', 'dl' (keep/drop highest/lowest) with its count
+	select: Optional[tuple[str, int]] = None
+	modifier: int = 0
+	repeats: int = 1
+
+
+GROUP_PATTERN = re.compile(
+	r'^(?:(?P<prefix>\d+)\s*x\s*)?'
+	r'(?P<number>\d*)\s*d\s*(?P<sides>\d+)'
+	r'(?:\s*(?P<select>kh|kl|dh|dl|k|d)\s*(?P<count>\d+))?'
+	r'(?:\s*(?P<modifier>[+-]\s*\d+))?'
+	r'(?:\s*x\s*(?P<suffix>\d+))?$',
+	re.IGNORECASE
+)
+
+
+def parse_expression(expression: str) -> list[DiceGroup]:
+	"""Parse a comma-separated dice expression, e.g. `2d6, 2d8+1` or `4d6dl1x6`.
+
+	Raises ValueError if a group can't be parsed.
+	"""
+	groups: list[DiceGroup] = []
+	for text in expression.split(','):
+		text = text.strip()
+		match = GROUP_PATTERN.match(text)
+		if not match:
+			raise ValueError(f'Invalid dice expression: {text!r}')
+
+		select = None
+		if match['select']:
+			# A bare 'k' keeps the highest dice, a bare 'd' drops the lowest ones
+			kind = {'k': 'kh', 'd': 'dl'}.get(match['select'].lower(), match['select'].lower())
+			select = (kind, int(match['count']))
+
+		if match['prefix'] and match['suffix']:
+			raise ValueError(f'Repeat count given twice: {text!r}')
+
+		groups.append(DiceGroup(
+			expression=text,
+			number=int(match['number'] or 1),
+			sides=int(match['sides']),
+			select=select,
+			modifier=int(re.sub(r'\s', '', match['modifier'] or '0')),
+			repeats=int(match['prefix'] or match['suffix'] or 1)
+		))
+	return groups
+
+
 class DiceTool(Tool):
-	MAX_DICE = 64
+	MAX_DICE = 10000
 	MIN_DICE = 1
-	MAX_SIDES = 64
+	MAX_SIDES = 1000
 	MIN_SIDES = 2
+	MAX_REPEATS = 10000
+	# Upper bound on the dice drawn by a single expression, across all groups and repeats
+	MAX_TOTAL_DICE = 1000000
+	# Individual results are listed only up to this many values per group; larger groups are summarized
+	MAX_LISTED = 100
 
-	def execute(self, number: int = 1, sides: int = 6) -> JsonValue:
+	def execute(self, expression: Optional[str] = None, number: int = 1, sides: int = 6) -> JsonValue:
 		"""
-		Throw N dice with M sides each.
+		Throw N dice with M sides each, or evaluate a dice expression.
 
 		Args:
+			expression: Dice expression, e.g. "2d6, 2d8" or "4d6dl1x6" (overrides number and sides)
 			number: Number of dice to throw (default: 1)
 			sides: Number of sides per die (default: 6)
 
 		Returns:
 			Dictionary with the results
 		"""
+		if expression is not None:
+			return self.evaluate(expression)
+
 		logging.debug(f'Throwing {number}d{sides}')
 
 		if number < self.MIN_DICE or number > self.MAX_DICE:
@@ -27,7 +92,7 @@ class DiceTool(Tool):
 		if sides < self.MIN_SIDES or sides > self.MAX_SIDES:
 			return {'error': f'Number of sides must be between {self.MIN_SIDES} and {self.MAX_SIDES}'}
 
-		results = [random.randint(1, sides) for _ in range(number)]
+		results = random.choices(range(1, sides + 1), k=number)
 		total = sum(results)
 
 		logging.debug(f'Dice results: {results} (total: {total})')
@@ -39,13 +104,101 @@ class DiceTool(Tool):
 			'total': total
 		}
 
+	def evaluate(self, expression: str) -> JsonValue:
+		logging.debug(f'Evaluating dice expression: {expression}')
+
+		try:
+			groups = parse_expression(expression)
+		except ValueError as e:
+			return {'error': str(e)}
+
+		for group in groups:
+			error = self._validate(group)
+			if error:
+				return {'error': f'{group.expression}: {error}'}
+
+		if sum(g.number * g.repeats for g in groups) > self.MAX_TOTAL_DICE:
+			return {'error': f'Expression throws more than {self.MAX_TOTAL_DICE} dice'}
+
+		results = [self._roll(group) for group in groups]
+		return {
+			'expression': expression,
+			'groups': results,
+			'total': sum(int(r['total']) for r in results)  # type: ignore[arg-type]
+		}
+
+	def _validate(self, group: DiceGroup) -> Optional[str]:
+		if group.number < self.MIN_DICE or group.number > self.MAX_DICE:
+			return f'Number of dice must be between {self.MIN_DICE} and {self.MAX_DICE}'
+		if group.sides < self.MIN_SIDES or group.sides > self.MAX_SIDES:
+			return f'Number of sides must be between {self.MIN_SIDES} and {self.MAX_SIDES}'
+		if group.repeats < 1 or group.repeats > self.MAX_REPEATS:
+			return f'Number of repeats must be between 1 and {self.MAX_REPEATS}'
+		if group.select and not 0 <= group.select[1] <= group.number:
+			return f'Can\'t keep or drop {group.select[1]} of {group.number} dice'
+		return None
+
+	def _roll(self, group: DiceGroup) -> dict[str, JsonValue]:
+		# Draw every die of every repeat in a single batch, then split it into rolls
+		draws = random.choices(range(1, group.sides + 1), k=group.number * group.repeats)
+		rolls = [draws[i:i + group.number] for i in range(0, len(draws), group.number)]
+		kept = [self._select(roll, group.select) for roll in rolls]
+		totals = [sum(k) + group.modifier for k in kept]
+
+		result: dict[str, JsonValue] = {'expression': group.expression}
+
+		if len(draws) <= self.MAX_LISTED:
+			result['results'] = rolls if group.repeats > 1 else rolls[0]
+			if group.select:
+				result['kept'] = kept if group.repeats > 1 else kept[0]
+		else:
+			result['counts'] = {str(face): count for face, count in sorted(Counter(draws).items())}
+
+		if group.repeats > 1:
+			if group.repeats <= self.MAX_LISTED:
+				result['totals'] = totals
+			result['min'] = min(totals)
+			result['max'] = max(totals)
+			result['mean'] = round(sum(totals) / len(totals), 3)
+
+		result['total'] = sum(totals)
+
+		logging.debug(f'Dice results for {group.expression}: total {result["total"]}')
+		return result
+
+	@staticmethod
+	def _select(roll: list[int], select: Optional[tuple[str, int]]) -> list[int]:
+		if not select:
+			return roll
+
+		kind, count = select
+		ordered = sorted(roll)
+		return {
+			'kh': ordered[len(ordered) - count:],
+			'kl': ordered[:count],
+			'dh': ordered[:len(ordered) - count],
+			'dl': ordered[count:]
+		}[kind]
+
 	@staticmethod
 	def definition() -> ToolDefinition:
 		return ToolDefinition(
-			description='Throw N dice with M sides each. Returns the individual results and total sum.',
+			description=(
+				'Throw dice. Either pass "expression" to evaluate several groups in a single call, '
+				'or "number" and "sides" to throw N dice with M sides each. Returns the individual results and total sum.'
+			),
 			parameters={
 				'type': 'object',
 				'properties': {
+					'expression': {
+						'type': 'string',
+						'description': (
+							'Comma-separated dice groups, each "NdM" optionally followed by '
+							'"khK"/"klK" (keep K highest/lowest), "dhK"/"dlK" (drop K highest/lowest), '
+							'"+k"/"-k" (modifier) and "xR" (repeat R times). '
+							'Examples: "2d6, 2d8", "4d6dl1x6", "1d20+5", "10000x1d20".'
+						)
+					},
 					'number': {
 						'type': 'integer',
 						'description': f'Number of dice to throw ({DiceTool.MIN_DICE}-{DiceTool.MAX_DICE})',
@@ -64,3 +217,7 @@ class DiceTool(Tool):
 				'required': []
 			}
 		)
+
+
+# Tools provided by this module; see plugins.discover
+TOOLS = {'dice': DiceTool}
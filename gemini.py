@@ -1,10 +1,11 @@
 import logging
 
-from context import Context, Message, Part, Request, Result, Role, Entry
+from context import Attachment, Blob, Context, Message, Note, Part, Request, Result, Role, Entry
 from core import Fetch, fetch, lookup_secret
 from iteration import LLMBackend
+from payload import InlineData, payloads
 from tools import ToolDefinition
-from typing import Any, Callable, Mapping, Sequence
+from typing import Any, Callable, Mapping, Optional, Sequence
 
 
 # TODO 9: Define strict types for Gemini's JSON structures
@@ -15,7 +16,7 @@ class Gemini(LLMBackend[Any, Any]):
 		self.api_key = lookup_secret('gemini', 'api-key')
 		self.fetch = fetch
 
-	def generate_response(self, context: Any) -> Any:
+	def generate_response(self, context: Any, timeout: Optional[float] = None) -> Any:
 		url = f"https://generativelanguage.googleapis.com/v1beta/models/{self.model}:generateContent"
 
 		headers = {
@@ -23,46 +24,44 @@ class Gemini(LLMBackend[Any, Any]):
 			'x-goog-api-key': self.api_key
 		}
 
-		return self.fetch(url, context, headers)
+		return self.fetch(url, context, headers, timeout=timeout)
 
 	def prepare_context(self, context: Context, tools: Mapping[str, ToolDefinition] = {}) -> Any:
-		content: Mapping[str, Any] = {
-			"system_instruction": {
-				"parts": []
-			},
-			"contents": []
-		}
+		system_parts = [part for entry in context if entry.role == Role.SYSTEM for part in entry.parts]
 
-		system_prompt_extensions = []
-
-		if tools:
-			content['tools'] = {
-				'functionDeclarations': [
-					{
-						"name": name,
-						"description": definition.description,
-						"parameters": definition.parameters
-					}
-					for name, definition in tools.items()
-				]
+		def static() -> Mapping[str, Any]:
+			sections: dict[str, Any] = {
+				"system_instruction": {
+					"parts": [self._prepare_part(p) for p in system_parts]
+				}
 			}
 
-			system_prompt_extensions = [
-				{'text': definition.instructions}
-				for definition
-				in tools.values()
-				if definition.instructions
-			]
+			if tools:
+				sections['tools'] = {
+					'functionDeclarations': [
+						{
+							"name": name,
+							"description": definition.description,
+							"parameters": definition.parameters
+						}
+						for name, definition in tools.items()
+					]
+				}
+
+				sections['system_instruction']['parts'].extend(
+					{'text': definition.instructions}
+					for definition
+					in tools.values()
+					if definition.instructions
+				)
+
+			return sections
 
-		for entry in context:
-			if entry.role == Role.SYSTEM:
-				parts = [self._prepare_part(p) for p in entry.parts]
-				content['system_instruction']['parts'].extend(parts)
-				content['system_instruction']['parts'].extend(system_prompt_extensions)
-			else:
-				content['contents'].append(self._prepare_entry(entry))
+		# The system instruction and the tool declarations are built and serialized once per key
+		key = (type(self).__name__, self.model, tuple(tools), tuple(repr(p) for p in system_parts))
+		contents = [self._prepare_entry(entry) for entry in context if entry.role != Role.SYSTEM]
 
-		return content
+		return payloads.payload(key, static, "contents", contents)
 
 	def _prepare_entry(self, entry: Entry) -> Any:
 		role = {
@@ -78,10 +77,17 @@ class Gemini(LLMBackend[Any, Any]):
 		}
 
 	def _prepare_part(self, part: Part) -> Any:
-		if isinstance(part, Message):
+		if isinstance(part, (Message, Blob, Note)):
 			return {
 				"text": part.text
 			}
+		elif isinstance(part, Attachment):
+			return {
+				"inline_data": {
+					"mime_type": part.type.value,
+					"data": InlineData(part.file)
+				}
+			}
 		elif isinstance(part, Request):
 			return {
 				"functionCall": {
@@ -120,10 +126,20 @@ class Gemini(LLMBackend[Any, Any]):
 
 		parts = [self._parse_part(p) for p in content.get("parts", [])]
 
+		meta: dict[str, Any] = {}
+		usage = result.get("usageMetadata")
+		if usage:
+			meta['usage'] = {
+				'prompt_tokens': usage.get("promptTokenCount", 0),
+				'output_tokens': usage.get("candidatesTokenCount", 0),
+				'total_tokens': usage.get("totalTokenCount", 0)
+			}
+
 		return [
 			Entry(
 				role=role,
-				parts=parts
+				parts=parts,
+				meta=meta
 			)
 		]
 
@@ -0,0 +1,111 @@
+import logging
+import sqlite3
+import time
+
+from context import Blob, Entry, Message, Result, Role
+from pathlib import Path
+from typing import Iterable, NamedTuple, Sequence
+
+
+# Upper bound on the characters of a prompt or an answer that are stored and indexed
+MAX_INDEXED = 64 * 1024
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS turns (
+	id INTEGER PRIMARY KEY,
+	session TEXT NOT NULL,
+	created REAL NOT NULL,
+	prompt TEXT NOT NULL,
+	answer TEXT NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS turns_fts USING fts5(
+	prompt, answer, content='turns', content_rowid='id'
+);
+'''
+
+
+class Hit(NamedTuple):
+	session: str
+	created: float
+	prompt: str
+	answer: str
+
+
+class History:
+	"""Persistent history of all turns across shell sessions, with a full-text index over prompts and answers."""
+
+	def __init__(self, path: Path):
+		'''Raises sqlite3.OperationalError if SQLite is built without FTS5, which the index needs.'''
+		path.parent.mkdir(parents=True, exist_ok=True)
+		self.connection = sqlite3.connect(path, timeout=5.0)
+		try:
+			# WAL lets concurrent q processes write while others search
+			self.connection.execute('PRAGMA journal_mode=WAL')
+			self.connection.executescript(SCHEMA)
+		except sqlite3.OperationalError:
+			self.connection.close()
+			raise
+
+	def close(self) -> None:
+		self.connection.close()
+
+	def record(self, session: str, entries: Sequence[Entry]) -> None:
+		'''Store one turn: the user prompt(s) and the model's answer(s) among `entries`, in a single transaction.'''
+		prompt = _text(e for e in entries if e.role == Role.USER)
+		answer = _text(e for e in entries if e.role in (Role.MODEL, Role.TOOL))
+		if not prompt and not answer:
+			return
+
+		with self.connection:
+			cursor = self.connection.execute(
+				'INSERT INTO turns (session, created, prompt, answer) VALUES (?, ?, ?, ?)',
+				(session, time.time(), prompt, answer)
+			)
+			self.connection.execute(
+				'INSERT INTO turns_fts (rowid, prompt, answer) VALUES (?, ?, ?)',
+				(cursor.lastrowid, prompt, answer)
+			)
+		logging.debug(f'Recorded turn {cursor.lastrowid} of session {session} in the history')
+
+	def search(self, terms: str, limit: int = 10) -> list[Hit]:
+		'''Best matches first; every term must appear in the prompt or the answer.'''
+		query = ' '.join('"' + term.replace('"', '""') + '"' for term in terms.split())
+		if not query:
+			return []
+
+		rows = self.connection.execute(
+			'''
+			SELECT turns.session, turns.created, turns.prompt, turns.answer
+			FROM turns_fts JOIN turns ON turns.id = turns_fts.rowid
+			WHERE turns_fts MATCH ?
+			ORDER BY bm25(turns_fts)
+			LIMIT ?
+			''',
+			(query, limit)
+		)
+		return [Hit(*row) for row in rows]
+
+
+def _text(entries: Iterable[Entry]) -> str:
+	texts: list[str] = []
+	for entry in entries:
+		for part in entry.parts:
+			if isinstance(part, (Message, Blob)):
+				texts.append(part.text[:MAX_INDEXED])
+			elif isinstance(part, Result):
+				texts.append(str(part.result)[:MAX_INDEXED])
+	return '\n'.join(texts)[:MAX_INDEXED]
+
+
+def format_hits(hits: Sequence[Hit], width: int = 100) -> str:
+	lines: list[str] = []
+	for hit in hits:
+		created = time.strftime('%Y-%m-%d %H:%M', time.localtime(hit.created))
+		lines.append(f'[{created}] {_shorten(hit.prompt, width)}')
+		lines.append(f'  => {_shorten(hit.answer, width)}')
+	return '\n'.join(lines)
+
+
+def _shorten(text: str, width: int) -> str:
+	text = ' '.join(text.split())
+	return text if len(text) <= width else text[:width - 3] + '...'
@@ -0,0 +1,114 @@
+import logging
+import mmap
+import os
+
+from pathlib import Path
+from squeeze import LineSqueezer, SqueezeStats
+from typing import BinaryIO, Optional
+
+
+DEFAULT_MAX_BYTES = 256 * 1024
+CHUNK_SIZE = 64 * 1024
+
+
+class HeadTailBuffer:
+	"""Keep the first `head` and the last `tail` bytes written, counting everything dropped in between.
+
+	Memory use is bounded by roughly `head + 2 * tail` bytes regardless of how much is written.
+	"""
+
+	def __init__(self, head: int, tail: int):
+		self.head_size = head
+		self.tail_size = tail
+		self.head = bytearray()
+		self.tail = bytearray()
+		self.total = 0
+
+	@property
+	def dropped(self) -> int:
+		return self.total - len(self.head) - min(len(self.tail), self.tail_size)
+
+	def write(self, data: bytes) -> None:
+		self.total += len(data)
+
+		missing = self.head_size - len(self.head)
+		if missing > 0:
+			self.head += data[:missing]
+			data = data[missing:]
+
+		if not data or self.tail_size <= 0:
+			return
+
+		self.tail += data
+		# Trim lazily, so that the amortized cost of a write stays proportional to its size
+		if len(self.tail) > 2 * self.tail_size:
+			del self.tail[:-self.tail_size]
+
+	def getvalue(self) -> bytes:
+		tail = self.tail[-self.tail_size:] if self.tail_size > 0 else b''
+		return bytes(self.head + tail)
+
+	def text(self, encoding: str = 'utf-8') -> str:
+		head = self.head.decode(encoding, errors='replace')
+		tail = bytes(self.tail[-self.tail_size:]).decode(encoding, errors='replace') if self.tail_size > 0 else ''
+		if self.dropped > 0:
+			return head + elision(self.dropped) + tail
+		return head + tail
+
+
+def elision(dropped: int) -> str:
+	return f'\n[... {dropped} bytes omitted ...]\n'
+
+
+def read_stream(stream: BinaryIO, limit: int = DEFAULT_MAX_BYTES, squeeze: Optional[SqueezeStats] = None) -> str:
+	"""Read a binary stream in chunks, keeping at most `limit` bytes split between its head and tail.
+
+	With `squeeze`, runs of repeated or similar lines are collapsed before the limit applies, and the
+	reduction is added to the given stats.
+	"""
+	head = limit // 2
+	buffer = HeadTailBuffer(head, limit - head)
+
+	if squeeze is not None:
+		squeezer = LineSqueezer(buffer.write, squeeze)
+		while chunk := stream.read(CHUNK_SIZE):
+			squeezer.write(chunk)
+		squeezer.close()
+	else:
+		while chunk := stream.read(CHUNK_SIZE):
+			buffer.write(chunk)
+
+	if buffer.dropped > 0:
+		logging.info(f'Input truncated: kept {buffer.total - buffer.dropped} of {buffer.total} bytes')
+
+	return buffer.text()
+
+
+def read_file(path: str | os.PathLike[str], limit: int = DEFAULT_MAX_BYTES, squeeze: Optional[SqueezeStats] = None) -> str:
+	"""Read a file through `mmap`, so that only the sampled head and tail are ever paged in.
+
+	Squeezing needs to see every line, so with `squeeze` the file is streamed instead.
+	"""
+	with open(Path(path), 'rb') as f:
+		if squeeze is not None:
+			return read_stream(f, limit, squeeze)
+
+		size = os.fstat(f.fileno()).st_size
+		if size == 0:
+			# Empty files can't be mapped; fall back to streaming (e.g. for /proc or pipes)
+			return read_stream(f, limit)
+
+		with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+			if size <= limit:
+				return mm[:].decode('utf-8', errors='replace')
+
+			head = limit // 2
+			tail = limit - head
+			dropped = size - head - tail
+			logging.info(f'File {path} truncated: kept {limit} of {size} bytes')
+
+			return (
+				mm[:head].decode('utf-8', errors='replace')
+				+ elision(dropped)
+				+ mm[size - tail:].decode('utf-8', errors='replace')
+			)
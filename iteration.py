@@ -1,8 +1,16 @@
 from abc import ABC, abstractmethod
+import asyncio
+import dataclasses
+import inspect
 import logging
-from context import Context, Entry, Part, Request, Result, Role
-from tools import ToolDefinition, ToolRegistry
-from typing import Callable, Generic, Mapping, Sequence, TypeVar
+import time
+from context import Context, Entry, Part, Request, Result, Role, ToolProgress
+from deadline import Deadline, DeadlineExceeded
+from metrics import metrics
+from ratelimit import RateLimiter, estimate_tokens
+from results import READ_RESULT, ResultPolicy, has_stored
+from tools import JsonValue, Progress, ToolDefinition, ToolRegistry
+from typing import Any, AsyncGenerator, Callable, Generator, Generic, Mapping, NamedTuple, Optional, Sequence, TypeVar
 
 
 TResult = TypeVar('TResult')
@@ -11,7 +19,7 @@ TContext = TypeVar('TContext')
 
 class LLMBackend(ABC, Generic[TResult, TContext]):
 	@abstractmethod
-	def generate_response(self, context: TContext) -> TResult:
+	def generate_response(self, context: TContext, timeout: Optional[float] = None) -> TResult:
 		raise NotImplementedError()
 
 	@abstractmethod
@@ -23,12 +31,60 @@ class LLMBackend(ABC, Generic[TResult, TContext]):
 		raise NotImplementedError()
 
 
+class Route(NamedTuple):
+	'''The backend picked for a question; see `router.Router`.'''
+	name: str
+	model: LLMBackend[Any, Any]
+	limiter: Optional[RateLimiter] = None
+
+
 class Iteration(Generic[TResult, TContext]):
-	def __init__(self, model: LLMBackend[TResult, TContext], tool_registry: ToolRegistry):
+	def __init__(
+		self,
+		model: LLMBackend[TResult, TContext],
+		tool_registry: ToolRegistry,
+		limiter: Optional[RateLimiter] = None,
+		results: Optional[ResultPolicy] = None,
+		router: Optional[Callable[[Context, Sequence[str]], Route]] = None
+	):
 		self.model = model
 		self.tool_registry = tool_registry
+		self.limiter = limiter
+		self.results = results or ResultPolicy()
+		self.router = router
+		# Name of the route of the current question, recorded in the meta of the model's entries
+		self.route: Optional[str] = None
+		# The question the route was picked for
+		self.routed: Optional[Entry] = None
+
+	def select(self, context: Context, tools: Sequence[str] | None) -> None:
+		'''Pick the backend of the question at the end of the context, unless it was picked already.
+
+		`execute` does this itself; callers that need the backend of a question first (e.g. to key a
+		cache on its model) can call it before.
+		'''
+		if self.router is None or not context or context[-1].role != Role.USER or context[-1] is self.routed:
+			return
+
+		route = self.router(context, tools or [])
+		self.model, self.limiter, self.route = route.model, route.limiter, route.name
+		self.routed = context[-1]
+		metrics.count('q_routes_total', route=route.name)
+
+	def execute(
+		self,
+		context: Context,
+		output: Callable[[Role, Part], None],
+		tools: Sequence[str] | None,
+		deadline: Optional[Deadline] = None
+	) -> Context:
+		'''Run the model (and the tools it requests) until it answers.
+
+		The context only ever grows by complete rounds: the model's entries are added together with the
+		results of the tools they request, so an interrupted round leaves the context as it was before it.
+		'''
+		deadline = deadline or Deadline()
 
-	def execute(self, context: Context, output: Callable[[Role, Part], None], tools: Sequence[str] | None) -> Context:
 		# Convert the context to the format required by the model:
 		def check_tool(tool_name: str) -> bool:
 			found = tool_name in self.tool_registry
@@ -36,22 +92,74 @@ class Iteration(Generic[TResult, TContext]):
 				logging.warning(f"Tool not found: {tool_name}")
 			return found
 
+		# Each question goes to the backend picked by the router; the tool rounds that follow stay with it
+		self.select(context, tools)
+
+		# Large results in the context are shown in part; the model gets the (read-only) tool to read the rest
+		tools = list(tools or [])
+		if READ_RESULT not in tools and READ_RESULT in self.tool_registry and has_stored(context):
+			tools.append(READ_RESULT)
+
 		tool_definitions = {
 			tool: self.tool_registry[tool].definition()
-			for tool in tools or []
+			for tool in tools
 			if check_tool(tool)
 		}
 
+		started = time.perf_counter()
 		prompt = self.model.prepare_context(context, tool_definitions)
 
 		# Generate the response from the model:
-		result = self.model.generate_response(prompt)
+		backend = type(self.model).__name__
+		model = getattr(self.model, 'model', backend)
+
+		# Wait for room within the provider's quota, shared with the other q processes
+		estimated = 0
+		if self.limiter is not None:
+			estimated = estimate_tokens(context)
+			waited = self.limiter.acquire(estimated, deadline)
+			metrics.observe('q_rate_limit_wait_seconds', waited, backend=backend)
+
+		requested = time.perf_counter()
+		try:
+			result = self.model.generate_response(prompt, timeout=deadline.remaining())
+		except Exception as e:
+			# HTTP errors carry their status code; anything else is counted by its type
+			metrics.count('q_backend_requests_total', backend=backend, model=model, status=str(getattr(e, 'code', None) or type(e).__name__))
+			raise
+		responded = time.perf_counter()
+		metrics.count('q_backend_requests_total', backend=backend, model=model, status='ok')
+		metrics.observe('q_backend_request_seconds', responded - requested, backend=backend, model=model)
 
 		# Extract the response from the result:
-		entries = self.model.parse_result(result)
+		entries = [
+			dataclasses.replace(entry, meta={
+				**entry.meta,
+				'model': model,
+				**({'route': self.route} if self.route is not None else {}),
+				'timings': {
+					'prepare_seconds': round(requested - started, 6),
+					'response_seconds': round(responded - requested, 6)
+				}
+			})
+			for entry in self.model.parse_result(result)
+		]
 
-		# Update the context with the new parts:
-		context.extend(entries)
+		used = 0
+		for entry in entries:
+			for kind in ('prompt', 'output'):
+				tokens = entry.meta.get('usage', {}).get(f'{kind}_tokens')
+				if tokens:
+					metrics.count('q_tokens_total', tokens, backend=backend, model=model, kind=kind)
+					used += tokens
+
+		if self.limiter is not None and used:
+			self.limiter.settle(estimated, used)
+
+		# Show the model's entries first, so that the progress of the tools follows the requests
+		for entry in entries:
+			for part in entry.parts:
+				output(entry.role, part)
 
 		# Run the tools requested by the model:
 		requests = [
@@ -65,15 +173,14 @@ class Iteration(Generic[TResult, TContext]):
 			Result(
 				id=request.id,
 				name=request.name,
-				result=self.tool_registry[request.name]().execute(**request.arguments)
+				result=self.results.apply(request.name, self._run_tool(request, deadline, output))
 			)
 			for request in requests
 			if check_tool(request.name)
 		]
 
-		for entry in entries:
-			for part in entry.parts:
-				output(entry.role, part)
+		# Update the context with the new parts:
+		context.extend(entries)
 
 		if results:
 			context.add_results(results)
@@ -83,6 +190,77 @@ class Iteration(Generic[TResult, TContext]):
 
 			# TODO 12: Prevent infinite recursion here. Only recurse if new requests are present, or limit recursion depth.
 			# TODO 13: Currently, just one tool round is requested and executed. Find a way to combine tool calls in multiple steps.
-			self.execute(context, output, tools)
+			self.execute(context, output, tools, deadline)
 
 		return context
+
+	def _run_tool(self, request: Request, deadline: Deadline, output: Callable[[Role, Part], None]) -> JsonValue:
+		started = time.perf_counter()
+		status = 'error'
+		try:
+			value = self._call_tool(request, deadline, output)
+			status = 'ok'
+			return value
+		except DeadlineExceeded:
+			status = 'timeout'
+			raise
+		except KeyboardInterrupt:
+			status = 'interrupted'
+			raise
+		finally:
+			metrics.count('q_tool_calls_total', tool=request.name, status=status)
+			metrics.observe('q_tool_seconds', time.perf_counter() - started, tool=request.name)
+
+	def _call_tool(self, request: Request, deadline: Deadline, output: Callable[[Role, Part], None]) -> JsonValue:
+		tool = self.tool_registry[request.name]()
+		tool.timeout = deadline.remaining(tool.timeout)
+		value = tool.execute(**request.arguments)
+
+		def report(progress: Progress) -> None:
+			output(Role.TOOL, ToolProgress(id=request.id, name=request.name, text=progress.text))
+
+		if inspect.isgenerator(value):
+			return _drain(value, deadline, report)
+		if inspect.isasyncgen(value):
+			return asyncio.run(_drain_async(value, deadline, report))
+		return value
+
+
+def _drain(stream: Generator[Any, None, Any], deadline: Deadline, report: Callable[[Progress], None]) -> JsonValue:
+	'''Run a generator tool to its end; it is closed if the deadline expires between two items, or on Ctrl-C.'''
+	result: JsonValue = None
+	try:
+		while True:
+			try:
+				item = next(stream)
+			except StopIteration as stop:
+				return stop.value if stop.value is not None else result
+
+			if isinstance(item, Progress):
+				report(item)
+			else:
+				result = item
+			deadline.check()
+	finally:
+		stream.close()
+
+
+async def _drain_async(stream: AsyncGenerator[Any, None], deadline: Deadline, report: Callable[[Progress], None]) -> JsonValue:
+	'''Run an async generator tool to its end; it is cancelled when the deadline expires, or on Ctrl-C.'''
+	result: JsonValue = None
+	scope = asyncio.timeout(deadline.remaining())
+	try:
+		async with scope:
+			async for item in stream:
+				if isinstance(item, Progress):
+					report(item)
+				else:
+					result = item
+		return result
+	except TimeoutError:
+		# Not a timeout of the tool's own
+		if scope.expired():
+			raise DeadlineExceeded('The tool did not finish before the deadline')
+		raise
+	finally:
+		await stream.aclose()
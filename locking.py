@@ -0,0 +1,25 @@
+import fcntl
+import os
+
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+
+@contextmanager
+def file_lock(path: Path, blocking: bool = True) -> Iterator[bool]:
+	'''Hold an exclusive advisory lock on `path`, creating the file if needed.
+
+	Yields whether the lock was acquired, which can only be False when `blocking` is off and another
+	process holds it. The lock is released when the block exits, or when the process dies.
+	'''
+	fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+	try:
+		try:
+			fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+		except BlockingIOError:
+			yield False
+			return
+		yield True
+	finally:
+		os.close(fd)
@@ -2,19 +2,73 @@
 
 import logging
 import os
+import sqlite3
+import sys
 import tempfile
 
-from core import collect_garbage, get_process_stime, parse_command_line, execute_command
+from compaction import DEFAULT_AFTER, DEFAULT_KEEP, DEFAULT_TIMEOUT, compact, needs_compaction, spawn
+from config import CACHE_DIR, DATA_DIR, load_config
+from context import Attachment
+from core import collect_garbage, get_process_stime, lookup_secret, parse_command_line, execute_command
+from deadline import DeadlineExceeded
+from deferred import WorkQueue, close_stdout
 from gemini import Gemini
-from iteration import Iteration
+from history import History
+from iteration import Iteration, LLMBackend, Route
+from metrics import metrics, render
 from nvidia import NvidiaNim
+from openai_compat import OpenAICompatible
 from pathlib import Path
+from plugins import TOOLS_DIR, discover
+from ratelimit import RateLimiter, bucket_file
+from repl import Repl
+from router import Router, parse_rules
+from results import DEFAULT_THRESHOLD as DEFAULT_RESULT_THRESHOLD, ResultPolicy
+from similarity import DEFAULT_THRESHOLD, SimilarityCache
 from tools import tools
-from dice import DiceTool
-from console import ConsoleCommandTool
+from typing import Any, Mapping, Optional
 
 
-model = 'gemini'
+BACKEND_TYPES = ('gemini', 'nvidia', 'openai')
+
+
+def make_backend(backend: Mapping[str, Any]) -> LLMBackend[Any, Any]:
+	kind = backend.get('type', 'gemini')
+
+	if kind == 'gemini':
+		return Gemini(backend.get('model', 'gemini-2.0-flash'))
+
+	if kind == 'nvidia':
+		return NvidiaNim(backend.get('model', 'meta/llama-4-maverick-17b-128e-instruct'))
+
+	if kind == 'openai':
+		api_key = backend.get('api_key')
+		if 'api_key_secret' in backend:
+			service, key = backend['api_key_secret']
+			api_key = lookup_secret(service, key)
+
+		return OpenAICompatible(
+			backend['model'],
+			base_url=backend.get('base_url', 'http://localhost:8080/v1'),
+			api_key=api_key,
+			sampling=backend.get('sampling', {}),
+			stream=backend.get('stream', False)
+		)
+
+	raise ValueError(f'Unknown backend type: {kind}')
+
+
+def make_limiter(backend: Mapping[str, Any], llm: LLMBackend[Any, Any]) -> Optional[RateLimiter]:
+	'''The provider's quota is shared by all the q processes using the same backend and API key.'''
+	rate_limit = backend.get('rate_limit')
+	if not rate_limit:
+		return None
+	return RateLimiter(bucket_file(llm), rate_limit.get('requests_per_minute'), rate_limit.get('tokens_per_minute'))
+
+
+def make_route(backend: Mapping[str, Any]) -> tuple[LLMBackend[Any, Any], Optional[RateLimiter]]:
+	llm = make_backend(backend)
+	return llm, make_limiter(backend, llm)
 
 
 def main():
@@ -23,11 +77,38 @@ def main():
 	log_level = logging.DEBUG if command.debug else logging.WARNING
 	logging.basicConfig(level=log_level)
 
-	collect_garbage()
+	config = load_config()
+
+	metrics_config = config.get('metrics', {})
+	metrics_path = Path(metrics_config.get('path', DATA_DIR / 'metrics.json')).expanduser()
+
+	if command.metrics:
+		sys.stdout.write(render(metrics_path))
+		return
+
+	# Register tools; their modules are imported when they are called
+	directories = [TOOLS_DIR, *(Path(d) for d in config.get('tools', {}).get('directories', []))]
+	discover(tools, directories)
+
+	if config.get('console', {}).get('persistent'):
+		from console import ConsoleCommandTool, ShellWorker
+		ConsoleCommandTool.worker = ShellWorker(config['console'].get('shell', '/bin/sh'))
 
-	# Register tools
-	tools.register('dice', DiceTool)
-	tools.register('console', ConsoleCommandTool)
+	backend_config = config.get('backend', {})
+	llm, limiter = make_route(backend_config)
+
+	compaction_config = config.get('compaction', {})
+
+	if command.compact:
+		# Detached worker started by a previous call; see `spawn`
+		compact(
+			Path(command.compact),
+			llm,
+			compaction_config.get('keep', DEFAULT_KEEP),
+			compaction_config.get('timeout', DEFAULT_TIMEOUT),
+			limiter
+		)
+		return
 
 	ppid = os.getppid()
 	stime = get_process_stime(ppid)
@@ -38,13 +119,84 @@ def main():
 	temp_dir = Path(tempfile.gettempdir())
 	context_file = temp_dir / f"q_context_{ppid}_{stime}.json"
 
-	gemini = Gemini("gemini-2.0-flash")
-	nvidia = NvidiaNim("meta/llama-4-maverick-17b-128e-instruct")
-
-	llm = nvidia if model == 'nvidia' else gemini
-	it = Iteration(llm, tools)
-
-	execute_command(context_file, command, prompts, it)
+	results_config = config.get('results', {})
+	results = ResultPolicy(results_config.get('threshold', DEFAULT_RESULT_THRESHOLD), results_config.get('tools', {}))
+
+	# Questions that match a rule go to its backend, the others to the configured one
+	router = None
+	if config.get('routes'):
+		router = Router(parse_rules(config['routes'], backend_config, BACKEND_TYPES), Route('default', llm, limiter), make_route)
+
+	it = Iteration(llm, tools, limiter, results, router)
+
+	history_config = config.get('history', {})
+	history = None
+	if history_config.get('enabled'):
+		try:
+			history = History(Path(history_config.get('path', DATA_DIR / 'history.sqlite3')).expanduser())
+		except sqlite3.OperationalError as e:
+			logging.error(f'The history is unavailable, as SQLite has no full-text search (FTS5): {e}')
+
+	cache_config = config.get('cache', {})
+	cache = None
+	if cache_config.get('enabled'):
+		cache = SimilarityCache(
+			Path(cache_config.get('path', CACHE_DIR / 'similarity.sqlite3')).expanduser(),
+			cache_config.get('threshold', DEFAULT_THRESHOLD)
+		)
+
+	# Housekeeping runs once the answer is printed
+	queue = WorkQueue()
+	queue.defer('garbage collection', collect_garbage)
+
+	def record(outcome: str) -> None:
+		'''Count the invocation, if it ran the model; failed ones write their metrics right away, as they exit early.'''
+		if not metrics_config.get('enabled'):
+			return
+		if prompts or command.interactive:
+			metrics.count('q_invocations_total', outcome=outcome)
+		if outcome == 'ok':
+			queue.defer('metrics update', metrics.flush, metrics_path)
+		else:
+			try:
+				metrics.flush(metrics_path)
+			except Exception:
+				logging.exception('Could not update the metrics')
+
+	# The housekeeping also runs on the way out of a failed call (e.g. after a timeout), keeping its exit status
+	try:
+		try:
+			if command.interactive:
+				attachments = [Attachment.store(path) for path in command.attach]
+				repl = Repl(context_file, it, command.tools, command.timeout, history, command.max_input, attachments=attachments)
+				context = repl.run(prompts, reset=command.reset)
+			else:
+				context = execute_command(context_file, command, prompts, it, history, cache, queue)
+		except DeadlineExceeded as e:
+			logging.error(f'{e} (--timeout {command.timeout:g}s)' if command.timeout else str(e))
+			record('timeout')
+			sys.exit(124)
+		except KeyboardInterrupt:
+			record('interrupted')
+			sys.exit(130)
+		except Exception:
+			# Fetch errors, and any other failure (a malformed response, a failing tool, ...)
+			record('error')
+			raise
+
+		record('ok')
+
+		# Summarize the old turns in the background, so that the next call sends a smaller context
+		if compaction_config.get('enabled') and (prompts or command.interactive) and context is not None:
+			if needs_compaction(context, compaction_config.get('after', DEFAULT_AFTER)):
+				queue.defer('compaction', spawn, context_file)
+
+		close_stdout()
+	finally:
+		completed = queue.run()
+
+	if not completed:
+		sys.exit(1)
 
 
 if __name__ == "__main__":
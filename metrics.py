@@ -0,0 +1,156 @@
+import bisect
+import json
+import logging
+import os
+import tempfile
+
+from locking import file_lock
+from pathlib import Path
+from typing import Any
+
+
+# Upper bounds of the histogram buckets, in seconds
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+DEFINITIONS = {
+	'q_invocations_total': ('counter', 'Invocations of q that ran the model, by outcome.'),
+	'q_routes_total': ('counter', 'Questions sent to each route of the router.'),
+	'q_backend_requests_total': ('counter', 'Requests to the LLM backend, by status (ok, HTTP status code or error type).'),
+	'q_backend_request_seconds': ('histogram', 'Latency of the successful requests to the LLM backend.'),
+	'q_rate_limit_wait_seconds': ('histogram', 'Time spent waiting for the rate limit before the requests to the LLM backend.'),
+	'q_tokens_total': ('counter', 'Tokens reported by the LLM backend, by kind.'),
+	'q_tool_calls_total': ('counter', 'Tool calls, by tool and status.'),
+	'q_tool_seconds': ('histogram', 'Duration of the tool calls.'),
+	'q_cache_lookups_total': ('counter', 'Similarity cache lookups, by result.'),
+}
+
+
+class Metrics:
+	"""Counters and histograms recorded during one invocation, merged into a shared file by `flush`.
+
+	Recording is cheap and always on; nothing is written unless metrics are enabled.
+	"""
+
+	def __init__(self):
+		# Series are keyed by metric name and label set (a JSON object with sorted keys)
+		self.counters: dict[str, dict[str, float]] = {}
+		self.histograms: dict[str, dict[str, dict[str, Any]]] = {}
+
+	def count(self, name: str, value: float = 1.0, **labels: str) -> None:
+		series = self.counters.setdefault(name, {})
+		key = _labels(labels)
+		series[key] = series.get(key, 0.0) + value
+
+	def observe(self, name: str, value: float, **labels: str) -> None:
+		series = self.histograms.setdefault(name, {})
+		histogram = series.setdefault(_labels(labels), _histogram())
+		histogram['buckets'][bisect.bisect_left(BUCKETS, value)] += 1
+		histogram['sum'] += value
+		histogram['count'] += 1
+
+	def flush(self, path: Path) -> None:
+		'''Add the recorded values to the metrics file, holding its lock so that concurrent invocations don't lose updates.'''
+		if not self.counters and not self.histograms:
+			return
+
+		path.parent.mkdir(parents=True, exist_ok=True)
+		with file_lock(path.parent / f'.{path.name}.lock'):
+			stored = load(path)
+
+			counters = stored.setdefault('counters', {})
+			for name, series in self.counters.items():
+				target = counters.setdefault(name, {})
+				for key, value in series.items():
+					target[key] = target.get(key, 0.0) + value
+
+			histograms = stored.setdefault('histograms', {})
+			for name, series in self.histograms.items():
+				target = histograms.setdefault(name, {})
+				for key, histogram in series.items():
+					existing = target.get(key)
+					if existing is None or len(existing['buckets']) != len(histogram['buckets']):
+						# New series, or one recorded with other bucket bounds
+						target[key] = histogram
+						continue
+					existing['buckets'] = [a + b for a, b in zip(existing['buckets'], histogram['buckets'])]
+					existing['sum'] += histogram['sum']
+					existing['count'] += histogram['count']
+
+			fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f'.{path.name}.')
+			try:
+				with os.fdopen(fd, 'w') as f:
+					json.dump(stored, f)
+				os.replace(tmp, path)
+			except BaseException:
+				os.unlink(tmp)
+				raise
+
+		self.counters.clear()
+		self.histograms.clear()
+
+
+def load(path: Path) -> dict[str, Any]:
+	try:
+		with open(path, 'r') as f:
+			return json.load(f)
+	except FileNotFoundError:
+		return {}
+	except ValueError as e:
+		logging.warning(f'Ignoring corrupt metrics file {path}: {e}')
+		return {}
+
+
+def render(path: Path) -> str:
+	'''The stored metrics in the Prometheus text exposition format.'''
+	stored = load(path)
+	counters = stored.get('counters', {})
+	histograms = stored.get('histograms', {})
+	lines: list[str] = []
+
+	for name, (kind, description) in DEFINITIONS.items():
+		series = counters.get(name) if kind == 'counter' else histograms.get(name)
+		if not series:
+			continue
+
+		lines.append(f'# HELP {name} {description}')
+		lines.append(f'# TYPE {name} {kind}')
+		for key, value in sorted(series.items()):
+			labels: dict[str, str] = json.loads(key)
+			if kind == 'counter':
+				lines.append(f'{name}{_format(labels)} {_number(value)}')
+				continue
+
+			cumulative = 0
+			for bound, count in zip([*BUCKETS, float('inf')], value['buckets']):
+				cumulative += count
+				le = '+Inf' if bound == float('inf') else _number(bound)
+				lines.append(f'{name}_bucket{_format({**labels, "le": le})} {cumulative}')
+			lines.append(f'{name}_sum{_format(labels)} {_number(value["sum"])}')
+			lines.append(f'{name}_count{_format(labels)} {value["count"]}')
+
+	return '\n'.join(lines) + '\n' if lines else ''
+
+
+def _histogram() -> dict[str, Any]:
+	return {'buckets': [0] * (len(BUCKETS) + 1), 'sum': 0.0, 'count': 0}
+
+
+def _labels(labels: dict[str, str]) -> str:
+	return json.dumps(labels, sort_keys=True)
+
+
+def _format(labels: dict[str, str]) -> str:
+	if not labels:
+		return ''
+	escaped = (
+		f'{k}="' + str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+		for k, v in labels.items()
+	)
+	return '{' + ','.join(escaped) + '}'
+
+
+def _number(value: float) -> str:
+	return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+metrics = Metrics()
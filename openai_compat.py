@@ -0,0 +1,223 @@
+import json
+import logging
+
+from context import Attachment, Blob, Context, Entry, Message, Note, Part, Request, Result, Role
+from core import Fetch, FetchStream, fetch, fetch_stream
+from iteration import LLMBackend
+from payload import InlineData, payloads
+from tools import JsonValue, ToolDefinition
+from typing import Any, Iterable, List, Mapping, Optional, Sequence, cast
+
+
+# TODO 11: Define strict types for the chat completions JSON structures
+class OpenAICompatible(LLMBackend[Any, Any]):
+	"""Client for any server implementing the OpenAI chat completions API (vLLM, llama.cpp, NIM, ...).
+
+	`sampling` holds the request settings sent as-is (max_tokens, temperature, top_p, ...). With `stream`
+	set, the response is read as server-sent events, so that the deadline applies to each chunk rather
+	than to the whole generation.
+	"""
+
+	def __init__(
+		self,
+		model: str,
+		base_url: str = 'http://localhost:8080/v1',
+		api_key: Optional[str] = None,
+		sampling: Mapping[str, Any] = {},
+		stream: bool = False,
+		fetch: Fetch = fetch,
+		fetch_stream: FetchStream = fetch_stream
+	):
+		self.max_context_length = 1048576
+		self.model = model
+		self.base_url = base_url.rstrip('/')
+		self.api_key = api_key
+		self.sampling = dict(sampling)
+		self.stream = stream
+		self.fetch = fetch
+		self.fetch_stream = fetch_stream
+
+	def generate_response(self, context: Any, timeout: Optional[float] = None) -> Any:
+		url = f"{self.base_url}/chat/completions"
+		headers = {
+			"Content-Type": "application/json",
+			"Accept": "text/event-stream" if self.stream else "application/json"
+		}
+		if self.api_key:
+			headers["Authorization"] = f"Bearer {self.api_key}"
+
+		if self.stream:
+			return accumulate(self.fetch_stream(url, context, headers, timeout=timeout))
+		return self.fetch(url, context, headers, timeout=timeout)
+
+	def prepare_context(self, context: Context, tools: Mapping[str, ToolDefinition] = {}) -> Any:
+		def static() -> Mapping[str, Any]:
+			sections: dict[str, Any] = {
+				"model": self.model,
+				**self.sampling,
+				"stream": self.stream
+			}
+			if self.stream:
+				sections["stream_options"] = {"include_usage": True}
+			if tools:
+				tool_definitions: List[dict[str, Any]] = []
+				for name, definition in tools.items():
+					tool_definitions.append({
+						"type": "function",
+						"function": {
+							"name": name,
+							"description": definition.description,
+							"parameters": definition.parameters
+						}
+					})
+				sections["tools"] = tool_definitions
+			return sections
+
+		key = (type(self).__name__, self.base_url, self.model, self.stream, repr(self.sampling), tuple(tools))
+		return payloads.payload(key, static, "messages", list(self._prepare_messages(context)))
+
+	def _prepare_messages(self, context: Context) -> Iterable[Any]:
+		# Backends that don't return call ids (e.g. Gemini) leave them empty; derive stable ones from the
+		# position of the request, and match the results to the pending requests in order.
+		pending: list[str] = []
+		calls = 0
+
+		for entry in context:
+			if entry.role == Role.TOOL:
+				for part in entry.parts:
+					if isinstance(part, Result):
+						call_id = part.id or (pending.pop(0) if pending else f"call_{calls}")
+						yield {"role": "tool", "tool_call_id": call_id, "content": json.dumps(part.result)}
+				continue
+
+			role = {
+				Role.SYSTEM: "system",
+				Role.USER: "user",
+				Role.MODEL: "assistant"
+			}.get(entry.role, "user")
+
+			content_parts = [p for p in entry.parts if not isinstance(p, Request)]
+			message: dict[str, Any] = {"role": role, "content": self._prepare_content(content_parts)}
+
+			requests = [p for p in entry.parts if isinstance(p, Request)]
+			if requests:
+				tool_calls: list[Any] = []
+				for request in requests:
+					call_id = request.id or f"call_{calls}"
+					calls += 1
+					if not request.id:
+						pending.append(call_id)
+					tool_calls.append({
+						"id": call_id,
+						"type": "function",
+						"function": {"name": request.name, "arguments": json.dumps(request.arguments)}
+					})
+				message["tool_calls"] = tool_calls
+
+			yield message
+
+	def _prepare_content(self, parts: Sequence[Part]) -> Any:
+		# Plain text is sent as a string, which every server accepts; mixed content as an array of parts
+		if not parts:
+			return None
+		if all(isinstance(p, (Message, Blob, Note)) for p in parts):
+			return "\n".join(cast(Message | Blob | Note, p).text for p in parts)
+		return [self._prepare_part(p) for p in parts]
+
+	def _prepare_part(self, part: Part) -> Any:
+		if isinstance(part, (Message, Blob, Note)):
+			return {"type": "text", "text": part.text}
+		elif isinstance(part, Attachment):
+			return {
+				"type": "image_url",
+				"image_url": {"url": InlineData(part.file, prefix=f"data:{part.type.value};base64,")}
+			}
+		elif isinstance(part, Result):
+			return {"type": "text", "text": json.dumps(part.result)}
+		else:
+			logging.warning(f'Unknown part type: {part}')
+			return {"type": "text", "text": ""}
+
+	def parse_result(self, result: Mapping[str, Any]) -> Sequence[Entry]:
+		choices = cast(List[dict[str, Any]], result.get("choices") or [{}])
+		message = cast(dict[str, Any], choices[0].get("message") or {})
+
+		role = {
+			"system": Role.SYSTEM,
+			"user": Role.USER,
+			"assistant": Role.MODEL,
+			"tool": Role.TOOL
+		}.get(str(message.get("role", "assistant")), Role.MODEL)
+
+		parts: list[Part] = []
+		content = message.get("content")
+		if content:
+			parts.append(Message(text=str(content)))
+
+		for tool_call in cast(list[dict[str, Any]], message.get("tool_calls") or []):
+			if tool_call.get("type", "function") != "function":
+				continue
+			function = cast(dict[str, Any], tool_call.get("function") or {})
+			name = str(function.get("name", ""))
+			if not name:
+				logging.error(f'Tool call missing a name: {tool_call}')
+				raise ValueError('Tool call missing a name')
+
+			arguments: Any = function.get("arguments") or {}
+			if isinstance(arguments, str):
+				try:
+					arguments = json.loads(arguments) if arguments.strip() else {}
+				except ValueError:
+					logging.warning(f'Invalid tool call arguments: {arguments}')
+					arguments = {}
+
+			parts.append(Request(id=str(tool_call.get("id", "")), name=name, arguments=cast(Mapping[str, JsonValue], arguments)))
+
+		meta: dict[str, Any] = {}
+		usage = cast(dict[str, Any], result.get("usage") or {})
+		if usage:
+			meta["usage"] = {
+				"prompt_tokens": usage.get("prompt_tokens", 0),
+				"output_tokens": usage.get("completion_tokens", 0),
+				"total_tokens": usage.get("total_tokens", 0)
+			}
+
+		return [Entry(role=role, parts=parts, meta=meta)]
+
+
+def accumulate(events: Iterable[Mapping[str, Any]]) -> dict[str, Any]:
+	'''Fold the chunks of a streamed chat completion into the equivalent non-streamed response.'''
+	role = "assistant"
+	content: list[str] = []
+	tool_calls: dict[int, dict[str, Any]] = {}
+	usage: Optional[Mapping[str, Any]] = None
+
+	for event in events:
+		if event.get("usage"):
+			usage = event["usage"]
+
+		for choice in event.get("choices") or []:
+			delta = choice.get("delta") or {}
+			role = delta.get("role") or role
+			if delta.get("content"):
+				content.append(delta["content"])
+
+			for call in delta.get("tool_calls") or []:
+				current = tool_calls.setdefault(call.get("index", len(tool_calls)), {
+					"id": "",
+					"type": "function",
+					"function": {"name": "", "arguments": ""}
+				})
+				current["id"] = call.get("id") or current["id"]
+				function = call.get("function") or {}
+				current["function"]["name"] += function.get("name") or ""
+				current["function"]["arguments"] += function.get("arguments") or ""
+
+	message: dict[str, Any] = {"role": role, "content": "".join(content) or None}
+	if tool_calls:
+		message["tool_calls"] = [tool_calls[i] for i in sorted(tool_calls)]
+
+	result: dict[str, Any] = {"choices": [{"message": message}]}
+	if usage:
+		result["usage"] = usage
+	return result
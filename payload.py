@@ -0,0 +1,127 @@
+import base64
+import json
+import mmap
+import os
+import secrets
+
+from pathlib import Path
+from typing import Any, Callable, Hashable, Iterable, Iterator, Mapping
+
+
+# Multiple of 3, so that the base64 encodings of consecutive chunks can simply be concatenated
+INLINE_CHUNK_SIZE = 3 * 256 * 1024
+
+
+class InlineData:
+	"""Base64 encoding of a file, used as a JSON string value in a payload.
+
+	The file is mapped and encoded chunk by chunk while the request body is sent, so neither
+	its bytes nor their encoding are ever held in memory in full.
+	"""
+
+	def __init__(self, path: Path, prefix: str = ''):
+		self.path = path
+		self.prefix = prefix.encode('utf-8')
+
+	def __repr__(self) -> str:
+		return f'<inline {self.path}>'
+
+	def __len__(self) -> int:
+		size = os.path.getsize(self.path)
+		return len(self.prefix) + 4 * ((size + 2) // 3)
+
+	def chunks(self) -> Iterator[bytes]:
+		yield self.prefix
+		with open(self.path, 'rb') as f:
+			size = os.fstat(f.fileno()).st_size
+			if size == 0:
+				return
+			with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+				view = memoryview(mm)
+				try:
+					for offset in range(0, size, INLINE_CHUNK_SIZE):
+						yield base64.b64encode(view[offset:offset + INLINE_CHUNK_SIZE])
+				finally:
+					view.release()
+
+
+class Payload(dict[str, Any]):
+	"""Request body made of static sections shared by all requests with the same key, plus one dynamic section.
+
+	It behaves like the plain dict the backends used to build, but `encode` serializes only the
+	dynamic section and splices it after the cached encoding of the static ones.
+	"""
+
+	def __init__(self, cache: 'PayloadCache', key: Hashable, static: Mapping[str, Any], name: str, dynamic: Any):
+		super().__init__(static)
+		self[name] = dynamic
+		self.cache = cache
+		self.key = key
+		self.name = name
+
+	def encode(self) -> bytes:
+		return b''.join(self.stream()[0])
+
+	def stream(self) -> tuple[Iterable[bytes], int]:
+		'''The encoded body as an iterable of chunks, and its total length.'''
+		inline: list[InlineData] = []
+		token = secrets.token_hex(8)
+
+		def placeholder(o: Any) -> Any:
+			if isinstance(o, InlineData):
+				inline.append(o)
+				return f'\0{token}\0'
+			raise TypeError(f'Object of type {type(o).__name__} is not JSON serializable')
+
+		dynamic = json.dumps(self[self.name], default=placeholder).encode('utf-8')
+		prefix = self.cache.prefix(self.key, self.name)
+
+		if not inline:
+			body = prefix + dynamic + b'}'
+			return [body], len(body)
+
+		# Each placeholder is encoded as a quoted JSON string; keep the quotes and splice the data in between
+		marker = json.dumps(f'\0{token}\0').encode('utf-8')[1:-1]
+		pieces = dynamic.split(marker)
+		length = len(prefix) + sum(len(p) for p in pieces) + 1 + sum(len(i) for i in inline)
+
+		def chunks() -> Iterator[bytes]:
+			yield prefix
+			for piece, data in zip(pieces, inline):
+				yield piece
+				yield from data.chunks()
+			yield pieces[-1]
+			yield b'}'
+
+		return chunks(), length
+
+
+class PayloadCache:
+	"""Static request sections keyed by (backend, model, toolset, ...), both as dicts and encoded once."""
+
+	def __init__(self):
+		self._static: dict[Hashable, Mapping[str, Any]] = {}
+		self._prefixes: dict[Hashable, bytes] = {}
+
+	def payload(self, key: Hashable, static: Callable[[], Mapping[str, Any]], name: str, dynamic: Any) -> Payload:
+		sections = self._static.get(key)
+		if sections is None:
+			sections = self._static[key] = static()
+		return Payload(self, key, sections, name, dynamic)
+
+	def prefix(self, key: Hashable, name: str) -> bytes:
+		'''The encoded static sections, up to and including the dynamic section's name.'''
+		prefix = self._prefixes.get(key)
+		if prefix is None:
+			static = self._static[key]
+			encoded = json.dumps(static).encode('utf-8')[:-1]
+			separator = b', ' if static else b''
+			prefix = self._prefixes[key] = encoded + separator + json.dumps(name).encode('utf-8') + b': '
+		return prefix
+
+	def clear(self) -> None:
+		self._static.clear()
+		self._prefixes.clear()
+
+
+payloads = PayloadCache()
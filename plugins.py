@@ -0,0 +1,136 @@
+import importlib
+import importlib.util
+import json
+import logging
+import os
+import sys
+import tempfile
+
+from config import CACHE_DIR, CONFIG_DIR
+from pathlib import Path
+from tools import LazyTool, Tool, ToolDefinition, ToolRegistry
+from types import ModuleType
+from typing import Any, Iterable, Type
+
+
+# Modules shipped with q that provide tools
+BUILTIN = ('dice', 'console', 'results')
+
+# Directory of the user's own tool modules
+TOOLS_DIR = CONFIG_DIR / 'tools'
+
+MANIFEST_FILE = CACHE_DIR / 'tools.json'
+MANIFEST_VERSION = 1
+
+
+def discover(
+	registry: ToolRegistry,
+	directories: Iterable[Path] = (TOOLS_DIR,),
+	manifest_path: Path = MANIFEST_FILE
+) -> None:
+	"""Register the built-in tools and those of the `*.py` modules in `directories`, without importing them.
+
+	A tool module declares its tools in a `TOOLS` mapping from name to `Tool` class. Their names and
+	definitions are kept in a manifest, which is rebuilt (importing every module once) only when a module
+	is added, removed or changed. A module is imported when one of its tools is first called.
+	"""
+	sources = find_sources(directories)
+	stamps = {module: stamp(path) for module, path in sources.items()}
+
+	manifest = load_manifest(manifest_path)
+	if manifest.get('version') != MANIFEST_VERSION or manifest.get('sources') != stamps:
+		logging.info('Rebuilding the tool manifest')
+		manifest = {'version': MANIFEST_VERSION, 'sources': stamps, 'tools': build_tools(sources)}
+		save_manifest(manifest_path, manifest)
+
+	for name, entry in manifest['tools'].items():
+		registry.register(name, LazyTool(
+			ToolDefinition(**entry['definition']),
+			lambda entry=entry: load_tool(entry['module'], entry['path'], entry['class'])
+		))
+
+
+def find_sources(directories: Iterable[Path]) -> dict[str, str]:
+	'''Map the names of the tool modules to their files.'''
+	sources: dict[str, str] = {}
+	for name in BUILTIN:
+		spec = importlib.util.find_spec(name)
+		if spec is not None and spec.origin:
+			sources[name] = spec.origin
+
+	for directory in directories:
+		for path in sorted(directory.expanduser().glob('*.py')):
+			# Prefixed, so that a user's module can't shadow (or be shadowed by) another module
+			sources[f'q_tool_{path.stem}'] = str(path)
+	return sources
+
+
+def stamp(path: str) -> list[int]:
+	stat = os.stat(path)
+	return [stat.st_mtime_ns, stat.st_size]
+
+
+def build_tools(sources: dict[str, str]) -> dict[str, dict[str, Any]]:
+	tools: dict[str, dict[str, Any]] = {}
+	for module, path in sources.items():
+		try:
+			declared: dict[str, Type[Tool]] = import_module(module, path).TOOLS
+		except Exception as e:
+			logging.warning(f'Skipping the tool module {path}: {e}')
+			continue
+
+		for name, cls in declared.items():
+			tools[name] = {
+				'module': module,
+				'path': path,
+				'class': cls.__name__,
+				'definition': cls.definition()._asdict()
+			}
+	return tools
+
+
+def import_module(module: str, path: str) -> ModuleType:
+	if module in sys.modules:
+		return sys.modules[module]
+	if module in BUILTIN:
+		return importlib.import_module(module)
+
+	spec = importlib.util.spec_from_file_location(module, path)
+	if spec is None or spec.loader is None:
+		raise ImportError(f'Cannot load {path}')
+	loaded = importlib.util.module_from_spec(spec)
+	sys.modules[module] = loaded
+	try:
+		spec.loader.exec_module(loaded)
+	except BaseException:
+		del sys.modules[module]
+		raise
+	return loaded
+
+
+def load_tool(module: str, path: str, name: str) -> Type[Tool]:
+	return getattr(import_module(module, path), name)
+
+
+def load_manifest(path: Path) -> dict[str, Any]:
+	try:
+		with open(path, 'r') as f:
+			return json.load(f)
+	except (OSError, ValueError):
+		return {}
+
+
+def save_manifest(path: Path, manifest: dict[str, Any]) -> None:
+	'''Write the manifest atomically; it is only a cache, so failing to write it is not an error.'''
+	try:
+		path.parent.mkdir(parents=True, exist_ok=True)
+		fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f'.{path.name}.')
+		try:
+			with os.fdopen(fd, 'w') as f:
+				json.dump(manifest, f)
+			os.replace(tmp, path)
+		except BaseException:
+			os.unlink(tmp)
+			raise
+	except OSError as e:
+		logging.warning(f'Could not save the tool manifest {path}: {e}')
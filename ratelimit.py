@@ -0,0 +1,155 @@
+import hashlib
+import json
+import os
+import random
+import tempfile
+import time
+
+from config import CACHE_DIR
+from context import Attachment, Blob, Context, Message, Note, Request, Result
+from deadline import Deadline, DeadlineExceeded
+from locking import file_lock
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+
+# Rough size of a token, in characters of text
+CHARS_PER_TOKEN = 4
+
+# Tokens counted for an image attachment
+IMAGE_TOKENS = 258
+
+# Upper bound of the random delay added to a wait, so that the processes woken together don't contend again
+JITTER_SECONDS = 0.05
+
+
+class RateLimiter:
+	"""Token buckets for the requests and the tokens per minute allowed by a provider, shared by all q processes.
+
+	The levels of the buckets live in a small JSON file, which is read, refilled and debited under a lock.
+	A process that finds a bucket short sleeps until it has refilled enough, then tries again, so that
+	parallel calls are spread out at the quota instead of all failing with 429.
+	"""
+
+	def __init__(
+		self,
+		path: Path,
+		requests_per_minute: Optional[float] = None,
+		tokens_per_minute: Optional[float] = None,
+		clock: Callable[[], float] = time.time,
+		sleep: Callable[[float], None] = time.sleep
+	):
+		self.path = path
+		self.lock = path.parent / f'.{path.name}.lock'
+		self.limits = {'requests': requests_per_minute, 'tokens': tokens_per_minute}
+		self.clock = clock
+		self.sleep = sleep
+
+	def acquire(self, tokens: int, deadline: Optional[Deadline] = None) -> float:
+		'''Wait until a request of about `tokens` tokens fits in the limits and debit it; returns the seconds waited.
+
+		Raises DeadlineExceeded right away if the wait would outlast the deadline.
+		'''
+		deadline = deadline or Deadline()
+		costs = {'requests': 1.0, 'tokens': float(tokens)}
+		for bucket, limit in self.limits.items():
+			if limit is not None:
+				# A request larger than the bucket could never fit; it waits for a full bucket instead
+				costs[bucket] = min(costs[bucket], limit)
+
+		self.path.parent.mkdir(parents=True, exist_ok=True)
+		waited = 0.0
+		while True:
+			with file_lock(self.lock):
+				levels = self._refill()
+				wait = max(
+					((costs[bucket] - levels[bucket]) * 60 / limit for bucket, limit in self.limits.items() if limit),
+					default=0.0
+				)
+				if wait <= 0:
+					for bucket in levels:
+						levels[bucket] -= costs[bucket]
+					self._save(levels)
+					return waited
+
+			remaining = deadline.remaining()
+			if remaining is not None and remaining < wait:
+				raise DeadlineExceeded(f'The rate limit delays the request by {wait:.1f}s, past the deadline')
+
+			wait += random.uniform(0, JITTER_SECONDS)
+			self.sleep(wait)
+			waited += wait
+
+	def settle(self, estimated: int, actual: int) -> None:
+		'''Debit (or refund) the difference between the estimated tokens of a request and those it actually used.'''
+		if self.limits['tokens'] is None or actual == estimated:
+			return
+
+		with file_lock(self.lock):
+			levels = self._refill()
+			levels['tokens'] -= actual - estimated
+			self._save(levels)
+
+	def _refill(self) -> dict[str, float]:
+		state = self._load()
+		now = self.clock()
+		elapsed = max(now - state.get('updated', now), 0.0)
+
+		levels: dict[str, float] = {}
+		for bucket, limit in self.limits.items():
+			# A bucket starts full; its level may be negative after a request used more tokens than estimated
+			level = float(state.get(bucket, limit or 0.0))
+			levels[bucket] = min(level + elapsed * limit / 60, limit) if limit else 0.0
+		return levels
+
+	def _load(self) -> dict[str, Any]:
+		try:
+			with open(self.path, 'r') as f:
+				state = json.load(f)
+		except (OSError, ValueError):
+			return {}
+		return state if isinstance(state, dict) else {}
+
+	def _save(self, levels: dict[str, float]) -> None:
+		# Replaced in one step: a process killed halfway must not leave a file that reads as full buckets
+		fd, tmp = tempfile.mkstemp(dir=self.path.parent, prefix=f'.{self.path.name}.')
+		try:
+			with os.fdopen(fd, 'w') as f:
+				json.dump({'updated': self.clock(), **levels}, f)
+			os.replace(tmp, self.path)
+		except BaseException:
+			os.unlink(tmp)
+			raise
+
+
+def bucket_file(backend: object, directory: Path = CACHE_DIR / 'ratelimit') -> Path:
+	'''State file shared by the processes that use the same backend with the same API key (which is not stored).'''
+	identity = '\0'.join([type(backend).__name__, str(getattr(backend, 'base_url', '')), str(getattr(backend, 'api_key', ''))])
+	return directory / f'{hashlib.sha256(identity.encode()).hexdigest()[:16]}.json'
+
+
+def estimate_tokens(context: Context) -> int:
+	'''Estimate the prompt tokens of a request: the usage last reported by the backend, plus the size of the entries added since.'''
+	tokens = 0
+	start = 0
+	for index in range(len(context) - 1, -1, -1):
+		usage: Any = context[index].meta.get('usage')
+		if usage:
+			tokens = int(usage.get('prompt_tokens', 0)) + int(usage.get('output_tokens', 0))
+			start = index + 1
+			break
+
+	characters = 0
+	for entry in context[start:]:
+		for part in entry.parts:
+			if isinstance(part, (Message, Note)):
+				characters += len(part.text)
+			elif isinstance(part, Request):
+				characters += len(part.name) + len(json.dumps(part.arguments))
+			elif isinstance(part, Result):
+				characters += len(part.name) + len(json.dumps(part.result))
+			elif isinstance(part, Blob):
+				characters += part.size
+			elif isinstance(part, Attachment):
+				tokens += IMAGE_TOKENS
+	return tokens + characters // CHARS_PER_TOKEN
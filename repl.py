@@ -0,0 +1,171 @@
+import logging
+import subprocess
+import sys
+
+from context import Attachment, Context, Role
+from core import FetchError, append_context, response_printer, save_context
+from deadline import Deadline, DeadlineExceeded
+from history import History
+from ingest import DEFAULT_MAX_BYTES, read_stream
+from iteration import Iteration
+from pathlib import Path
+from typing import Any, Iterable, Iterator, Optional, Sequence
+
+try:
+	# Line editing and recall for `input`, where available
+	import readline
+except ImportError:
+	pass
+
+
+PROMPT = 'q> '
+CONTINUATION = '.. '
+
+# A line holding only this starts and ends a block of lines sent as one prompt
+BLOCK = '"""'
+
+HELP = '''Type a question and press Enter; the answer uses the whole conversation so far.
+  line \\          continue the question on the next line
+  """             start (and end) a block of lines
+  !COMMAND        run a shell command and attach its output to the next question
+  /reset          start a new conversation
+  /help           show this help
+  /exit, Ctrl-D   quit
+Ctrl-C cancels the question being answered, or the input being typed.'''
+
+
+class Repl:
+	"""Interactive session: the context, the backend and its connection stay in memory between the questions.
+
+	Each answered turn is appended to the shell's context file right away, so that a plain `q` call that
+	follows (or a crash) sees every completed turn.
+	"""
+
+	def __init__(
+		self,
+		context_file: Path,
+		iteration: Iteration[Any, Any],
+		tools: Optional[Sequence[str]] = None,
+		timeout: Optional[float] = None,
+		history: Optional[History] = None,
+		max_input: int = DEFAULT_MAX_BYTES,
+		lines: Optional[Iterable[str]] = None,
+		attachments: Sequence[Attachment] = ()
+	):
+		self.context_file = context_file
+		self.iteration = iteration
+		self.tools = tools
+		self.timeout = timeout
+		self.history = history
+		self.max_input = max_input
+		# Input lines; the terminal (with line editing) if none are given
+		self.lines: Optional[Iterator[str]] = iter(lines) if lines is not None else None
+		# Command outputs, and the images given with -a, to attach to the next question
+		self.attached: list[str] = []
+		self.attachments = list(attachments)
+		self.context = Context('')
+
+	def run(self, prompts: Sequence[str] = (), reset: bool = False) -> Context:
+		'''Answer `prompts` (if any), then the questions read from the input until it ends; `reset` starts a new conversation.'''
+		if self.context_file.exists():
+			with open(self.context_file, 'r') as f:
+				self.context = Context(f.read())
+
+		if reset:
+			self.context.reset()
+			save_context(self.context_file, self.context)
+
+		if prompts:
+			self.ask(list(prompts))
+
+		while True:
+			try:
+				text = self.read()
+				command = text.strip()
+				if command in ('/exit', '/quit'):
+					break
+				elif command == '/help':
+					print(HELP, file=sys.stderr)
+				elif command == '/reset':
+					self.context.reset()
+					self.attached.clear()
+					self.attachments.clear()
+					save_context(self.context_file, self.context)
+				elif command.startswith('!'):
+					self.attach(command[1:].strip())
+				elif command:
+					self.ask([text])
+			except EOFError:
+				break
+			except KeyboardInterrupt:
+				# Drop what was being typed, or the command whose output was being read
+				print(file=sys.stderr)
+				self.attached.clear()
+
+		return self.context
+
+	def read(self) -> str:
+		'''Read one question: a line, lines joined by trailing backslashes, or a block between `"""` lines.'''
+		line = self.readline(PROMPT)
+		if line.strip() == BLOCK:
+			block: list[str] = []
+			while (line := self.readline(CONTINUATION)).strip() != BLOCK:
+				block.append(line)
+			return '\n'.join(block)
+
+		lines: list[str] = []
+		while line.endswith('\\'):
+			lines.append(line[:-1])
+			line = self.readline(CONTINUATION)
+		lines.append(line)
+		return '\n'.join(lines)
+
+	def readline(self, prompt: str) -> str:
+		if self.lines is None:
+			return input(prompt)
+
+		line = next(self.lines, None)
+		if line is None:
+			raise EOFError()
+		return line.rstrip('\n')
+
+	def attach(self, command: str) -> None:
+		'''Run a shell command; its output (trimmed like piped input) goes with the next question.'''
+		if not command:
+			return
+
+		process = subprocess.Popen(command, shell=True, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+		assert process.stdout is not None
+		with process.stdout:
+			output = read_stream(process.stdout, self.max_input).strip()
+		status = process.wait()
+
+		self.attached.append(f'$ {command}\n{output}' + (f'\n[exit status {status}]' if status else ''))
+		print(f'[attached {len(output)} characters of output from `{command}`]', file=sys.stderr)
+
+	def ask(self, prompts: list[str]) -> None:
+		'''Answer one question and save the turn; a failed or interrupted turn is discarded.'''
+		start = len(self.context)
+		self.context.add_text(Role.USER, [*prompts, *self.attached], self.attachments)
+		self.attached = []
+		self.attachments = []
+
+		try:
+			self.iteration.execute(self.context, response_printer(), self.tools, Deadline(self.timeout))
+		except (KeyboardInterrupt, DeadlineExceeded, FetchError) as e:
+			del self.context[start:]
+			if isinstance(e, KeyboardInterrupt):
+				print('[cancelled]', file=sys.stderr)
+			else:
+				logging.error(f'The question was not answered: {e}')
+			return
+		except Exception as e:
+			# E.g. a malformed response, or a failing tool: the session goes on without the turn
+			del self.context[start:]
+			logging.error(f'The question was not answered: {type(e).__name__}: {e}')
+			logging.debug('Traceback of the failed turn', exc_info=True)
+			return
+
+		append_context(self.context_file, self.context, start)
+		if self.history is not None:
+			self.history.record(self.context_file.stem, self.context[start:])
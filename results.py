@@ -0,0 +1,145 @@
+import json
+import re
+
+from blobs import blobs
+from context import Context, Result
+from tools import JsonValue, Tool, ToolDefinition
+from typing import Any, Mapping, Optional
+
+
+# Results larger than this, in bytes of JSON, are stored out of band
+DEFAULT_THRESHOLD = 16 * 1024
+
+# Bytes of the beginning, and of the end, of a stored text shown to the model
+PREVIEW_BYTES = 2048
+
+# Lines returned by `read_result` unless asked otherwise, and the bytes it returns at most
+DEFAULT_LINES = 200
+MAX_READ_BYTES = DEFAULT_THRESHOLD
+
+READ_RESULT = 'read_result'
+
+DIGEST = re.compile(r'^[0-9a-f]{64}$')
+
+
+class ResultPolicy:
+	"""Keep large tool results out of the context, which is sent again with every later request.
+
+	A result over the threshold of its tool is stored in the blob store. The model gets a digest instead:
+	the head and the tail of the text, its size in bytes and lines, and the blob digest to read more
+	through the `read_result` tool. In a mapping result (e.g. of `console`) only the largest text fields
+	are replaced, so that small fields such as an exit status stay as they are.
+	"""
+
+	def __init__(self, threshold: Optional[int] = DEFAULT_THRESHOLD, tools: Mapping[str, Optional[int]] = {}):
+		self.threshold = threshold
+		# Thresholds of specific tools; None keeps the results of a tool whole
+		self.tools = tools
+
+	def apply(self, tool: str, value: JsonValue) -> JsonValue:
+		limit = self.tools.get(tool, self.threshold)
+		if limit is None or tool == READ_RESULT or _size(value) <= limit:
+			return value
+
+		# The previews of a low threshold are shorter, so that the digest itself fits
+		preview = min(PREVIEW_BYTES, limit // 4)
+		if isinstance(value, Mapping):
+			fields = dict(value)
+			for key in sorted((k for k, v in fields.items() if isinstance(v, str)), key=lambda k: -len(fields[k])):
+				fields[key] = store(fields[key], preview)
+				if _size(fields) <= limit:
+					return fields
+
+		return store(value if isinstance(value, str) else json.dumps(value, ensure_ascii=False), preview)
+
+
+def store(text: str, preview: int = PREVIEW_BYTES) -> dict[str, JsonValue]:
+	'''Put the text in the blob store and describe it for the model, with `preview` bytes of its head and tail.'''
+	data = text.encode('utf-8')
+	digest = blobs.put(data)
+	lines = data.count(b'\n') + (0 if data.endswith(b'\n') else 1)
+
+	head = data[:preview]
+	tail = data[-preview:] if len(data) > 2 * preview else data[preview:]
+	if len(data) > 2 * preview:
+		# Cut at line boundaries, unless the lines are longer than the preview
+		head = head.rsplit(b'\n', 1)[0] + b'\n' if b'\n' in head else head
+		tail = tail.split(b'\n', 1)[1] if b'\n' in tail[:-1] else tail
+
+	return {
+		'digest': digest,
+		'bytes': len(data),
+		'lines': lines,
+		'head': head.decode('utf-8', errors='ignore'),
+		'tail': tail.decode('utf-8', errors='ignore'),
+		'note': f'Only the head and the tail of this output are shown. Call `{READ_RESULT}` with the digest to read other lines.'
+	}
+
+
+def is_stored(value: Any) -> bool:
+	return isinstance(value, Mapping) and 'digest' in value and 'head' in value and 'tail' in value
+
+
+def has_stored(context: Context) -> bool:
+	'''Whether a result in the context was stored out of band, so that the model may need `read_result`.'''
+	for entry in context:
+		for part in entry.parts:
+			if isinstance(part, Result) and (
+				is_stored(part.result) or (isinstance(part.result, Mapping) and any(is_stored(v) for v in part.result.values()))
+			):
+				return True
+	return False
+
+
+class ReadResultTool(Tool):
+	"""Read a range of lines of a tool result that was stored out of band."""
+
+	@staticmethod
+	def definition() -> ToolDefinition:
+		return ToolDefinition(
+			description='Read lines of a large tool output that was shown only in part, with a digest, a head and a tail.',
+			parameters={
+				'type': 'object',
+				'properties': {
+					'digest': {'type': 'string', 'description': 'The digest of the stored output'},
+					'start': {'type': 'integer', 'description': 'First line to read, starting at 1', 'minimum': 1, 'default': 1},
+					'count': {'type': 'integer', 'description': 'Number of lines to read', 'minimum': 1, 'default': DEFAULT_LINES}
+				},
+				'required': ['digest']
+			}
+		)
+
+	def execute(self, digest: str, start: int = 1, count: int = DEFAULT_LINES) -> JsonValue:
+		if not DIGEST.match(digest):
+			return {'error': f'Invalid digest: {digest!r}'}
+		try:
+			data = blobs.get(digest)
+		except KeyError:
+			return {'error': f'No stored output with the digest {digest}'}
+
+		lines = data.decode('utf-8', errors='replace').splitlines(keepends=True)
+		first = max(int(start), 1) - 1
+		selected: list[str] = []
+		size = 0
+		for line in lines[first:first + max(int(count), 1)]:
+			size += len(line.encode('utf-8'))
+			if selected and size > MAX_READ_BYTES:
+				break
+			selected.append(line)
+
+		return {
+			'digest': digest,
+			'start': first + 1,
+			'end': first + len(selected),
+			'total_lines': len(lines),
+			# A single line can still be longer than the cap
+			'text': ''.join(selected).encode('utf-8')[:MAX_READ_BYTES].decode('utf-8', errors='ignore')
+		}
+
+
+def _size(value: Any) -> int:
+	return len(json.dumps(value, ensure_ascii=False).encode('utf-8'))
+
+
+# Tools provided by this module; see plugins.discover
+TOOLS = {READ_RESULT: ReadResultTool}
@@ -0,0 +1,106 @@
+import logging
+
+from context import Attachment, Blob, Context, Message, Role
+from iteration import LLMBackend, Route
+from ratelimit import RateLimiter, estimate_tokens
+from typing import Any, Callable, Collection, Mapping, NamedTuple, Optional, Sequence
+
+
+class Signals(NamedTuple):
+	'''What is known about a question before it is sent, at next to no cost.'''
+	tokens: int
+	prompt: int
+	tools: bool
+	attachments: bool
+
+
+class Rule(NamedTuple):
+	'''A route and the conditions of the questions it takes; unset conditions match anything.'''
+	name: str
+	backend: Mapping[str, Any]
+	min_tokens: Optional[int] = None
+	max_tokens: Optional[int] = None
+	min_prompt: Optional[int] = None
+	max_prompt: Optional[int] = None
+	tools: Optional[bool] = None
+	attachments: Optional[bool] = None
+
+	def matches(self, signals: Signals) -> bool:
+		return (
+			(self.min_tokens is None or signals.tokens >= self.min_tokens)
+			and (self.max_tokens is None or signals.tokens <= self.max_tokens)
+			and (self.min_prompt is None or signals.prompt >= self.min_prompt)
+			and (self.max_prompt is None or signals.prompt <= self.max_prompt)
+			and (self.tools is None or signals.tools == self.tools)
+			and (self.attachments is None or signals.attachments == self.attachments)
+		)
+
+
+def signals(context: Context, tools: Sequence[str]) -> Signals:
+	'''Signals of the question at the end of the context: estimated tokens of the whole request, characters of the question.'''
+	question = context[-1] if context and context[-1].role == Role.USER else None
+	parts = question.parts if question is not None else []
+	return Signals(
+		tokens=estimate_tokens(context),
+		prompt=sum(len(p.text) if isinstance(p, Message) else p.size if isinstance(p, Blob) else 0 for p in parts),
+		tools=bool(tools),
+		attachments=any(isinstance(p, Attachment) for p in parts)
+	)
+
+
+def parse_rules(
+	routes: Sequence[Mapping[str, Any]],
+	backend: Mapping[str, Any],
+	types: Optional[Collection[str]] = None
+) -> list[Rule]:
+	'''Rules from the `routes` configuration; the backend settings of a route extend those of `backend`.
+
+	Raises ValueError for unknown conditions, and for backend types not in `types` (if given), so that
+	mistakes in the configuration show at startup rather than with the first question routed to them.
+	'''
+	rules: list[Rule] = []
+	for index, route in enumerate(routes):
+		when = dict(route.get('when', {}))
+		unknown = set(when) - set(Rule._fields[2:])
+		if unknown:
+			raise ValueError(f'Unknown route condition(s): {", ".join(sorted(unknown))}')
+
+		settings = {**backend, **route.get('backend', {})}
+		if types is not None and settings.get('type', 'gemini') not in types:
+			raise ValueError(f'Unknown backend type of route {index + 1}: {settings["type"]}')
+		name = route.get('name') or settings.get('model') or f'route {index + 1}'
+		rules.append(Rule(name=name, backend=settings, **when))
+	return rules
+
+
+class Router:
+	"""Pick the backend of each question: the first rule that matches it, or the configured backend.
+
+	The backends of the rules are created when they are first picked, so unused routes cost nothing (no
+	secret lookups, no connections). A backend that can't be created (e.g. its secret is missing) is
+	reported, and its questions go to the configured backend.
+	"""
+
+	def __init__(
+		self,
+		rules: Sequence[Rule],
+		default: Route,
+		make: Callable[[Mapping[str, Any]], tuple[LLMBackend[Any, Any], Optional[RateLimiter]]]
+	):
+		self.rules = rules
+		self.default = default
+		self.make = make
+		self.routes: dict[int, Route] = {}
+
+	def __call__(self, context: Context, tools: Sequence[str]) -> Route:
+		found = signals(context, tools)
+		for index, rule in enumerate(self.rules):
+			if rule.matches(found):
+				if index not in self.routes:
+					try:
+						self.routes[index] = Route(rule.name, *self.make(rule.backend))
+					except Exception as e:
+						logging.error(f'Could not create the backend of route {rule.name!r}, using the default one: {e}')
+						return self.default
+				return self.routes[index]
+		return self.default
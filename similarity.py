@@ -0,0 +1,176 @@
+import hashlib
+import json
+import logging
+import re
+import sqlite3
+import time
+import zlib
+
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+
+# Signature size (one-permutation MinHash bins) and its split into LSH bands
+BINS = 64
+BANDS = 16
+ROWS = BINS // BANDS
+SHINGLE_SIZE = 5
+
+DEFAULT_THRESHOLD = 0.85
+
+# Characters of a prompt stored with its answer
+MAX_PROMPT = 4096
+
+# Volatile tokens that make otherwise identical prompts differ; the order matters. They ignore the case, so that
+# `template` can keep the case of the text.
+VOLATILE = [
+	(re.compile(r'\d{4}-\d{2}-\d{2}[t ]\d{2}:\d{2}(:\d{2}(\.\d+)?)?(z|[+-]\d{2}:?\d{2})?', re.IGNORECASE), '<ts>'),
+	(re.compile(r'\b(jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec) +\d{1,2} \d{2}:\d{2}:\d{2}\b', re.IGNORECASE), '<ts>'),
+	(re.compile(r'\b\d{1,2}:\d{2}:\d{2}(\.\d+)?\b'), '<ts>'),
+	(re.compile(r'\b[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\b', re.IGNORECASE), '<id>'),
+	(re.compile(r'\b0x[0-9a-f]+\b', re.IGNORECASE), '<hex>'),
+	(re.compile(r'\b(?=[0-9a-f]*\d)(?=[0-9a-f]*[a-f])[0-9a-f]{8,}\b', re.IGNORECASE), '<hex>'),
+	# PIDs, only where they are marked as such: `pid=123`, `PID 77` and syslog's `sshd[42]:`
+	(re.compile(r'\b(pid[=: ] *)\d+\b', re.IGNORECASE), r'\1<pid>'),
+	(re.compile(r'(?<=\w\[)\d+(?=\]:)'), '<pid>'),
+]
+
+# Any other number. Numbers are part of the question ("2+2", "64 KiB"), so they are only replaced in descriptions
+# of similar lines, never in the signatures.
+NUMBER = (re.compile(r'\d+'), '<n>')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS answers (
+	id INTEGER PRIMARY KEY,
+	config TEXT NOT NULL,
+	created REAL NOT NULL,
+	signature BLOB NOT NULL,
+	prompt TEXT NOT NULL,
+	answer TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS bands (
+	band INTEGER NOT NULL,
+	bucket INTEGER NOT NULL,
+	answer_id INTEGER NOT NULL REFERENCES answers(id) ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS bands_bucket ON bands (band, bucket);
+'''
+
+# Marks an empty bin of a signature
+EMPTY = 0xFFFFFFFF
+
+
+def normalize(text: str) -> str:
+	'''Lowercase the text, replace timestamps, hex IDs and PIDs with placeholders and collapse whitespace.'''
+	return ' '.join(template(text.lower()).split())
+
+
+def template(text: str, numbers: bool = False) -> str:
+	'''Replace timestamps, hex IDs and PIDs (and all other numbers, if `numbers`) with placeholders, leaving the rest of the text as it is.'''
+	for pattern, replacement in VOLATILE + ([NUMBER] if numbers else []):
+		text = pattern.sub(replacement, text)
+	return text
+
+
+def numbers(prompt: str) -> list[str]:
+	'''The numbers left in the normalized prompt, as far as it is stored with an answer.'''
+	return NUMBER[0].findall(normalize(prompt[:MAX_PROMPT]))
+
+
+def signature(text: str) -> list[int]:
+	'''One-permutation MinHash of the character shingles of the normalized text.'''
+	data = normalize(text).encode('utf-8')
+	mins = [EMPTY] * BINS
+	for i in range(max(len(data) - SHINGLE_SIZE + 1, 1)):
+		h = zlib.crc32(data[i:i + SHINGLE_SIZE])
+		b = h % BINS
+		v = h // BINS
+		if v < mins[b]:
+			mins[b] = v
+	return mins
+
+
+def similarity(a: list[int], b: list[int]) -> float:
+	'''Estimated Jaccard similarity of the shingle sets behind two signatures.'''
+	used = [(x, y) for x, y in zip(a, b) if x != EMPTY or y != EMPTY]
+	if not used:
+		return 1.0
+	return sum(1 for x, y in used if x == y) / len(used)
+
+
+def config_key(*parts: object) -> str:
+	'''Digest of everything that must match for a cached answer to be reused (backend, model, system prompt, earlier turns, ...).'''
+	return hashlib.sha256(json.dumps(parts, default=str).encode('utf-8')).hexdigest()
+
+
+def buckets(sig: list[int]) -> list[int]:
+	return [zlib.crc32(repr(sig[band * ROWS:(band + 1) * ROWS]).encode()) for band in range(BANDS)]
+
+
+class Hit(NamedTuple):
+	answer: str
+	prompt: str
+	similarity: float
+
+
+class SimilarityCache:
+	"""Answers to earlier prompts, looked up by near-duplicate matching of new prompts.
+
+	Prompts are only compared within the same configuration key (model, system prompt, ...).
+	"""
+
+	def __init__(self, path: Path, threshold: float = DEFAULT_THRESHOLD):
+		path.parent.mkdir(parents=True, exist_ok=True)
+		self.threshold = threshold
+		self.connection = sqlite3.connect(path, timeout=5.0)
+		self.connection.execute('PRAGMA journal_mode=WAL')
+		self.connection.execute('PRAGMA foreign_keys=ON')
+		self.connection.executescript(SCHEMA)
+
+	def close(self) -> None:
+		self.connection.close()
+
+	def lookup(self, config: str, prompt: str) -> Optional[Hit]:
+		sig = signature(prompt)
+		candidates = self.connection.execute(
+			f'''
+			SELECT DISTINCT answers.signature, answers.prompt, answers.answer
+			FROM bands JOIN answers ON answers.id = bands.answer_id
+			WHERE answers.config = ? AND ({' OR '.join(['(bands.band = ? AND bands.bucket = ?)'] * BANDS)})
+			''',
+			(config, *[v for band, bucket in enumerate(buckets(sig)) for v in (band, bucket)])
+		)
+
+		best: Optional[Hit] = None
+		found = numbers(prompt)
+		for blob, cached_prompt, answer in candidates:
+			# A long prompt can be similar enough despite a different number, which is a different question
+			if numbers(cached_prompt) != found:
+				continue
+			score = similarity(sig, _unpack(blob))
+			if score >= self.threshold and (best is None or score > best.similarity):
+				best = Hit(answer=answer, prompt=cached_prompt, similarity=score)
+
+		if best:
+			logging.info(f'Similarity cache hit ({best.similarity:.2f})')
+		return best
+
+	def store(self, config: str, prompt: str, answer: str) -> None:
+		sig = signature(prompt)
+		with self.connection:
+			cursor = self.connection.execute(
+				'INSERT INTO answers (config, created, signature, prompt, answer) VALUES (?, ?, ?, ?, ?)',
+				(config, time.time(), _pack(sig), prompt[:MAX_PROMPT], answer)
+			)
+			self.connection.executemany(
+				'INSERT INTO bands (band, bucket, answer_id) VALUES (?, ?, ?)',
+				[(band, bucket, cursor.lastrowid) for band, bucket in enumerate(buckets(sig))]
+			)
+
+
+def _pack(sig: list[int]) -> bytes:
+	return b''.join(v.to_bytes(4, 'little') for v in sig)
+
+
+def _unpack(blob: bytes) -> list[int]:
+	return [int.from_bytes(blob[i:i + 4], 'little') for i in range(0, len(blob), 4)]
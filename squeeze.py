@@ -0,0 +1,146 @@
+import re
+
+from similarity import template
+from typing import Callable, Optional
+
+
+# Runs of similar lines shorter than this are kept as they are
+MIN_RUN = 3
+
+# Lines longer than this (minified JSON, binary data) are passed through as they are, without being buffered
+MAX_LINE = 64 * 1024
+
+# Tokens of hex digits that contain a digit: numbers, timestamps (piecewise), hex IDs. A single pass over each
+# line is much faster than `template`, which only describes the runs that are collapsed.
+VARIABLE = re.compile(rb'0x[0-9a-fA-F]+|[0-9a-fA-F]*[0-9][0-9a-fA-F]*')
+
+
+class SqueezeStats:
+	'''Size of the inputs before and after squeezing, summed over all the inputs of an invocation.'''
+
+	def __init__(self):
+		self.before = 0
+		self.after = 0
+		self.collapsed = 0
+
+	def __str__(self) -> str:
+		saved = 1 - self.after / self.before if self.before else 0.0
+		return f'Squeezed the input from {self.before} to {self.after} bytes ({saved:.0%} smaller, {self.collapsed} lines collapsed)'
+
+
+class LineSqueezer:
+	"""Collapse runs of repeated lines, and of lines that differ only in timestamps, numbers or hex IDs.
+
+	A run of identical lines becomes the line and a repeat count. A run of similar lines keeps its first
+	and last lines, with the common template and the number of lines omitted in between. Lines are
+	written to `sink` as soon as their run ends, and lines over `max_line` bytes as they arrive, so
+	memory use doesn't grow with the input.
+	"""
+
+	def __init__(self, sink: Callable[[bytes], None], stats: Optional[SqueezeStats] = None, max_line: int = MAX_LINE):
+		self.sink = sink
+		self.stats = stats or SqueezeStats()
+		self.max_line = max_line
+		# Pieces of the line being read, and their length; joined once the line ends
+		self.partial: list[bytes] = []
+		self.size = 0
+		# Whether the line being read is too long and is being written as it arrives
+		self.passing = False
+		# The current run: its key, its lines kept so far (at most MIN_RUN), its last line and length
+		self.key: Optional[bytes] = None
+		self.kept: list[bytes] = []
+		self.last = b''
+		self.count = 0
+		self.identical = True
+
+	def write(self, data: bytes) -> None:
+		self.stats.before += len(data)
+		lines = data.split(b'\n')
+		for line in lines[:-1]:
+			self._piece(line)
+			self._end(newline=True)
+		self._piece(lines[-1])
+
+	def close(self) -> None:
+		if self.size or self.passing:
+			self._end(newline=False)
+		self._flush()
+
+	def _piece(self, data: bytes) -> None:
+		if self.passing:
+			self._emit(data)
+			return
+		if not data:
+			return
+
+		self.partial.append(data)
+		self.size += len(data)
+		if self.size > self.max_line:
+			# Too long to compare with other lines: end the run, and write the line without keeping it
+			self._flush()
+			self.passing = True
+			self._emit(b''.join(self.partial))
+			self.partial = []
+			self.size = 0
+
+	def _end(self, newline: bool) -> None:
+		if self.passing:
+			self.passing = False
+			if newline:
+				self._emit(b'\n')
+			return
+
+		line = b''.join(self.partial)
+		self.partial = []
+		self.size = 0
+		self._line(line, newline)
+
+	def _emit(self, data: bytes) -> None:
+		self.stats.after += len(data)
+		self.sink(data)
+
+	def _line(self, text: bytes, newline: bool = True) -> None:
+		line = text + b'\n' if newline else text
+		if self.count and line == self.last:
+			# Cheap path for exact repeats
+			self._extend(line)
+			return
+
+		key = VARIABLE.sub(b'#', text)
+		if self.count and key == self.key:
+			self.identical = False
+			self._extend(line)
+			return
+
+		self._flush()
+		self.key = key
+		self.kept = [line]
+		self.last = line
+		self.count = 1
+		self.identical = True
+
+	def _extend(self, line: bytes) -> None:
+		self.count += 1
+		self.last = line
+		if len(self.kept) < MIN_RUN:
+			self.kept.append(line)
+
+	def _flush(self) -> None:
+		if not self.count:
+			return
+
+		if self.count < MIN_RUN:
+			output = b''.join(self.kept)
+		elif self.identical:
+			output = self.kept[0] + f'[... previous line repeated {self.count - 1} more times ...]\n'.encode()
+			self.stats.collapsed += self.count - 1
+		else:
+			omitted = self.count - 2
+			shown = template(self.kept[0].decode('utf-8', errors='replace').rstrip('\n'), numbers=True)
+			output = self.kept[0] + f'[... {omitted} more lines like: {shown} ...]\n'.encode() + self.last
+			self.stats.collapsed += omitted
+
+		self.stats.after += len(output)
+		self.sink(output)
+		self.count = 0
+		self.kept = []
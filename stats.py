@@ -0,0 +1,78 @@
+from context import Blob, Context, Entry, Message, Role
+from typing import Any, NamedTuple, Sequence
+
+
+class Turn(NamedTuple):
+	index: int
+	model: str
+	prompt_tokens: int
+	output_tokens: int
+	total_tokens: int
+	seconds: float
+	prompt: str
+
+
+def turns(context: Context) -> list[Turn]:
+	'''Model turns that carry usage or timing metadata, with the user prompt that led to them.'''
+	result: list[Turn] = []
+	prompt = ''
+	for index, entry in enumerate(context):
+		if entry.role == Role.USER:
+			prompt = _text(entry)
+		if entry.role != Role.MODEL or not entry.meta:
+			continue
+
+		usage: Any = entry.meta.get('usage') or {}
+		timings: Any = entry.meta.get('timings') or {}
+		result.append(Turn(
+			index=index,
+			model=str(entry.meta.get('model', '')),
+			prompt_tokens=int(usage.get('prompt_tokens', 0)),
+			output_tokens=int(usage.get('output_tokens', 0)),
+			total_tokens=int(usage.get('total_tokens', 0)),
+			seconds=float(timings.get('response_seconds', 0.0)),
+			prompt=prompt
+		))
+	return result
+
+
+def summarize(context: Context, heaviest: int = 5) -> str:
+	recorded = turns(context)
+	if not recorded:
+		return 'No usage recorded in the current context.'
+
+	count = len(recorded)
+	prompt_tokens = sum(t.prompt_tokens for t in recorded)
+	output_tokens = sum(t.output_tokens for t in recorded)
+	seconds = sum(t.seconds for t in recorded)
+
+	lines = [
+		f'Model turns:   {count}',
+		f'Prompt tokens: {prompt_tokens} total, {prompt_tokens / count:.0f} average',
+		f'Output tokens: {output_tokens} total, {output_tokens / count:.0f} average',
+		f'Latency:       {seconds:.2f}s total, {seconds / count:.2f}s average, {max(t.seconds for t in recorded):.2f}s max',
+		'',
+		'Heaviest turns:'
+	]
+
+	ranked: Sequence[Turn] = sorted(recorded, key=lambda t: (t.total_tokens, t.seconds), reverse=True)[:heaviest]
+	for t in ranked:
+		lines.append(
+			f'  #{t.index:<4} {t.total_tokens:>8} tokens {t.seconds:>7.2f}s  {t.model}  {_shorten(t.prompt)}'
+		)
+
+	return '\n'.join(lines)
+
+
+def _text(entry: Entry) -> str:
+	# Blobs are summarized by their size, to avoid loading them just for a preview
+	return ' '.join(
+		p.text if isinstance(p, Message) else f'<{p.size} bytes>'
+		for p in entry.parts
+		if isinstance(p, (Message, Blob))
+	)
+
+
+def _shorten(text: str, width: int = 60) -> str:
+	text = ' '.join(text.split())
+	return text if len(text) <= width else text[:width - 3] + '...'
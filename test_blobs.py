@@ -0,0 +1,58 @@
+import os
+import tempfile
+import time
+import unittest
+
+from blobs import BlobStore
+from pathlib import Path
+
+
+class TestBlobStore(unittest.TestCase):
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.store = BlobStore(Path(self.tmp.name) / 'blobs')
+
+	def tearDown(self):
+		self.tmp.cleanup()
+
+	def test_put_and_get(self):
+		digest = self.store.put(b'hello' * 1000)
+		self.assertEqual(len(digest), 64)
+		self.assertEqual(self.store.get(digest), b'hello' * 1000)
+		self.assertEqual(list(self.store.digests()), [digest])
+
+	def test_deduplication(self):
+		first = self.store.put(b'same')
+		second = self.store.put(b'same')
+		self.assertEqual(first, second)
+		self.assertEqual(len(list(self.store.digests())), 1)
+
+	def test_uncompressed(self):
+		store = BlobStore(Path(self.tmp.name) / 'raw', compress=False)
+		digest = store.put(b'raw data')
+		path = store.path(digest)
+		assert path is not None
+		self.assertEqual(path.read_bytes(), b'raw data')
+		self.assertEqual(store.get(digest), b'raw data')
+
+	def test_missing(self):
+		with self.assertRaises(KeyError):
+			self.store.get('0' * 64)
+
+	def test_collect(self):
+		kept = self.store.put(b'kept')
+		dropped = self.store.put(b'dropped')
+		recent = self.store.put(b'recent')
+
+		past = time.time() - 7200
+		for digest in (kept, dropped):
+			path = self.store.path(digest)
+			assert path is not None
+			os.utime(path, (past, past))
+
+		self.store.collect({kept})
+		self.assertEqual(sorted(self.store.digests()), sorted([kept, recent]))
+
+
+if __name__ == '__main__':
+	unittest.main()
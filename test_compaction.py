@@ -0,0 +1,144 @@
+import tempfile
+import unittest
+
+from compaction import compact, needs_compaction, split, transcript
+from context import Context, Entry, Message, Note, Request, Result, Role
+from core import lock_path, save_context
+from iteration import LLMBackend
+from locking import file_lock
+from pathlib import Path
+from tools import ToolDefinition
+from typing import Callable, Mapping, Optional, Sequence
+
+
+class SummaryBackend(LLMBackend[str, Context]):
+	'''Answers with a fixed summary and records the transcripts it was asked to summarize.'''
+
+	def __init__(self, summary: str = 'The user asked about numbers.', during: Optional[Callable[[], None]] = None):
+		self.summary = summary
+		self.during = during
+		self.requests: list[Context] = []
+
+	def prepare_context(self, context: Context, tools: Mapping[str, ToolDefinition] = {}) -> Context:
+		return context
+
+	def generate_response(self, context: Context, timeout: Optional[float] = None) -> str:
+		self.requests.append(context)
+		if self.during:
+			self.during()
+		return self.summary
+
+	def parse_result(self, result: str) -> Sequence[Entry]:
+		return [Entry(role=Role.MODEL, parts=[Message(text=result)])]
+
+
+def make_context(turns: int) -> Context:
+	context = Context('')
+	for i in range(turns):
+		context.add_text(Role.USER, [f'question {i}'])
+		context.append(Entry(role=Role.MODEL, parts=[Message(text=f'answer {i}')]))
+	return context
+
+
+class TestCompaction(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.TemporaryDirectory()
+		self.context_file = Path(self.directory.name) / 'q_context_1_1.json'
+
+	def tearDown(self):
+		self.directory.cleanup()
+
+	def load(self) -> Context:
+		return Context(self.context_file.read_text())
+
+	def test_split(self):
+		context = make_context(6)
+		self.assertEqual(split(context, keep=2), (1, 9))
+		self.assertEqual(split(context, keep=6), (1, 1))
+		self.assertTrue(needs_compaction(context, after=5))
+		self.assertFalse(needs_compaction(context, after=6))
+
+	def test_compact(self):
+		save_context(self.context_file, make_context(6))
+		backend = SummaryBackend()
+
+		self.assertTrue(compact(self.context_file, backend, keep=2))
+
+		context = self.load()
+		self.assertEqual(len(context), 6)
+		self.assertEqual(context[0].role, Role.SYSTEM)
+		self.assertEqual(context[1].role, Role.SYSTEM)
+		self.assertEqual(context[1].parts, [Note(text='Summary of the earlier conversation:\nThe user asked about numbers.')])
+		self.assertEqual(context[1].meta['compacted_entries'], 8)
+		self.assertEqual(context[2].parts, [Message(text='question 4')])
+
+		prompt = backend.requests[0][1].parts[0]
+		assert isinstance(prompt, Message)
+		self.assertIn('user: question 0', prompt.text)
+		self.assertIn('model: answer 3', prompt.text)
+		self.assertNotIn('question 4', prompt.text)
+
+	def test_summary_is_cumulative(self):
+		save_context(self.context_file, make_context(6))
+		compact(self.context_file, SummaryBackend('first'), keep=2)
+
+		context = self.load()
+		for i in range(6, 9):
+			context.add_text(Role.USER, [f'question {i}'])
+			context.append(Entry(role=Role.MODEL, parts=[Message(text=f'answer {i}')]))
+		save_context(self.context_file, context)
+
+		backend = SummaryBackend('second')
+		self.assertTrue(compact(self.context_file, backend, keep=2))
+
+		prompt = backend.requests[0][1].parts[0]
+		assert isinstance(prompt, Message)
+		self.assertTrue(prompt.text.startswith('Summary of the earlier conversation:\nfirst'))
+
+		context = self.load()
+		self.assertEqual([e.role for e in context[:3]], [Role.SYSTEM, Role.SYSTEM, Role.USER])
+		self.assertEqual(len([e for e in context if any(isinstance(p, Note) for p in e.parts)]), 1)
+		self.assertEqual(context[2].parts, [Message(text='question 7')])
+
+	def test_new_turn_during_compaction_is_kept(self):
+		save_context(self.context_file, make_context(6))
+
+		def new_turn():
+			context = self.load()
+			context.add_text(Role.USER, ['question 6'])
+			save_context(self.context_file, context)
+
+		self.assertTrue(compact(self.context_file, SummaryBackend(during=new_turn), keep=2))
+		context = self.load()
+		self.assertEqual(context[-1].parts, [Message(text='question 6')])
+		self.assertIsInstance(context[1].parts[0], Note)
+
+	def test_reset_during_compaction_discards_summary(self):
+		save_context(self.context_file, make_context(6))
+
+		def reset():
+			save_context(self.context_file, Context(''))
+
+		self.assertFalse(compact(self.context_file, SummaryBackend(during=reset), keep=2))
+		self.assertEqual(len(self.load()), 1)
+
+	def test_single_worker(self):
+		save_context(self.context_file, make_context(6))
+		backend = SummaryBackend()
+		with file_lock(lock_path(self.context_file, 'compact')):
+			self.assertFalse(compact(self.context_file, backend, keep=2))
+		self.assertEqual(backend.requests, [])
+
+	def test_transcript(self):
+		entries = [
+			Entry(role=Role.MODEL, parts=[Request(id='1', name='dice', arguments={'number': 2})]),
+			Entry(role=Role.TOOL, parts=[Result(id='1', name='dice', result='x' * 5000)])
+		]
+		text = transcript(entries)
+		self.assertIn('model called dice({"number": 2})', text)
+		self.assertIn('characters omitted', text)
+		self.assertLess(len(text), 4500)
+
+
+if __name__ == '__main__':
+	unittest.main()
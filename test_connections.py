@@ -0,0 +1,144 @@
+import http.server
+import json
+import threading
+import time
+import unittest
+
+from connections import ConnectionPool
+from core import FetchError, fetch, fetch_stream
+from deadline import DeadlineExceeded
+from typing import Any
+from unittest.mock import patch
+
+
+class KeepAlive(http.server.BaseHTTPRequestHandler):
+	'''Echo server that keeps connections open and counts them.'''
+	protocol_version = 'HTTP/1.1'
+	connections = 0
+
+	def setup(self):
+		super().setup()
+		KeepAlive.connections += 1
+
+	def do_POST(self):
+		body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+		if 'trickle' in body:
+			return self.trickle(body['trickle'])
+		status = body.get('status', 200)
+		data = json.dumps({'echo': body}).encode()
+
+		self.send_response(status)
+		self.send_header('Content-Type', 'application/json')
+		self.send_header('Content-Length', str(len(data)))
+		if 'location' in body:
+			self.send_header('Location', body['location'])
+		if body.get('close'):
+			self.send_header('Connection', 'close')
+		# `drop` closes the connection without announcing it, like a server's idle timeout
+		self.close_connection = bool(body.get('close') or body.get('drop'))
+		self.end_headers()
+		self.wfile.write(data)
+
+	def trickle(self, lines: int) -> None:
+		'''Send server-sent events a byte at a time, each well within the socket timeout.'''
+		data = b'data: {}\n\n' * lines + b'data: [DONE]\n\n'
+		self.send_response(200)
+		self.send_header('Content-Type', 'text/event-stream')
+		self.send_header('Content-Length', str(len(data)))
+		self.end_headers()
+		self.close_connection = True
+		try:
+			for i in range(len(data)):
+				self.wfile.write(data[i:i + 1])
+				self.wfile.flush()
+				time.sleep(0.03)
+		except (BrokenPipeError, ConnectionResetError):
+			pass
+
+	def do_GET(self):
+		data = json.dumps({'echo': 'GET'}).encode()
+		self.send_response(200)
+		self.send_header('Content-Type', 'application/json')
+		self.send_header('Content-Length', str(len(data)))
+		self.end_headers()
+		self.wfile.write(data)
+
+	def log_message(self, format: str, *args: Any) -> None:
+		pass
+
+
+class TestConnectionPool(unittest.TestCase):
+	@classmethod
+	def setUpClass(cls):
+		cls.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), KeepAlive)
+		threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+		cls.url = f'http://127.0.0.1:{cls.server.server_port}/v1/chat'
+
+	@classmethod
+	def tearDownClass(cls):
+		cls.server.shutdown()
+		cls.server.server_close()
+
+	def setUp(self):
+		self.pool = ConnectionPool()
+		KeepAlive.connections = 0
+
+	def tearDown(self):
+		self.pool.close()
+
+	def post(self, data: Any) -> Any:
+		with self.pool.post(self.url, json.dumps(data).encode(), {'Content-Type': 'application/json'}, 5) as response:
+			return response.status, json.loads(response.read())
+
+	def test_connection_is_reused(self):
+		for i in range(3):
+			self.assertEqual(self.post({'turn': i}), (200, {'echo': {'turn': i}}))
+		self.assertEqual(KeepAlive.connections, 1)
+
+	def test_closed_connection_is_replaced(self):
+		self.post({'close': True})
+		self.assertEqual(self.post({'turn': 2})[0], 200)
+		self.assertEqual(KeepAlive.connections, 2)
+
+	def test_connection_dropped_after_the_check_is_retried(self):
+		self.post({'drop': True})
+		time.sleep(0.1)
+		# The server closes the connection between the check and the request
+		with patch('connections._dropped', return_value=False):
+			self.assertEqual(self.post({'turn': 2}), (200, {'echo': {'turn': 2}}))
+		self.assertEqual(KeepAlive.connections, 2)
+
+		# A body that can be read only once is made again for the retry
+		self.post({'drop': True})
+		time.sleep(0.1)
+		bodies = iter([[b'{"turn": 3}'], [b'{"turn": 4}']])
+		with patch('connections._dropped', return_value=False), self.pool.post(self.url, lambda: next(bodies), {'Content-Length': '11'}, 5) as response:
+			self.assertEqual(json.loads(response.read()), {'echo': {'turn': 4}})
+
+	def test_abandoned_response_is_not_reused(self):
+		self.pool.post(self.url, b'{}', {}, 5).close()
+		self.assertEqual(self.pool.idle, {})
+
+	def test_fetch(self):
+		self.assertEqual(fetch(self.url, {'question': 1}, {'Content-Type': 'application/json'}, timeout=5), {'echo': {'question': 1}})
+		with self.assertRaises(FetchError) as raised:
+			fetch(self.url, {'status': 429}, {'Content-Type': 'application/json'}, timeout=5)
+		self.assertEqual(getattr(raised.exception, 'code', None), 429)
+		self.assertIn('"status": 429', str(raised.exception))
+
+	def test_timeout_is_a_total_deadline(self):
+		# Each byte arrives within the socket timeout, the whole body doesn't
+		started = time.monotonic()
+		with self.assertRaises(DeadlineExceeded):
+			fetch(self.url, {'trickle': 3}, {'Content-Type': 'application/json'}, timeout=0.5)
+		with self.assertRaises(DeadlineExceeded):
+			list(fetch_stream(self.url, {'trickle': 3}, {'Content-Type': 'application/json'}, timeout=0.5))
+		self.assertLess(time.monotonic() - started, 2)
+
+	def test_redirects_are_left_to_urllib(self):
+		# urllib follows a redirected POST with a GET, as it did before the pool
+		self.assertEqual(fetch(self.url, {'status': 302, 'location': self.url}, {'Content-Type': 'application/json'}, timeout=5), {'echo': 'GET'})
+
+
+if __name__ == '__main__':
+	unittest.main()
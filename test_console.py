@@ -0,0 +1,106 @@
+import io
+import os
+import tempfile
+import unittest
+
+from console import ConsoleCommandTool, ShellWorker, _tee
+from contextlib import redirect_stderr, redirect_stdout
+from ingest import HeadTailBuffer
+from unittest.mock import patch
+
+
+class TestConsoleCommandTool(unittest.TestCase):
+	def execute(self, command: str, answer: str = 'y'):
+		with patch('builtins.input', return_value=answer), redirect_stdout(io.StringIO()) as out, redirect_stderr(io.StringIO()):
+			result = ConsoleCommandTool().execute(command)
+		return result, out.getvalue()
+
+	def test_denied(self):
+		result, _ = self.execute('echo hello', answer='n')
+		self.assertEqual(result, {'approved': False, 'command': 'echo hello', 'error': 'User denied execution'})
+
+	def test_output(self):
+		result, out = self.execute('echo hello; echo oops >&2; exit 3')
+		self.assertIn('hello', out)
+		self.assertEqual(result, {
+			'approved': True,
+			'command': 'echo hello; echo oops >&2; exit 3',
+			'returncode': 3,
+			'stdout': 'hello\n',
+			'stderr': 'oops\n'
+		})
+
+	def test_bounded_output(self):
+		with patch.object(ConsoleCommandTool, 'MAX_OUTPUT', 100):
+			result, _ = self.execute('head -c 10000 /dev/zero | tr "\\\\0" x')
+		assert isinstance(result, dict)
+		self.assertEqual(result['stdout_dropped_bytes'], 9900)
+		self.assertTrue(str(result['stdout']).startswith('x' * 50))
+		self.assertTrue(str(result['stdout']).endswith('x' * 50))
+
+	def test_timeout(self):
+		with patch.object(ConsoleCommandTool, 'MAX_TIMEOUT', 0.2):
+			result, _ = self.execute('sleep 5')
+		assert isinstance(result, dict)
+		self.assertTrue(result['timeout'])
+
+
+
+class TestShellWorker(TestConsoleCommandTool):
+	def setUp(self):
+		self.worker = ShellWorker()
+		patcher = patch.object(ConsoleCommandTool, 'worker', self.worker)
+		patcher.start()
+		self.addCleanup(patcher.stop)
+		self.addCleanup(self.worker.close)
+
+	def test_state_carries_over(self):
+		with tempfile.TemporaryDirectory() as directory:
+			self.execute(f'cd {directory} && export GREETING=hello')
+			result, _ = self.execute('pwd; echo "$GREETING"')
+		assert isinstance(result, dict)
+		self.assertEqual(result['stdout'], f'{os.path.realpath(directory)}\nhello\n')
+		self.assertEqual(result['returncode'], 0)
+
+	def test_framing(self):
+		pid = None
+		for command, stdout, returncode in [
+			('printf "no newline"', 'no newline', 0),
+			('printf "line\\n\\n"', 'line\n\n', 0),
+			('false', '', 1),
+			('echo "unterminated', '', 2),
+			('cat', '', 0)
+		]:
+			result, _ = self.execute(command)
+			assert isinstance(result, dict) and self.worker.process is not None
+			self.assertEqual((result['stdout'], result['returncode']), (stdout, returncode), command)
+			# Still the same shell
+			pid = pid or self.worker.process.pid
+			self.assertEqual(self.worker.process.pid, pid)
+
+	def test_restart_after_timeout(self):
+		self.execute('export KEPT=yes')
+		with patch.object(ConsoleCommandTool, 'MAX_TIMEOUT', 0.2):
+			result, _ = self.execute('sleep 5')
+		assert isinstance(result, dict)
+		self.assertTrue(result['timeout'])
+
+		result, _ = self.execute('echo "${KEPT:-fresh}"')
+		assert isinstance(result, dict)
+		self.assertEqual(result['stdout'], 'fresh\n')
+
+
+class TestTee(unittest.TestCase):
+	def test_split_characters_are_echoed_whole(self):
+		echo = io.StringIO()
+		write = _tee(HeadTailBuffer(100, 100), echo)
+		data = 'naïve – ☃'.encode()
+		for i in range(len(data)):
+			write(data[i:i + 1])
+		write(b'\xe2')
+		write(b'')
+		self.assertEqual(echo.getvalue(), 'naïve – ☃\ufffd')
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -1,7 +1,11 @@
 import json
+import tempfile
 from typing import cast
 import unittest
-from context import Context, Entry, PartType, Role, Message, Request, Result
+from unittest.mock import patch
+from blobs import BlobStore
+from context import BLOB_THRESHOLD, Attachment, Blob, Context, ContextFile, Entry, PartType, Role, Message, Request, Result
+from pathlib import Path
 
 class TestContext(unittest.TestCase):
 	def test_initialization(self):
@@ -127,6 +131,39 @@ class TestContext(unittest.TestCase):
 			part = cast(Message, part)
 			self.assertEqual(part.text, txt)
 
+	def test_add_large_text(self):
+		with tempfile.TemporaryDirectory() as tmp, patch('context.blobs', BlobStore(Path(tmp))):
+			text = 'x' * (BLOB_THRESHOLD + 1)
+			context = Context('')
+			context.add_text(Role.USER, ['small', text])
+			self.assertIsInstance(context[-1].parts[0], Message)
+			blob = context[-1].parts[1]
+			self.assertIsInstance(blob, Blob)
+			blob = cast(Blob, blob)
+			self.assertEqual(blob.size, len(text))
+			self.assertEqual(blob.text, text)
+
+			restored = Context(context.to_json())
+			self.assertEqual(restored[-1].parts[1], blob)
+			self.assertNotIn(text, context.to_json())
+
+	def test_add_attachment(self):
+		with tempfile.TemporaryDirectory() as tmp, patch('context.blobs', BlobStore(Path(tmp) / 'blobs')):
+			image = Path(tmp) / 'screenshot.jpg'
+			image.write_bytes(b'\xff\xd8 not really a jpeg')
+			attachment = Attachment.store(image)
+			self.assertEqual(attachment.type, PartType.JPEG)
+			self.assertEqual(attachment.file.read_bytes(), image.read_bytes())
+
+			context = Context('')
+			context.add_text(Role.USER, ['What is this?'], [attachment])
+			self.assertEqual(context[-1].parts[1], attachment)
+			self.assertNotIn('not really', context.to_json())
+			self.assertEqual(Context(context.to_json())[-1].parts[1], attachment)
+
+			with self.assertRaises(ValueError):
+				Attachment.store(Path(tmp) / 'notes.txt')
+
 	def test_add_results(self):
 		results: list[Result] = [Result(id='1', name='test', result='ok')]
 		context = Context('')
@@ -205,6 +242,84 @@ class TestContext(unittest.TestCase):
 		], indent=4)
 		self.assertEqual(json.loads(json_str), json.loads(expected_json))
 
+	def test_to_json_compact_and_pretty(self):
+		context = Context('')
+		context.add_text(Role.USER, ['Hello'])
+		compact = context.to_json()
+		pretty = context.to_json(indent=4)
+		# One entry per line
+		self.assertEqual(len(compact.splitlines()), len(context) + 2)
+		self.assertNotIn(': ', compact)
+		self.assertIn('\n    {', pretty)
+		self.assertEqual(json.loads(compact), json.loads(pretty))
+
+	def test_round_trip(self):
+		context = Context('')
+		context.add_text(Role.USER, ['Hello', 'World'])
+		context.extend([
+			Entry(role=Role.MODEL, parts=[
+				Message(text='Calling'),
+				Request(id='1', name='test_tool', arguments={'param': [1, 2.5, None]})
+			])
+		])
+		context.add_results([Result(id='1', name='test_tool', result={'nested': {'ok': True}})])
+		self.assertEqual(list(Context(context.to_json())), list(context))
+
+
+
+class TestContextFile(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.TemporaryDirectory()
+		self.path = Path(self.directory.name) / 'context.json'
+
+	def tearDown(self):
+		self.directory.cleanup()
+
+	def make_context(self) -> Context:
+		context = Context('')
+		for i in range(5):
+			context.add_text(Role.USER, [f'Question {i}\nwith a line break'])
+			context.add_text(Role.MODEL, [f'Answer {i}'])
+		return context
+
+	def test_tail_first(self):
+		context = self.make_context()
+		self.path.write_text(context.to_json())
+
+		with ContextFile(self.path) as saved:
+			self.assertEqual(saved.get_last_response(), 'Answer 4')
+			# Only the last entry has been decoded
+			self.assertEqual(len(saved.entries), 1)
+
+			self.assertEqual(saved[-2], context[-2])
+			self.assertEqual(list(reversed(saved)), list(reversed(context)))
+			self.assertEqual(len(saved), len(context))
+			self.assertEqual(saved[0], context[0])
+			self.assertEqual(list(saved[1:3]), context[1:3])
+			self.assertEqual(list(saved), list(context))
+			with self.assertRaises(IndexError):
+				saved[len(context)]
+			with self.assertRaises(IndexError):
+				saved[-len(context) - 1]
+
+	def test_empty(self):
+		context = Context('')
+		context.clear()
+		self.path.write_text(context.to_json())
+		with ContextFile(self.path) as saved:
+			self.assertEqual(len(saved), 0)
+			self.assertIsNone(saved.get_last_response())
+
+	def test_older_layouts(self):
+		context = self.make_context()
+		entries = [e.encode() for e in context]
+		for data in (json.dumps(entries, separators=(',', ':')), json.dumps(entries, indent=4), ''):
+			self.path.write_text(data)
+			with ContextFile(self.path) as saved:
+				expected = context if data else []
+				self.assertEqual(list(saved), list(expected))
+				self.assertEqual(saved.get_last_response(), 'Answer 4' if data else None)
+
 
 if __name__ == '__main__':
 	unittest.main()
@@ -0,0 +1,31 @@
+import time
+import unittest
+
+from deadline import Deadline, DeadlineExceeded
+
+
+class TestDeadline(unittest.TestCase):
+	def test_unlimited(self):
+		deadline = Deadline()
+		self.assertIsNone(deadline.remaining())
+		self.assertEqual(deadline.remaining(5), 5)
+		deadline.check()
+
+	def test_remaining(self):
+		deadline = Deadline(10)
+		remaining = deadline.remaining()
+		assert remaining is not None
+		self.assertTrue(9 < remaining <= 10)
+		self.assertEqual(deadline.remaining(2), 2)
+
+	def test_expired(self):
+		deadline = Deadline(0.01)
+		time.sleep(0.02)
+		with self.assertRaises(DeadlineExceeded):
+			deadline.check()
+		with self.assertRaises(TimeoutError):
+			deadline.remaining(1)
+
+
+if __name__ == '__main__':
+	unittest.main()
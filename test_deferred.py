@@ -0,0 +1,63 @@
+import logging
+import os
+import unittest
+
+from deferred import WorkQueue, close_stdout
+
+
+class TestWorkQueue(unittest.TestCase):
+	def setUp(self):
+		logging.getLogger().setLevel(logging.CRITICAL)
+
+	def tearDown(self):
+		logging.getLogger().setLevel(logging.WARNING)
+
+	def test_order(self):
+		done: list[str] = []
+		queue = WorkQueue()
+		queue.defer('first', done.append, 'a')
+		queue.defer('second', done.append, 'b')
+		self.assertEqual(done, [])
+
+		self.assertTrue(queue.run())
+		self.assertEqual(done, ['a', 'b'])
+		self.assertEqual(queue.tasks, [])
+
+	def test_failure_does_not_stop_the_rest(self):
+		done: list[str] = []
+
+		def fail():
+			raise OSError('disk full')
+
+		queue = WorkQueue()
+		queue.defer('failing', fail)
+		queue.defer('save', done.append, 'saved')
+
+		self.assertFalse(queue.run())
+		self.assertEqual(done, ['saved'])
+
+
+class TestCloseStdout(unittest.TestCase):
+	def test_reader_sees_end_of_output(self):
+		read_end, write_end = os.pipe()
+		with os.fdopen(read_end, 'r') as reader, os.fdopen(write_end, 'w') as stream:
+			stream.write('answer\n')
+			close_stdout(stream)
+
+			# The writer is still open, yet the reader gets the answer and the end of the stream
+			self.assertEqual(reader.read(), 'answer\n')
+
+			# Late writes go nowhere
+			stream.write('late\n')
+			stream.flush()
+
+	def test_reader_gone(self):
+		read_end, write_end = os.pipe()
+		os.close(read_end)
+		with os.fdopen(write_end, 'w') as stream:
+			stream.write('answer\n')
+			close_stdout(stream)
+
+
+if __name__ == '__main__':
+	unittest.main()
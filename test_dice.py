@@ -0,0 +1,75 @@
+import time
+import unittest
+
+from dice import DiceGroup, DiceTool, parse_expression
+from typing import Any, cast
+from unittest.mock import patch
+
+
+class TestParseExpression(unittest.TestCase):
+	def test_groups(self):
+		self.assertEqual(parse_expression('2d6, d8+1, 4d6dl1x6, 3x2d10kh1-2'), [
+			DiceGroup('2d6', 2, 6),
+			DiceGroup('d8+1', 1, 8, modifier=1),
+			DiceGroup('4d6dl1x6', 4, 6, select=('dl', 1), repeats=6),
+			DiceGroup('3x2d10kh1-2', 2, 10, select=('kh', 1), modifier=-2, repeats=3)
+		])
+
+	def test_shorthand_select(self):
+		self.assertEqual(parse_expression('4d6k3')[0].select, ('kh', 3))
+		self.assertEqual(parse_expression('4d6d1')[0].select, ('dl', 1))
+
+	def test_invalid(self):
+		for expression in ['', 'd', '2x6', '2d6 and 1d4', '2x3d6x2']:
+			with self.assertRaises(ValueError):
+				parse_expression(expression)
+
+
+class TestDiceTool(unittest.TestCase):
+	def test_number_and_sides(self):
+		result = cast(dict[str, Any], DiceTool().execute(number=3, sides=4))
+		self.assertEqual(len(result['results']), 3)
+		self.assertTrue(all(1 <= r <= 4 for r in result['results']))
+		self.assertEqual(result['total'], sum(result['results']))
+
+	def test_limits(self):
+		self.assertIn('error', cast(dict[str, Any], DiceTool().execute(number=0)))
+		self.assertIn('error', cast(dict[str, Any], DiceTool().execute(expression='2d1')))
+		self.assertIn('error', cast(dict[str, Any], DiceTool().execute(expression='2d6kh3')))
+		self.assertIn('error', cast(dict[str, Any], DiceTool().execute(expression='bogus')))
+
+	def test_multiple_groups(self):
+		with patch('random.choices', side_effect=[[3, 5], [8, 1]]):
+			result = DiceTool().execute(expression='2d6, 2d8+2')
+		self.assertEqual(result, {
+			'expression': '2d6, 2d8+2',
+			'groups': [
+				{'expression': '2d6', 'results': [3, 5], 'total': 8},
+				{'expression': '2d8+2', 'results': [8, 1], 'total': 11}
+			],
+			'total': 19
+		})
+
+	def test_keep_drop_and_repeat(self):
+		with patch('random.choices', return_value=[1, 4, 6, 3, 2, 2, 5, 6]):
+			result = cast(dict[str, Any], DiceTool().execute(expression='4d6dl1x2'))
+		group = result['groups'][0]
+		self.assertEqual(group['results'], [[1, 4, 6, 3], [2, 2, 5, 6]])
+		self.assertEqual(group['kept'], [[3, 4, 6], [2, 5, 6]])
+		self.assertEqual(group['totals'], [13, 13])
+		self.assertEqual(group['total'], 26)
+
+	def test_large_roll_is_summarized(self):
+		start = time.perf_counter()
+		result = cast(dict[str, Any], DiceTool().execute(expression='10000x1d20'))
+		self.assertLess(time.perf_counter() - start, 1)
+
+		group = result['groups'][0]
+		self.assertNotIn('results', group)
+		self.assertNotIn('totals', group)
+		self.assertEqual(sum(group['counts'].values()), 10000)
+		self.assertTrue(1 <= group['min'] <= group['mean'] <= group['max'] <= 20)
+
+
+if __name__ == '__main__':
+	unittest.main()
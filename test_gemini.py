@@ -1,7 +1,10 @@
+import base64
 import gemini
+import json
+import tempfile
 import unittest
 
-from context import Message, Request, Result, Context, Role, Entry
+from context import Attachment, Message, Request, Result, Context, Role, Entry
 from tools import ToolDefinition
 from unittest.mock import Mock
 
@@ -66,6 +69,18 @@ class TestGeminiGenerateResponse(unittest.TestCase):
 		self.assertEqual(result_tools["system_instruction"]["parts"][1]["text"], "do foo")
 		self.assertEqual(len(result_tools["system_instruction"]["parts"]), 2) # Tool 'bar' has no instructions, so only 2 parts total
 
+	def test_prepare_attachment(self):
+		with tempfile.NamedTemporaryFile(suffix='.png') as f:
+			f.write(b'\x89PNG data')
+			f.flush()
+			ctx = Context("")
+			ctx.add_text(Role.USER, ["what is this?"], [Attachment(path=f.name)])
+			result = self.backend.prepare_context(ctx)
+			body = json.loads(result.encode())
+		self.assertEqual(body["contents"][0]["parts"][1], {
+			"inline_data": {"mime_type": "image/png", "data": base64.b64encode(b'\x89PNG data').decode()}
+		})
+
 	def test_generate_response(self):
 		context = {"foo": "bar"}
 		result = self.backend.generate_response(context)
@@ -113,6 +128,15 @@ class TestGeminiGenerateResponse(unittest.TestCase):
 		self.assertEqual(result[0].parts[0], Message("This is a sample response."))
 		self.assertEqual(result[0].parts[1], Request("", "sample_tool", {"param": "value"}))
 		self.assertEqual(result[0].parts[2], Result("", "sample_tool", {"result": 42}))
+		self.assertEqual(result[0].meta, {})
+
+	def test_parse_result_usage(self):
+		sample_response = {	# type: ignore
+			"candidates": [{"content": {"parts": [{"text": "Hi"}]}}],
+			"usageMetadata": {"promptTokenCount": 12, "candidatesTokenCount": 3, "totalTokenCount": 15}
+		}
+		result = self.backend.parse_result(sample_response)
+		self.assertEqual(result[0].meta, {"usage": {"prompt_tokens": 12, "output_tokens": 3, "total_tokens": 15}})
 
 if __name__ == "__main__":
 	unittest.main()
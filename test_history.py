@@ -0,0 +1,57 @@
+import tempfile
+import unittest
+
+from context import Entry, Message, Result, Role
+from history import History, format_hits
+from pathlib import Path
+
+
+class TestHistory(unittest.TestCase):
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.history = History(Path(self.tmp.name) / 'sub' / 'history.sqlite3')
+
+	def tearDown(self):
+		self.history.close()
+		self.tmp.cleanup()
+
+	def turn(self, prompt: str, answer: str) -> list[Entry]:
+		return [
+			Entry(role=Role.USER, parts=[Message(text=prompt)]),
+			Entry(role=Role.MODEL, parts=[Message(text=answer)])
+		]
+
+	def test_record_and_search(self):
+		self.history.record('s1', self.turn('How to check the CUDA version?', 'nvidia-smi'))
+		self.history.record('s2', self.turn('Capital of France?', 'Paris'))
+		self.history.record('s2', [
+			Entry(role=Role.USER, parts=[Message(text='Roll a die')]),
+			Entry(role=Role.TOOL, parts=[Result(id='', name='dice', result={'total': 4})])
+		])
+
+		hits = self.history.search('cuda')
+		self.assertEqual(len(hits), 1)
+		self.assertEqual(hits[0].session, 's1')
+		self.assertEqual(hits[0].answer, 'nvidia-smi')
+
+		self.assertEqual(self.history.search('paris')[0].prompt, 'Capital of France?')
+		self.assertEqual(len(self.history.search('total')), 1)
+		self.assertEqual(self.history.search('paris cuda'), [])
+		self.assertIn('=> Paris', format_hits(self.history.search('france')))
+
+	def test_ranking(self):
+		self.history.record('s', self.turn('docker question', 'something else entirely, with many more words in it'))
+		self.history.record('s', self.turn('docker docker docker', 'docker'))
+		hits = self.history.search('docker')
+		self.assertEqual(hits[0].answer, 'docker')
+
+	def test_query_syntax_is_escaped(self):
+		self.history.record('s', self.turn('what does "set -e" do?', 'exit on error'))
+		self.assertEqual(len(self.history.search('"set -e"')), 1)
+		self.assertEqual(len(self.history.search('set-e NEAR(')), 0)
+		self.assertEqual(len(self.history.search('exit')), 1)
+		self.assertEqual(self.history.search('   '), [])
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,64 @@
+import io
+import os
+import tempfile
+import unittest
+
+from ingest import HeadTailBuffer, read_file, read_stream
+
+
+class TestHeadTailBuffer(unittest.TestCase):
+	def test_small_input_is_kept(self):
+		buffer = HeadTailBuffer(4, 4)
+		buffer.write(b'abc')
+		buffer.write(b'def')
+		self.assertEqual(buffer.getvalue(), b'abcdef')
+		self.assertEqual(buffer.dropped, 0)
+		self.assertEqual(buffer.text(), 'abcdef')
+
+	def test_large_input_keeps_head_and_tail(self):
+		buffer = HeadTailBuffer(3, 3)
+		for chunk in [b'0123', b'456789', b'abcdef']:
+			buffer.write(chunk)
+		self.assertEqual(buffer.total, 16)
+		self.assertEqual(buffer.getvalue(), b'012def')
+		self.assertEqual(buffer.dropped, 10)
+		self.assertIn('10 bytes omitted', buffer.text())
+		self.assertTrue(buffer.text().startswith('012'))
+		self.assertTrue(buffer.text().endswith('def'))
+
+
+class TestReadStream(unittest.TestCase):
+	def test_within_limit(self):
+		self.assertEqual(read_stream(io.BytesIO(b'hello'), 16), 'hello')
+
+	def test_over_limit(self):
+		text = read_stream(io.BytesIO(b'a' * 1000 + b'b' * 1000), 100)
+		self.assertTrue(text.startswith('a' * 50))
+		self.assertTrue(text.endswith('b' * 50))
+		self.assertIn('1900 bytes omitted', text)
+
+
+class TestReadFile(unittest.TestCase):
+	def setUp(self):
+		fd, self.path = tempfile.mkstemp()
+		os.close(fd)
+
+	def tearDown(self):
+		os.remove(self.path)
+
+	def test_empty_file(self):
+		self.assertEqual(read_file(self.path, 10), '')
+
+	def test_within_limit(self):
+		with open(self.path, 'wb') as f:
+			f.write(b'hello world')
+		self.assertEqual(read_file(self.path, 100), 'hello world')
+
+	def test_over_limit(self):
+		with open(self.path, 'wb') as f:
+			f.write(b'x' * 10 + b'-' * 100 + b'y' * 10)
+		self.assertEqual(read_file(self.path, 20), 'x' * 10 + '\n[... 100 bytes omitted ...]\n' + 'y' * 10)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -1,8 +1,11 @@
+import asyncio
 import logging
+import time
 from typing import Sequence, cast
 import unittest
-from context import Context, Entry, Request, Result, Role, Message
-from tools import Tool, ToolDefinition, ToolRegistry
+from deadline import Deadline, DeadlineExceeded
+from context import Context, Entry, Request, Result, Role, Message, ToolProgress
+from tools import Progress, Tool, ToolDefinition, ToolRegistry
 from typing import Mapping
 from iteration import Iteration, LLMBackend
 
@@ -25,7 +28,7 @@ class DummyTool(Tool):
 
 
 class DummyBackend(LLMBackend[str, Context]):
-	def generate_response(self, context: Context) -> str:
+	def generate_response(self, context: Context, timeout: float | None = None) -> str:
 		return "dummy_result"
 
 	def prepare_context(self, context: Context, tools: 'Mapping[str, ToolDefinition]' = {}) -> Context:
@@ -77,6 +80,9 @@ class TestIteration(unittest.TestCase):
 		self.assertEqual(request_part.name, "dummy_tool")
 		self.assertEqual(request_part.arguments, {"x": 1})
 
+		self.assertEqual(updated_context[2].meta['model'], 'DummyBackend')
+		self.assertIn('response_seconds', cast(Mapping[str, object], updated_context[2].meta['timings']))
+
 		self.assertEqual(updated_context[3].role, Role.TOOL)
 		self.assertIsInstance(updated_context[3].parts[0], Result)
 		result_part = cast(Result, updated_context[3].parts[0])
@@ -84,6 +90,47 @@ class TestIteration(unittest.TestCase):
 		self.assertEqual(result_part.name, "dummy_tool")
 		self.assertEqual(result_part.result, 2)
 
+	def test_deadline(self):
+		class SlowTool(DummyTool):
+			def execute(self, x: int) -> int:
+				time.sleep(0.05)
+				return x + 1
+
+		tool_registry = ToolRegistry()
+		tool_registry.register('dummy_tool', SlowTool)
+		context = Context("")
+		context.add_text(Role.USER, ["Call the dummy tool with x=1, please."])
+		iteration = Iteration(DummyBackend(), tool_registry)
+
+		with self.assertRaises(DeadlineExceeded):
+			iteration.execute(context, lambda role, part: None, ['dummy_tool'], Deadline(0.01))
+
+		# The completed tool round was kept, the interrupted one was not added
+		self.assertEqual(len(context), 4)
+		self.assertEqual(context[-1].role, Role.TOOL)
+
+	def test_deadline_is_passed_down(self):
+		timeouts: list[float | None] = []
+
+		class TimedBackend(DummyBackend):
+			def generate_response(self, context: Context, timeout: float | None = None) -> str:
+				timeouts.append(timeout)
+				return super().generate_response(context, timeout)
+
+		class TimedTool(DummyTool):
+			def execute(self, x: int) -> int:
+				timeouts.append(self.timeout)
+				return x + 1
+
+		tool_registry = ToolRegistry()
+		tool_registry.register('dummy_tool', TimedTool)
+		context = Context("")
+		context.add_text(Role.USER, ["Call the dummy tool with x=1, please."])
+		Iteration(TimedBackend(), tool_registry).execute(context, lambda role, part: None, ['dummy_tool'], Deadline(10))
+
+		self.assertEqual(len(timeouts), 3)
+		self.assertTrue(all(t is not None and 0 < t <= 10 for t in timeouts))
+
 	def test_tool_not_found(self):
 		backend = DummyBackend()
 		tool_registry = ToolRegistry()  # No tools registered
@@ -136,5 +183,94 @@ class TestIteration(unittest.TestCase):
 		self.assertIsInstance(outputs[2][1], Message)
 		self.assertEqual(cast(Message, outputs[2][1]).text, "Tool execution complete and result received.")
 
+	def run_streaming(self, tool: type[Tool], deadline: Deadline | None = None) -> tuple[Context, list[tuple[Role, object]]]:
+		tool_registry = ToolRegistry()
+		tool_registry.register('dummy_tool', tool)
+		context = Context("")
+		context.add_text(Role.USER, ["Call the dummy tool with x=1, please."])
+		outputs: list[tuple[Role, object]] = []
+		Iteration(DummyBackend(), tool_registry).execute(context, lambda role, part: outputs.append((role, part)), ['dummy_tool'], deadline)
+		return context, outputs
+
+	def test_generator_tool(self):
+		class CountingTool(DummyTool):
+			def execute(self, x: int):  # type: ignore[override]
+				for step in range(3):
+					yield Progress(f'step {step}')
+				return x + 1
+
+		context, outputs = self.run_streaming(CountingTool)
+
+		self.assertEqual(cast(Result, context[3].parts[0]).result, 2)
+		self.assertIsInstance(outputs[0][1], Request)
+		self.assertEqual(outputs[1:4], [(Role.TOOL, ToolProgress(id='random_id', name='dummy_tool', text=f'step {i}')) for i in range(3)])
+		self.assertIsInstance(outputs[4][1], Result)
+		# Progress is shown, but not kept
+		self.assertFalse(any(isinstance(p, ToolProgress) for e in context for p in e.parts))
+
+	def test_async_generator_tool(self):
+		class AsyncTool(DummyTool):
+			async def execute(self, x: int):  # type: ignore[override]
+				yield Progress('waiting')
+				await asyncio.sleep(0.01)
+				yield x + 1
+
+		context, outputs = self.run_streaming(AsyncTool)
+
+		self.assertEqual(cast(Result, context[3].parts[0]).result, 2)
+		self.assertEqual(outputs[1], (Role.TOOL, ToolProgress(id='random_id', name='dummy_tool', text='waiting')))
+
+	def test_generator_tool_cancelled_on_deadline(self):
+		cleaned_up: list[str] = []
+
+		class EndlessTool(DummyTool):
+			def execute(self, x: int):  # type: ignore[override]
+				try:
+					while True:
+						time.sleep(0.01)
+						yield Progress('still working')
+				finally:
+					cleaned_up.append('sync')
+
+		class AsyncEndlessTool(DummyTool):
+			async def execute(self, x: int):  # type: ignore[override]
+				try:
+					while True:
+						await asyncio.sleep(1)
+						yield Progress('still working')
+				finally:
+					cleaned_up.append('async')
+
+		for tool in (EndlessTool, AsyncEndlessTool):
+			with self.assertRaises(DeadlineExceeded):
+				self.run_streaming(tool, Deadline(0.05))
+		self.assertEqual(cleaned_up, ['sync', 'async'])
+
+	def test_generator_tool_cancelled_on_interrupt(self):
+		cleaned_up: list[bool] = []
+
+		class InterruptedTool(DummyTool):
+			def execute(self, x: int):  # type: ignore[override]
+				try:
+					yield Progress('started')
+					yield Progress('never shown')
+				finally:
+					cleaned_up.append(True)
+
+		def output(role: Role, part: object) -> None:
+			if isinstance(part, ToolProgress):
+				raise KeyboardInterrupt()
+
+		tool_registry = ToolRegistry()
+		tool_registry.register('dummy_tool', InterruptedTool)
+		context = Context("")
+		context.add_text(Role.USER, ["Call the dummy tool with x=1, please."])
+		with self.assertRaises(KeyboardInterrupt):
+			Iteration(DummyBackend(), tool_registry).execute(context, output, ['dummy_tool'])
+
+		self.assertEqual(cleaned_up, [True])
+		self.assertEqual(len(context), 2)
+
+
 if __name__ == "__main__":
 	unittest.main()
@@ -0,0 +1,121 @@
+import json
+import tempfile
+import threading
+import unittest
+
+from context import Context, Role
+from iteration import Iteration
+from metrics import BUCKETS, Metrics, metrics, render
+from pathlib import Path
+from test_iteration import DummyBackend, DummyTool
+from tools import ToolRegistry
+
+
+class TestMetrics(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.TemporaryDirectory()
+		self.path = Path(self.directory.name) / 'metrics' / 'metrics.json'
+
+	def tearDown(self):
+		self.directory.cleanup()
+
+	def test_invocations_add_up(self):
+		for status in ('ok', 'ok', '429'):
+			recorder = Metrics()
+			recorder.count('q_backend_requests_total', backend='Gemini', status=status)
+			recorder.observe('q_backend_request_seconds', 0.5, backend='Gemini')
+			recorder.flush(self.path)
+			self.assertEqual(recorder.counters, {})
+
+		text = render(self.path)
+		self.assertIn('# TYPE q_backend_requests_total counter', text)
+		self.assertIn('q_backend_requests_total{backend="Gemini",status="ok"} 2', text)
+		self.assertIn('q_backend_requests_total{backend="Gemini",status="429"} 1', text)
+
+		# Buckets are cumulative and end with +Inf
+		self.assertIn('# TYPE q_backend_request_seconds histogram', text)
+		self.assertIn('q_backend_request_seconds_bucket{backend="Gemini",le="0.25"} 0', text)
+		self.assertIn('q_backend_request_seconds_bucket{backend="Gemini",le="0.5"} 3', text)
+		self.assertIn('q_backend_request_seconds_bucket{backend="Gemini",le="+Inf"} 3', text)
+		self.assertIn('q_backend_request_seconds_sum{backend="Gemini"} 1.5', text)
+		self.assertIn('q_backend_request_seconds_count{backend="Gemini"} 3', text)
+
+	def test_concurrent_flushes(self):
+		def invocation():
+			recorder = Metrics()
+			recorder.count('q_invocations_total', outcome='ok')
+			recorder.flush(self.path)
+
+		threads = [threading.Thread(target=invocation) for _ in range(20)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+
+		self.assertIn('q_invocations_total{outcome="ok"} 20', render(self.path))
+
+	def test_label_escaping(self):
+		recorder = Metrics()
+		recorder.count('q_tool_calls_total', tool='say "hi"\\\n', status='ok')
+		recorder.flush(self.path)
+		self.assertIn('q_tool_calls_total{status="ok",tool="say \\"hi\\"\\\\\\n"} 1', render(self.path))
+
+	def test_missing_or_corrupt_file(self):
+		self.assertEqual(render(self.path), '')
+
+		self.path.parent.mkdir(parents=True)
+		self.path.write_text('{"counters": ')
+		recorder = Metrics()
+		recorder.count('q_cache_lookups_total', result='hit')
+		recorder.flush(self.path)
+		self.assertEqual(json.loads(self.path.read_text())['counters'], {'q_cache_lookups_total': {'{"result": "hit"}': 1.0}})
+
+	def test_bucket_bounds(self):
+		recorder = Metrics()
+		recorder.observe('q_tool_seconds', BUCKETS[0], tool='t')
+		recorder.observe('q_tool_seconds', BUCKETS[-1] * 2, tool='t')
+		buckets = recorder.histograms['q_tool_seconds']['{"tool": "t"}']['buckets']
+		self.assertEqual(buckets[0], 1)
+		self.assertEqual(buckets[-1], 1)
+
+
+class TestIterationMetrics(unittest.TestCase):
+	def setUp(self):
+		metrics.counters.clear()
+		metrics.histograms.clear()
+
+	def tearDown(self):
+		metrics.counters.clear()
+		metrics.histograms.clear()
+
+	def test_backend_and_tool_calls(self):
+		registry = ToolRegistry()
+		registry.register('dummy_tool', DummyTool)
+		context = Context('')
+		context.add_text(Role.USER, ['Call the dummy tool'])
+		Iteration(DummyBackend(), registry).execute(context, lambda role, part: None, ['dummy_tool'])
+
+		labels = '{"backend": "DummyBackend", "model": "DummyBackend", "status": "ok"}'
+		self.assertEqual(metrics.counters['q_backend_requests_total'][labels], 2)
+		self.assertEqual(metrics.counters['q_tool_calls_total']['{"status": "ok", "tool": "dummy_tool"}'], 1)
+		self.assertEqual(metrics.histograms['q_tool_seconds']['{"tool": "dummy_tool"}']['count'], 1)
+
+	def test_backend_errors(self):
+		class Failing(DummyBackend):
+			def generate_response(self, context, timeout=None):
+				error = OSError('Too many requests')
+				error.code = 429  # type: ignore[attr-defined]
+				raise error
+
+		context = Context('')
+		context.add_text(Role.USER, ['Hello'])
+		with self.assertRaises(OSError):
+			Iteration(Failing(), ToolRegistry()).execute(context, lambda role, part: None, None)
+
+		labels = '{"backend": "Failing", "model": "Failing", "status": "429"}'
+		self.assertEqual(metrics.counters['q_backend_requests_total'][labels], 1)
+		self.assertNotIn('q_backend_request_seconds', metrics.histograms)
+
+
+if __name__ == '__main__':
+	unittest.main()
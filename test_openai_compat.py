@@ -0,0 +1,137 @@
+import http.server
+import json
+import threading
+import unittest
+
+from context import Context, Entry, Message, Request, Result, Role
+from openai_compat import OpenAICompatible, accumulate
+from tools import ToolDefinition
+from typing import Any, cast
+
+
+class StandIn(http.server.BaseHTTPRequestHandler):
+	'''Minimal local chat completions server: it records the requests and replays the queued responses.'''
+	requests: list[tuple[dict[str, str], Any]] = []
+	responses: list[Any] = []
+
+	def do_POST(self):
+		body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+		StandIn.requests.append((dict(self.headers), body))
+		response = StandIn.responses.pop(0)
+
+		if body.get('stream'):
+			data = b''.join(b'data: ' + json.dumps(event).encode() + b'\n\n' for event in response) + b'data: [DONE]\n\n'
+			content_type = 'text/event-stream'
+		else:
+			data = json.dumps(response).encode()
+			content_type = 'application/json'
+
+		self.send_response(200)
+		self.send_header('Content-Type', content_type)
+		self.send_header('Content-Length', str(len(data)))
+		self.end_headers()
+		self.wfile.write(data)
+
+	def log_message(self, format: str, *args: Any) -> None:
+		pass
+
+
+class TestOpenAICompatible(unittest.TestCase):
+	@classmethod
+	def setUpClass(cls):
+		cls.server = http.server.HTTPServer(('127.0.0.1', 0), StandIn)
+		threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+		cls.base_url = f'http://127.0.0.1:{cls.server.server_port}/v1'
+
+	@classmethod
+	def tearDownClass(cls):
+		cls.server.shutdown()
+		cls.server.server_close()
+
+	def setUp(self):
+		StandIn.requests.clear()
+		StandIn.responses.clear()
+
+	def test_completion(self):
+		StandIn.responses.append({
+			'choices': [{'message': {'role': 'assistant', 'content': 'Paris'}}],
+			'usage': {'prompt_tokens': 20, 'completion_tokens': 1, 'total_tokens': 21}
+		})
+		backend = OpenAICompatible('local-model', base_url=self.base_url + '/', sampling={'temperature': 0.2})
+		context = Context('')
+		context.add_text(Role.USER, ['Capital of France?'])
+
+		entries = backend.parse_result(backend.generate_response(backend.prepare_context(context), timeout=5))
+
+		headers, body = StandIn.requests[0]
+		self.assertNotIn('Authorization', headers)
+		self.assertEqual(body['model'], 'local-model')
+		self.assertEqual(body['temperature'], 0.2)
+		self.assertEqual(body['messages'][1], {'role': 'user', 'content': 'Capital of France?'})
+		self.assertEqual(entries[0].parts, [Message(text='Paris')])
+		self.assertEqual(entries[0].meta['usage'], {'prompt_tokens': 20, 'output_tokens': 1, 'total_tokens': 21})
+
+	def test_tool_calls(self):
+		StandIn.responses.append({
+			'choices': [{'message': {'role': 'assistant', 'content': None, 'tool_calls': [
+				{'id': 'call_abc', 'type': 'function', 'function': {'name': 'dice', 'arguments': '{"number": 2}'}}
+			]}}]
+		})
+		backend = OpenAICompatible('local-model', base_url=self.base_url, api_key='secret')
+		tools = {'dice': ToolDefinition(description='Throw dice', parameters={'type': 'object'})}
+		context = Context('')
+		context.add_text(Role.USER, ['Roll two dice'])
+
+		entries = backend.parse_result(backend.generate_response(backend.prepare_context(context, tools)))
+		headers, body = StandIn.requests[0]
+		self.assertEqual(headers['Authorization'], 'Bearer secret')
+		self.assertEqual(body['tools'][0]['function']['name'], 'dice')
+		self.assertEqual(entries[0].parts, [Request(id='call_abc', name='dice', arguments={'number': 2})])
+
+		# The call id is sent back with the assistant message and the tool result
+		context.extend(entries)
+		context.add_results([Result(id='call_abc', name='dice', result={'total': 7})])
+		messages = backend.prepare_context(context, tools)['messages']
+		self.assertEqual(messages[2]['tool_calls'][0]['id'], 'call_abc')
+		self.assertEqual(messages[2]['tool_calls'][0]['function']['arguments'], '{"number": 2}')
+		self.assertEqual(messages[3], {'role': 'tool', 'tool_call_id': 'call_abc', 'content': '{"total": 7}'})
+
+	def test_missing_call_ids(self):
+		backend = OpenAICompatible('local-model', base_url=self.base_url)
+		context = Context('')
+		context.extend([
+			Entry(role=Role.MODEL, parts=[Request(id='', name='a', arguments={}), Request(id='', name='b', arguments={})]),
+			Entry(role=Role.TOOL, parts=[Result(id='', name='a', result=1), Result(id='', name='b', result=2)])
+		])
+		messages = backend.prepare_context(context)['messages']
+		ids = [call['id'] for call in messages[1]['tool_calls']]
+		self.assertEqual(len(set(ids)), 2)
+		self.assertEqual([m['tool_call_id'] for m in messages[2:]], ids)
+
+	def test_streaming(self):
+		StandIn.responses.append([
+			{'choices': [{'delta': {'role': 'assistant', 'content': 'Hel'}}]},
+			{'choices': [{'delta': {'content': 'lo'}}]},
+			{'choices': [{'delta': {'tool_calls': [{'index': 0, 'id': 'call_1', 'function': {'name': 'dice', 'arguments': '{"num'}}]}}]},
+			{'choices': [{'delta': {'tool_calls': [{'index': 0, 'function': {'arguments': 'ber": 3}'}}]}}]},
+			{'choices': [], 'usage': {'prompt_tokens': 5, 'completion_tokens': 2, 'total_tokens': 7}}
+		])
+		backend = OpenAICompatible('local-model', base_url=self.base_url, stream=True)
+		context = Context('')
+		context.add_text(Role.USER, ['Say hello and roll three dice'])
+
+		entries = backend.parse_result(backend.generate_response(backend.prepare_context(context), timeout=5))
+		_, body = StandIn.requests[0]
+		self.assertTrue(body['stream'])
+		self.assertEqual(entries[0].parts, [
+			Message(text='Hello'),
+			Request(id='call_1', name='dice', arguments={'number': 3})
+		])
+		self.assertEqual(cast(dict[str, int], entries[0].meta['usage'])['total_tokens'], 7)
+
+	def test_accumulate_empty(self):
+		self.assertEqual(accumulate([]), {'choices': [{'message': {'role': 'assistant', 'content': None}}]})
+
+
+if __name__ == '__main__':
+	unittest.main()
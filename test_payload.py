@@ -0,0 +1,68 @@
+import base64
+import json
+import os
+import tempfile
+import unittest
+
+from pathlib import Path
+from payload import InlineData, PayloadCache
+from unittest.mock import Mock
+
+
+class TestPayloadCache(unittest.TestCase):
+	def setUp(self):
+		self.cache = PayloadCache()
+
+	def test_encode(self):
+		payload = self.cache.payload('key', lambda: {'model': 'm', 'tools': [{'name': 'é'}]}, 'messages', [{'text': 'hi'}])
+		self.assertEqual(payload, {'model': 'm', 'tools': [{'name': 'é'}], 'messages': [{'text': 'hi'}]})
+		self.assertEqual(json.loads(payload.encode()), payload)
+		self.assertEqual(payload.encode(), json.dumps(payload).encode('utf-8'))
+
+	def test_empty_static(self):
+		payload = self.cache.payload('empty', lambda: {}, 'contents', [])
+		self.assertEqual(payload.encode(), b'{"contents": []}')
+
+	def test_static_built_once_per_key(self):
+		static = Mock(return_value={'model': 'm'})
+		first = self.cache.payload('key', static, 'messages', [1])
+		second = self.cache.payload('key', static, 'messages', [1, 2])
+		self.cache.payload('other', static, 'messages', [])
+		self.assertEqual(static.call_count, 2)
+		self.assertEqual(json.loads(first.encode())['messages'], [1])
+		self.assertEqual(json.loads(second.encode())['messages'], [1, 2])
+
+	def test_inline_data(self):
+		data = os.urandom(100000)
+		with tempfile.NamedTemporaryFile() as f:
+			f.write(data)
+			f.flush()
+
+			inline = InlineData(Path(f.name), prefix='data:image/png;base64,')
+			payload = self.cache.payload('inline', lambda: {'model': 'm'}, 'messages', [
+				{'url': inline, 'text': 'a "quoted" \u0000 string'},
+				{'url': InlineData(Path(f.name))}
+			])
+			chunks, length = payload.stream()
+			body = b''.join(chunks)
+			inline_length = len(inline)
+
+		self.assertEqual(len(body), length)
+		decoded = json.loads(body)
+		encoded = base64.b64encode(data).decode('ascii')
+		self.assertEqual(decoded['messages'][0]['url'], 'data:image/png;base64,' + encoded)
+		self.assertEqual(decoded['messages'][0]['text'], 'a "quoted" \u0000 string')
+		self.assertEqual(decoded['messages'][1]['url'], encoded)
+		self.assertEqual(inline_length, len(decoded['messages'][0]['url']))
+
+	def test_inline_data_chunks(self):
+		with tempfile.NamedTemporaryFile() as f:
+			f.write(b'x' * 3 * 1024 * 1024)
+			f.flush()
+			chunks = list(InlineData(Path(f.name)).chunks())
+		self.assertGreater(len(chunks), 2)
+		self.assertEqual(b''.join(chunks), base64.b64encode(b'x' * 3 * 1024 * 1024))
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,95 @@
+import json
+import logging
+import os
+import sys
+import tempfile
+import unittest
+
+from pathlib import Path
+from plugins import discover
+from tools import LazyTool, ToolRegistry
+
+
+PLUGIN = '''
+from tools import Tool, ToolDefinition
+
+
+class EchoTool(Tool):
+	@staticmethod
+	def definition():
+		return ToolDefinition(description={description!r}, parameters={{'type': 'object'}})
+
+	def execute(self, text):
+		return text
+
+
+TOOLS = {{'echo': EchoTool}}
+'''
+
+
+class TestDiscover(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.TemporaryDirectory()
+		self.tools_dir = Path(self.directory.name) / 'tools'
+		self.tools_dir.mkdir()
+		self.manifest = Path(self.directory.name) / 'cache' / 'tools.json'
+		self.write_plugin('Echo the text back.')
+
+	def tearDown(self):
+		sys.modules.pop('q_tool_echo', None)
+		self.directory.cleanup()
+
+	def write_plugin(self, description: str) -> None:
+		path = self.tools_dir / 'echo.py'
+		path.write_text(PLUGIN.format(description=description))
+		# Make sure the change is seen even on file systems with coarse timestamps
+		stat = path.stat()
+		os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+	def discover(self) -> ToolRegistry:
+		registry = ToolRegistry()
+		discover(registry, [self.tools_dir], self.manifest)
+		return registry
+
+	def test_builtin_and_user_tools(self):
+		registry = self.discover()
+		self.assertEqual(set(registry), {'dice', 'console', 'read_result', 'echo'})
+		self.assertIsInstance(registry['echo'], LazyTool)
+		self.assertEqual(registry['echo'].definition().description, 'Echo the text back.')
+		self.assertEqual(registry['echo']().execute(text='hi'), 'hi')
+
+	def test_manifest_avoids_imports(self):
+		self.discover()
+		sys.modules.pop('q_tool_echo')
+
+		registry = self.discover()
+		self.assertEqual(registry['echo'].definition().description, 'Echo the text back.')
+		self.assertNotIn('q_tool_echo', sys.modules)
+
+		registry['echo']()
+		self.assertIn('q_tool_echo', sys.modules)
+
+	def test_changed_module_rebuilds_the_manifest(self):
+		self.discover()
+		sys.modules.pop('q_tool_echo')
+		self.write_plugin('Repeat the text.')
+
+		registry = self.discover()
+		self.assertEqual(registry['echo'].definition().description, 'Repeat the text.')
+		self.assertIn('Repeat the text.', self.manifest.read_text())
+
+	def test_broken_module_is_skipped(self):
+		(self.tools_dir / 'broken.py').write_text('raise RuntimeError("oops")\n')
+		logging.getLogger().setLevel(logging.ERROR)
+		try:
+			registry = self.discover()
+		finally:
+			logging.getLogger().setLevel(logging.WARNING)
+
+		self.assertIn('echo', registry)
+		self.assertNotIn('q_tool_broken', sys.modules)
+		self.assertIn('q_tool_broken', json.loads(self.manifest.read_text())['sources'])
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,117 @@
+import tempfile
+import unittest
+
+from context import Context, Entry, Message, Role
+from deadline import Deadline, DeadlineExceeded
+from pathlib import Path
+from ratelimit import CHARS_PER_TOKEN, JITTER_SECONDS, RateLimiter, bucket_file, estimate_tokens
+from unittest.mock import patch
+
+
+class Clock:
+	'''Fake time; sleeping advances it.'''
+
+	def __init__(self):
+		self.now = 1000.0
+		self.slept: list[float] = []
+
+	def __call__(self) -> float:
+		return self.now
+
+	def sleep(self, seconds: float) -> None:
+		self.slept.append(seconds)
+		self.now += seconds
+
+
+class TestRateLimiter(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.TemporaryDirectory()
+		self.path = Path(self.directory.name) / 'ratelimit' / 'bucket.json'
+		self.clock = Clock()
+
+	def tearDown(self):
+		self.directory.cleanup()
+
+	def limiter(self, requests_per_minute=None, tokens_per_minute=None) -> RateLimiter:
+		return RateLimiter(self.path, requests_per_minute, tokens_per_minute, clock=self.clock, sleep=self.clock.sleep)
+
+	def test_requests_per_minute(self):
+		limiter = self.limiter(requests_per_minute=60)
+		for _ in range(60):
+			self.assertEqual(limiter.acquire(100), 0.0)
+
+		# The bucket is empty and refills at one request per second
+		waited = limiter.acquire(100)
+		self.assertGreaterEqual(waited, 1.0)
+		self.assertLessEqual(waited, 1.0 + JITTER_SECONDS)
+
+	def test_shared_between_processes(self):
+		first = self.limiter(tokens_per_minute=6000)
+		second = self.limiter(tokens_per_minute=6000)
+
+		first.acquire(4000)
+		# 2000 tokens are left; 3000 more refill in 30 seconds
+		self.assertGreaterEqual(second.acquire(5000), 30.0)
+
+	def test_interrupted_save_keeps_the_state(self):
+		self.limiter(tokens_per_minute=6000).acquire(4000)
+
+		# Killed while writing the new levels
+		with patch('json.dump', side_effect=KeyboardInterrupt), self.assertRaises(KeyboardInterrupt):
+			self.limiter(tokens_per_minute=6000).acquire(1000)
+		self.assertEqual([p.name for p in self.path.parent.iterdir() if not p.name.endswith('.lock')], ['bucket.json'])
+
+		# The buckets are not read as full
+		self.assertGreaterEqual(self.limiter(tokens_per_minute=6000).acquire(5000), 30.0)
+
+	def test_request_larger_than_the_bucket(self):
+		limiter = self.limiter(tokens_per_minute=1000)
+		self.assertEqual(limiter.acquire(50000), 0.0)
+		self.assertGreaterEqual(limiter.acquire(50000), 60.0)
+
+	def test_deadline(self):
+		limiter = self.limiter(requests_per_minute=1)
+		limiter.acquire(1)
+		with self.assertRaises(DeadlineExceeded):
+			limiter.acquire(1, Deadline(5))
+		self.assertEqual(self.clock.slept, [])
+
+	def test_settle(self):
+		limiter = self.limiter(tokens_per_minute=6000)
+		limiter.acquire(1000)
+		limiter.settle(1000, 7000)
+
+		# Used 7000 tokens, 1000 over the minute's quota: 1000 + 600 tokens take 16 seconds to refill
+		self.assertGreaterEqual(limiter.acquire(600), 16.0)
+
+	def test_no_limits(self):
+		limiter = self.limiter()
+		for _ in range(1000):
+			self.assertEqual(limiter.acquire(10 ** 9), 0.0)
+
+
+class TestEstimate(unittest.TestCase):
+	def test_from_text(self):
+		context = Context('')
+		context.clear()
+		context.add_text(Role.USER, ['x' * 400])
+		self.assertEqual(estimate_tokens(context), 400 // CHARS_PER_TOKEN)
+
+	def test_from_reported_usage(self):
+		context = Context('')
+		context.add_text(Role.USER, ['x' * 4000])
+		context.append(Entry(Role.MODEL, [Message('answer')], meta={'usage': {'prompt_tokens': 900, 'output_tokens': 50}}))
+		context.add_text(Role.USER, ['y' * 40])
+		self.assertEqual(estimate_tokens(context), 950 + 10)
+
+	def test_bucket_file(self):
+		class Backend:
+			def __init__(self, api_key: str):
+				self.api_key = api_key
+
+		self.assertEqual(bucket_file(Backend('a')), bucket_file(Backend('a')))
+		self.assertNotEqual(bucket_file(Backend('a')), bucket_file(Backend('b')))
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,114 @@
+import io
+import json
+import tempfile
+import unittest
+
+from contextlib import redirect_stderr, redirect_stdout
+from context import Attachment, Context, Entry, Message, PartType, Role
+from core import FetchError
+from iteration import Iteration, LLMBackend
+from pathlib import Path
+from repl import Repl
+from tools import ToolDefinition, ToolRegistry
+from typing import Mapping, Sequence
+
+
+class EchoBackend(LLMBackend[str, str]):
+	'''Answers with the last user message; fails on "fail", and can't parse the answer to "crash".'''
+
+	def prepare_context(self, context: Context, tools: Mapping[str, ToolDefinition] = {}) -> str:
+		user = [e for e in context if e.role == Role.USER][-1]
+		return '|'.join(p.text for p in user.parts if isinstance(p, Message))
+
+	def generate_response(self, context: str, timeout: float | None = None) -> str:
+		if context == 'fail':
+			raise FetchError('Too many requests', code=429)
+		return context
+
+	def parse_result(self, result: str) -> Sequence[Entry]:
+		if result == 'crash':
+			raise ValueError('Tool call without a name')
+		return [Entry(role=Role.MODEL, parts=[Message(text=f'echo: {result}')])]
+
+
+class TestRepl(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.TemporaryDirectory()
+		self.context_file = Path(self.directory.name) / 'q_context_1_1.json'
+
+	def tearDown(self):
+		self.directory.cleanup()
+
+	def run_repl(
+		self,
+		lines: list[str],
+		prompts: Sequence[str] = (),
+		reset: bool = False,
+		attachments: Sequence[Attachment] = ()
+	) -> tuple[Context, str]:
+		output = io.StringIO()
+		repl = Repl(self.context_file, Iteration(EchoBackend(), ToolRegistry()), lines=lines, attachments=attachments)
+		with redirect_stdout(output), redirect_stderr(io.StringIO()):
+			context = repl.run(prompts, reset)
+		return context, output.getvalue()
+
+	def saved(self) -> Context:
+		return Context(self.context_file.read_text())
+
+	def test_turns_are_saved_as_they_complete(self):
+		context, output = self.run_repl(['first question', '', 'second question'], prompts=['from the command line'])
+		self.assertEqual(output.splitlines(), ['echo: from the command line', 'echo: first question', 'echo: second question'])
+		self.assertEqual(self.saved(), context)
+		self.assertEqual(len(context), 7)
+
+		# The next session continues the conversation
+		context, _ = self.run_repl(['third question'])
+		self.assertEqual(len(context), 9)
+		self.assertEqual(self.saved(), context)
+
+		# The file stays in the one-entry-per-line layout
+		lines = self.context_file.read_text().splitlines()
+		self.assertEqual(len(lines), 11)
+		self.assertEqual(json.loads(lines[-2])['role'], 'model')
+
+	def test_multiple_lines(self):
+		_, output = self.run_repl(['one \\', 'two', '"""', 'three', '', 'four', '"""'])
+		self.assertEqual(output, 'echo: one \ntwo\necho: three\n\nfour\n')
+
+	def test_command_output(self):
+		context, output = self.run_repl(['!echo hello; exit 3', 'what happened?'])
+		self.assertEqual(output, 'echo: what happened?|$ echo hello; exit 3\nhello\n[exit status 3]\n')
+		self.assertEqual(len(context[-2].parts), 2)
+
+	def test_failed_turn_is_discarded(self):
+		context, _ = self.run_repl(['fail', 'hello', '/exit', 'never asked'])
+		self.assertEqual([e.role for e in context], [Role.SYSTEM, Role.USER, Role.MODEL])
+		self.assertEqual(self.saved(), context)
+
+	def test_unexpected_errors_end_only_the_turn(self):
+		context, output = self.run_repl(['crash', 'hello'])
+		self.assertEqual(output, 'echo: hello\n')
+		self.assertEqual([e.role for e in context], [Role.SYSTEM, Role.USER, Role.MODEL])
+		self.assertEqual(self.saved(), context)
+
+	def test_reset(self):
+		self.run_repl(['hello'])
+		context, _ = self.run_repl(['/reset'])
+		self.assertEqual(len(context), 1)
+		self.assertEqual(self.saved(), context)
+
+		# -r
+		self.run_repl(['hello'])
+		context, _ = self.run_repl([], reset=True)
+		self.assertEqual(len(context), 1)
+		self.assertEqual(self.saved(), context)
+
+	def test_attachments_go_with_the_first_question(self):
+		image = Attachment(path='/tmp/img.png', type=PartType.PNG)
+		context, _ = self.run_repl(['describe this', 'and now?'], attachments=[image])
+		self.assertEqual(context[1].parts, [Message('describe this'), image])
+		self.assertEqual(context[3].parts, [Message('and now?')])
+
+
+if __name__ == '__main__':
+	unittest.main()
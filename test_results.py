@@ -0,0 +1,120 @@
+import tempfile
+import unittest
+
+from blobs import BlobStore
+from context import Context, Role
+from iteration import Iteration
+from results import MAX_READ_BYTES, PREVIEW_BYTES, READ_RESULT, ReadResultTool, ResultPolicy, has_stored
+from test_iteration import DummyBackend
+from tools import JsonValue, Tool, ToolDefinition, ToolRegistry
+from pathlib import Path
+from typing import Any, Mapping, cast
+from unittest.mock import patch
+
+
+LOG = ''.join(f'line {i}: {"x" * 40}\n' for i in range(1, 1001))
+
+
+class StoreTestCase(unittest.TestCase):
+	'''Stores the results in a temporary blob store rather than the one of the live contexts.'''
+
+	def setUp(self):
+		self.directory = tempfile.TemporaryDirectory()
+		self.blobs = BlobStore(Path(self.directory.name))
+		patcher = patch('results.blobs', self.blobs)
+		patcher.start()
+		self.addCleanup(patcher.stop)
+
+	def tearDown(self):
+		self.directory.cleanup()
+
+
+class TestResultPolicy(StoreTestCase):
+	def test_small_results_are_kept(self):
+		self.assertEqual(ResultPolicy().apply('console', {'stdout': 'ok', 'exit_code': 0}), {'stdout': 'ok', 'exit_code': 0})
+
+	def test_large_text(self):
+		stored = cast(dict[str, Any], ResultPolicy(threshold=1024).apply('tool', LOG))
+		self.assertEqual(self.blobs.get(stored['digest']).decode(), LOG)
+		self.assertEqual(stored['bytes'], len(LOG))
+		self.assertEqual(stored['lines'], 1000)
+		self.assertTrue(stored['head'].startswith('line 1: '))
+		self.assertTrue(stored['head'].endswith('\n'))
+		self.assertLessEqual(len(stored['head']), PREVIEW_BYTES)
+		self.assertTrue(stored['tail'].endswith('line 1000: ' + 'x' * 40 + '\n'))
+		self.assertTrue(stored['tail'].startswith('line '))
+
+	def test_large_field(self):
+		result = cast(dict[str, Any], ResultPolicy(threshold=1024).apply('console', {'stdout': LOG, 'stderr': 'warning', 'exit_code': 1}))
+		self.assertEqual(result['stderr'], 'warning')
+		self.assertEqual(result['exit_code'], 1)
+		self.assertEqual(self.blobs.get(result['stdout']['digest']).decode(), LOG)
+
+	def test_per_tool_thresholds(self):
+		policy = ResultPolicy(threshold=1024, tools={'console': None, 'grep': 100000})
+		self.assertEqual(policy.apply('console', LOG), LOG)
+		self.assertEqual(policy.apply('grep', LOG), LOG)
+		self.assertNotEqual(policy.apply('other', LOG), LOG)
+
+		# Reading a stored result must not store it again
+		self.assertEqual(ResultPolicy(threshold=10).apply(READ_RESULT, LOG), LOG)
+
+
+class TestReadResult(StoreTestCase):
+	def test_range(self):
+		digest = cast(dict[str, Any], ResultPolicy(threshold=1024).apply('tool', LOG))['digest']
+		result = cast(dict[str, Any], ReadResultTool().execute(digest=digest, start=500, count=2))
+		self.assertEqual(result['text'], f'line 500: {"x" * 40}\nline 501: {"x" * 40}\n')
+		self.assertEqual((result['start'], result['end'], result['total_lines']), (500, 501, 1000))
+
+	def test_size_cap(self):
+		digest = self.blobs.put(('y' * 1000 + '\n').encode() * 100)
+		result = cast(dict[str, Any], ReadResultTool().execute(digest=digest, count=100))
+		self.assertLess(result['end'], 100)
+
+		digest = self.blobs.put(b'z' * 1000000)
+		result = cast(dict[str, Any], ReadResultTool().execute(digest=digest))
+		self.assertEqual(len(result['text']), MAX_READ_BYTES)
+
+	def test_errors(self):
+		self.assertIn('error', cast(dict[str, Any], ReadResultTool().execute(digest='../../etc/passwd')))
+		self.assertIn('error', cast(dict[str, Any], ReadResultTool().execute(digest='0' * 64)))
+
+
+class LogTool(Tool):
+	@staticmethod
+	def definition() -> ToolDefinition:
+		return ToolDefinition(description='Print a long log.', parameters={'type': 'object'})
+
+	def execute(self, x: int) -> JsonValue:
+		return LOG
+
+
+class OfferedTools(DummyBackend):
+	def __init__(self):
+		super().__init__()
+		self.offered: list[list[str]] = []
+
+	def prepare_context(self, context: Context, tools: Mapping[str, ToolDefinition] = {}) -> Context:
+		self.offered.append(list(tools))
+		return context
+
+
+class TestIterationResults(StoreTestCase):
+	def test_large_result_is_stored_and_readable(self):
+		registry = ToolRegistry()
+		registry.register('dummy_tool', LogTool)
+		registry.register(READ_RESULT, ReadResultTool)
+		backend = OfferedTools()
+		context = Context('')
+		context.add_text(Role.USER, ['Show me the log'])
+
+		Iteration(backend, registry, results=ResultPolicy(threshold=1024)).execute(context, lambda role, part: None, ['dummy_tool'])
+
+		self.assertTrue(has_stored(context))
+		self.assertEqual(backend.offered, [['dummy_tool'], ['dummy_tool', READ_RESULT]])
+		self.assertLess(len(context.to_json()), len(LOG))
+
+
+if __name__ == '__main__':
+	unittest.main()
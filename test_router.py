@@ -0,0 +1,175 @@
+import contextlib
+import io
+import tempfile
+import unittest
+
+from argparse import Namespace
+from blobs import BlobStore
+from context import Context, Entry, Message, Role
+from core import execute_command
+from iteration import Iteration, LLMBackend, Route
+from pathlib import Path
+from router import Router, Rule, Signals, parse_rules, signals
+from similarity import SimilarityCache
+from test_iteration import DummyBackend, DummyTool
+from tools import ToolDefinition, ToolRegistry
+from typing import Any, Mapping, Optional, Sequence
+from unittest.mock import patch
+
+
+class NamedBackend(LLMBackend[str, Context]):
+	def __init__(self, model: str):
+		self.model = model
+
+	def prepare_context(self, context: Context, tools: Mapping[str, ToolDefinition] = {}) -> Context:
+		return context
+
+	def generate_response(self, context: Context, timeout: Optional[float] = None) -> str:
+		return f'answered by {self.model}'
+
+	def parse_result(self, result: str) -> Sequence[Entry]:
+		return [Entry(role=Role.MODEL, parts=[Message(text=result)])]
+
+
+def question(text: str) -> Context:
+	context = Context('')
+	context.clear()
+	context.add_text(Role.USER, [text])
+	return context
+
+
+class TestRules(unittest.TestCase):
+	def test_signals(self):
+		found = signals(question('x' * 400), ['dice'])
+		self.assertEqual(found, Signals(tokens=100, prompt=400, tools=True, attachments=False))
+
+	def test_matches(self):
+		small = Rule('small', {}, max_tokens=1000, tools=False)
+		self.assertTrue(small.matches(Signals(tokens=10, prompt=40, tools=False, attachments=False)))
+		self.assertFalse(small.matches(Signals(tokens=10, prompt=40, tools=True, attachments=False)))
+		self.assertFalse(small.matches(Signals(tokens=5000, prompt=40, tools=False, attachments=False)))
+		self.assertTrue(Rule('any', {}).matches(Signals(tokens=5000, prompt=40, tools=True, attachments=True)))
+
+	def test_parse_rules(self):
+		backend = {'type': 'gemini', 'model': 'gemini-2.0-flash', 'rate_limit': {'requests_per_minute': 15}}
+		rules = parse_rules([
+			{'name': 'quick', 'when': {'max_prompt': 200}, 'backend': {'model': 'gemini-2.0-flash-lite'}},
+			{'when': {'min_tokens': 50000}, 'backend': {'model': 'gemini-2.5-pro'}}
+		], backend)
+
+		self.assertEqual(rules[0].name, 'quick')
+		self.assertEqual(rules[0].max_prompt, 200)
+		self.assertEqual(rules[0].backend, {**backend, 'model': 'gemini-2.0-flash-lite'})
+		self.assertEqual(rules[1].name, 'gemini-2.5-pro')
+
+		with self.assertRaises(ValueError):
+			parse_rules([{'when': {'max_words': 3}}], backend)
+
+		# Backend types are checked at startup, not when a question is first routed
+		self.assertEqual(len(parse_rules([{'backend': {'type': 'openai'}}], backend, ('gemini', 'openai'))), 1)
+		with self.assertRaises(ValueError):
+			parse_rules([{'backend': {'type': 'gemeni'}}], backend, ('gemini', 'openai'))
+
+
+class TestRouter(unittest.TestCase):
+	def setUp(self):
+		# Long questions are stored as blobs; keep them out of the store of the live contexts
+		self.directory = tempfile.TemporaryDirectory()
+		patcher = patch('context.blobs', BlobStore(Path(self.directory.name)))
+		patcher.start()
+		self.addCleanup(patcher.stop)
+		self.addCleanup(self.directory.cleanup)
+		self.made: list[str] = []
+
+		def make(backend: Mapping[str, Any]) -> tuple[LLMBackend[Any, Any], None]:
+			self.made.append(backend['model'])
+			return NamedBackend(backend['model']), None
+
+		rules = [Rule('quick', {'model': 'small'}, max_prompt=100, tools=False), Rule('heavy', {'model': 'large'}, min_tokens=10000)]
+		self.router = Router(rules, Route('default', NamedBackend('medium')), make)
+
+	def test_routes(self):
+		self.assertEqual(self.router(question('What is the flag for verbose?'), []).name, 'quick')
+		self.assertEqual(self.router(question('What is the flag for verbose?'), ['console']).name, 'default')
+		self.assertEqual(self.router(question('x' * 80000), []).name, 'heavy')
+		self.assertEqual(self.router(question('y' * 1000), []).name, 'default')
+
+		# Backends are made once, and only when picked
+		self.router(question('Again?'), [])
+		self.assertEqual(self.made, ['small', 'large'])
+
+	def test_failed_backend_falls_back_to_the_default(self):
+		def make(backend: Mapping[str, Any]) -> tuple[LLMBackend[Any, Any], None]:
+			raise LookupError('No secret found for api_key')
+
+		router = Router([Rule('quick', {'model': 'small'})], Route('default', NamedBackend('medium')), make)
+		with self.assertLogs(level='ERROR'):
+			self.assertEqual(router(question('Hi'), []).name, 'default')
+
+	def test_iteration(self):
+		it = Iteration(NamedBackend('medium'), ToolRegistry(), router=self.router)
+		context = it.execute(question('Hi'), lambda role, part: None, None)
+		self.assertEqual(context[-1].parts[0], Message('answered by small'))
+		self.assertEqual(context[-1].meta['route'], 'quick')
+		self.assertEqual(context[-1].meta['model'], 'small')
+
+		context.add_text(Role.USER, ['z' * 1000])
+		it.execute(context, lambda role, part: None, None)
+		self.assertEqual(context[-1].meta['route'], 'default')
+
+	def test_select(self):
+		calls: list[str] = []
+
+		def router(context: Context, tools: Sequence[str]) -> Route:
+			calls.append(context[-1].role.name)
+			return Route('quick', NamedBackend('small'))
+
+		it = Iteration(NamedBackend('medium'), ToolRegistry(), router=router)
+		context = question('Hi')
+		it.select(context, None)
+		self.assertEqual(getattr(it.model, 'model'), 'small')
+
+		# The question is not routed again
+		it.execute(context, lambda role, part: None, None)
+		self.assertEqual(calls, ['USER'])
+		self.assertEqual(context[-1].meta['route'], 'quick')
+
+	def test_cache_is_keyed_on_the_routed_model(self):
+		cache = SimilarityCache(Path(self.directory.name) / 'cache.sqlite3')
+		self.addCleanup(cache.close)
+		command = Namespace(search=None, attach=[], reset=False, log=False, stats=False, parse=False, tools=None, timeout=None)
+		context_file = Path(self.directory.name) / 'context.json'
+
+		def ask(router: Router) -> tuple[Message, bool]:
+			# Each time in a new conversation, which is part of the cache key as well
+			context_file.unlink(missing_ok=True)
+			with contextlib.redirect_stdout(io.StringIO()):
+				context = execute_command(context_file, command, ['Hi'], Iteration(NamedBackend('medium'), ToolRegistry(), router=router), cache=cache)
+			assert context is not None
+			return context[-1].parts[0], context[-1].meta.get('cached', False)  # type: ignore[return-value]
+
+		self.assertEqual(ask(self.router), (Message('answered by small'), False))
+		# The same question, routed to another model, is not answered from the cache
+		large = Router([Rule('heavy', {'model': 'large'})], Route('default', NamedBackend('medium')), lambda b: (NamedBackend(b['model']), None))
+		self.assertEqual(ask(large), (Message('answered by large'), False))
+		self.assertEqual(ask(self.router), (Message('answered by small'), True))
+
+	def test_tool_rounds_stay_on_the_route(self):
+		picked: list[str] = []
+		backend = DummyBackend()
+
+		def router(context: Context, tools: Sequence[str]) -> Route:
+			picked.append(context[-1].role.name)
+			return Route('tools', backend)
+
+		registry = ToolRegistry()
+		registry.register('dummy_tool', DummyTool)
+		context = question('Call the dummy tool')
+		Iteration(NamedBackend('unused'), registry, router=router).execute(context, lambda role, part: None, ['dummy_tool'])
+
+		self.assertEqual(picked, ['USER'])
+		self.assertEqual([e.meta.get('route') for e in context if e.role == Role.MODEL], ['tools', 'tools'])
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,109 @@
+import contextlib
+import io
+import tempfile
+import unittest
+
+from argparse import Namespace
+from context import Context, Role
+from core import execute_command, save_context
+from iteration import Iteration
+from pathlib import Path
+from similarity import SimilarityCache, config_key, normalize, signature, similarity
+from test_router import NamedBackend
+from tools import ToolRegistry
+
+
+LOG_A = '2024-05-01T10:00:01Z ERROR worker[1234]: connection to 10.0.0.5 refused (request deadbeef42)\nWhat is wrong?'
+LOG_B = '2024-06-11 11:22:33 ERROR worker[9876]: connection to 10.0.0.5 refused (request 0xcafe)\nWhat is wrong?'
+
+
+class TestSignatures(unittest.TestCase):
+	def test_normalize(self):
+		self.assertEqual(normalize(LOG_A), normalize(LOG_B))
+		self.assertEqual(
+			normalize('Oct 12 10:01:02 host sshd[42]: a1b2c3d4e5f6 PID 77'),
+			'<ts> host sshd[<pid>]: <hex> pid <pid>'
+		)
+
+		# Other numbers are part of the question
+		self.assertNotEqual(normalize('What is 2+2?'), normalize('What is 3+5?'))
+		self.assertNotEqual(normalize('connection to 10.0.0.5 refused'), normalize('connection to 10.0.0.7 refused'))
+
+	def test_similarity(self):
+		self.assertEqual(similarity(signature(LOG_A), signature(LOG_B)), 1.0)
+		self.assertGreater(similarity(
+			signature('How do I list all files modified in the last hour in this directory?'),
+			signature('how do I list all files modified in the last hour in this directory')
+		), 0.85)
+		self.assertLess(similarity(signature(LOG_A), signature('What is the capital of France?')), 0.2)
+
+
+class TestSimilarityCache(unittest.TestCase):
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.cache = SimilarityCache(Path(self.tmp.name) / 'cache.sqlite3', threshold=0.9)
+
+	def tearDown(self):
+		self.cache.close()
+		self.tmp.cleanup()
+
+	def test_lookup(self):
+		key = config_key('Gemini', 'model', ['system prompt'], [])
+		self.assertIsNone(self.cache.lookup(key, LOG_A))
+
+		self.cache.store(key, LOG_A, 'The worker can not reach the database.')
+		hit = self.cache.lookup(key, LOG_B)
+		assert hit is not None
+		self.assertEqual(hit.answer, 'The worker can not reach the database.')
+		self.assertEqual(hit.similarity, 1.0)
+
+		self.assertIsNone(self.cache.lookup(key, 'What is the capital of France?'))
+
+	def test_numbers_do_not_match(self):
+		key = config_key('Gemini', 'model')
+		self.cache.store(key, 'What is 2+2?', '4')
+		self.cache.store(key, 'How many bytes are in 64 KiB?', '65536')
+		self.assertIsNone(self.cache.lookup(key, 'What is 3+5?'))
+		self.assertIsNone(self.cache.lookup(key, 'How many bytes are in 2 KiB?'))
+
+		long = 'Please explain, in plain words and with an example, how many bytes there are in 64 KiB of memory'
+		self.cache.store(key, long, '65536')
+		self.assertIsNotNone(self.cache.lookup(key, long + '?'))
+		self.assertIsNone(self.cache.lookup(key, long.replace('64', '2')))
+
+	def test_configurations_are_separate(self):
+		self.cache.store(config_key('Gemini', 'a'), LOG_A, 'answer')
+		self.assertIsNone(self.cache.lookup(config_key('Gemini', 'b'), LOG_A))
+
+
+class TestConversationKey(unittest.TestCase):
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.cache = SimilarityCache(Path(self.tmp.name) / 'cache.sqlite3')
+
+	def tearDown(self):
+		self.cache.close()
+		self.tmp.cleanup()
+
+	def ask(self, name: str, earlier: str, prompt: str) -> bool:
+		'''Ask `prompt` after the turn `earlier` in a new context file; whether the answer came from the cache.'''
+		context_file = Path(self.tmp.name) / f'{name}.json'
+		context = Context('')
+		context.add_text(Role.USER, [earlier])
+		context.add_text(Role.MODEL, ['It depends.'])
+		save_context(context_file, context)
+
+		command = Namespace(search=None, attach=[], reset=False, log=False, stats=False, parse=False, tools=None, timeout=None)
+		with contextlib.redirect_stdout(io.StringIO()):
+			result = execute_command(context_file, command, [prompt], Iteration(NamedBackend('model'), ToolRegistry()), cache=self.cache)
+		assert result is not None
+		return result[-1].meta.get('cached', False)
+
+	def test_follow_ups_depend_on_the_conversation(self):
+		self.assertFalse(self.ask('a', 'Why is the upload slow?', 'why?'))
+		self.assertFalse(self.ask('b', 'Why did the build fail?', 'why?'))
+		self.assertTrue(self.ask('c', 'Why is the upload slow?', 'why?'))
+
+
+if __name__ == '__main__':
+	unittest.main()
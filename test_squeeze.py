@@ -0,0 +1,77 @@
+import io
+import unittest
+
+from ingest import read_stream
+from squeeze import LineSqueezer, SqueezeStats
+
+
+def squeeze(data: bytes, chunk: int = 0) -> tuple[bytes, SqueezeStats]:
+	output = bytearray()
+	squeezer = LineSqueezer(output.extend)
+	for i in range(0, len(data), chunk or len(data) or 1):
+		squeezer.write(data[i:i + (chunk or len(data))])
+	squeezer.close()
+	return bytes(output), squeezer.stats
+
+
+class TestLineSqueezer(unittest.TestCase):
+	def test_identical_lines(self):
+		output, stats = squeeze(b'start\n' + b'retrying...\n' * 50 + b'done\n')
+		self.assertEqual(output, b'start\nretrying...\n[... previous line repeated 49 more times ...]\ndone\n')
+		self.assertEqual(stats.collapsed, 49)
+
+	def test_similar_lines(self):
+		log = b''.join(
+			f'2024-05-01 10:{i // 60:02d}:{i % 60:02d} worker {i} heartbeat id=0x{i * 4099:x}\n'.encode()
+			for i in range(120)
+		)
+		output, stats = squeeze(b'boot\n' + log + b'shutdown')
+		self.assertEqual(output.splitlines(), [
+			b'boot',
+			b'2024-05-01 10:00:00 worker 0 heartbeat id=0x0',
+			b'[... 118 more lines like: <ts> worker <n> heartbeat id=<hex> ...]',
+			b'2024-05-01 10:01:59 worker 119 heartbeat id=0x77165',
+			b'shutdown'
+		])
+		self.assertEqual(stats.before, len(log) + 13)
+		self.assertEqual(stats.after, len(output))
+		self.assertIn('smaller', str(stats))
+
+	def test_short_runs_are_kept(self):
+		data = b'a 1\na 2\nb\nb\nc\n'
+		self.assertEqual(squeeze(data)[0], data)
+
+	def test_chunk_boundaries(self):
+		data = b''.join(f'line {i % 3}\n'.encode() * 5 for i in range(10)) + b'tail without newline'
+		self.assertEqual(squeeze(data, chunk=1)[0], squeeze(data)[0])
+		self.assertTrue(squeeze(data)[0].endswith(b'tail without newline'))
+
+	def test_long_lines_pass_through(self):
+		long = b'{"k": 1}' * 100
+		data = b'x\n' * 5 + long + b'\n' + b'x\n' * 5 + long
+		output = bytearray()
+		squeezer = LineSqueezer(output.extend, max_line=100)
+		for i in range(0, len(data), 7):
+			squeezer.write(data[i:i + 7])
+			self.assertLessEqual(squeezer.size, 100)
+		squeezer.close()
+
+		self.assertEqual(bytes(output), squeeze(b'x\n' * 5)[0] + long + b'\n' + squeeze(b'x\n' * 5)[0] + long)
+		self.assertEqual(squeezer.stats.after, len(output))
+
+	def test_read_stream_without_newlines(self):
+		# Used to be quadratic: the partial line was joined again with every chunk
+		stream = io.BytesIO(b'0123456789abcdef' * (2 * 1024 * 1024))
+		text = read_stream(stream, limit=1024, squeeze=SqueezeStats())
+		self.assertTrue(text.startswith('0123456789abcdef'))
+		self.assertIn('bytes omitted', text)
+
+	def test_read_stream(self):
+		stats = SqueezeStats()
+		text = read_stream(io.BytesIO(b'error: disk full\n' * 100000), limit=1024, squeeze=stats)
+		self.assertEqual(text, 'error: disk full\n[... previous line repeated 99999 more times ...]\n')
+		self.assertEqual(stats.before, 1700000)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,46 @@
+import unittest
+
+from context import Context, Entry, Message, Role
+from stats import summarize, turns
+
+
+class TestStats(unittest.TestCase):
+	def make_context(self) -> Context:
+		context = Context('')
+		for i, (tokens, seconds) in enumerate([(100, 0.5), (900, 2.0), (300, 1.0)]):
+			context.add_text(Role.USER, [f'question {i}'])
+			context.append(Entry(role=Role.MODEL, parts=[Message(text=f'answer {i}')], meta={
+				'model': 'test-model',
+				'usage': {'prompt_tokens': tokens - 10, 'output_tokens': 10, 'total_tokens': tokens},
+				'timings': {'prepare_seconds': 0.001, 'response_seconds': seconds}
+			}))
+		return context
+
+	def test_turns(self):
+		recorded = turns(self.make_context())
+		self.assertEqual([t.total_tokens for t in recorded], [100, 900, 300])
+		self.assertEqual([t.prompt for t in recorded], ['question 0', 'question 1', 'question 2'])
+		self.assertEqual(recorded[1].index, 4)
+
+	def test_summarize(self):
+		summary = summarize(self.make_context(), heaviest=2)
+		self.assertIn('Model turns:   3', summary)
+		self.assertIn('Prompt tokens: 1270 total, 423 average', summary)
+		self.assertIn('3.50s total', summary)
+		heaviest = summary.split('Heaviest turns:\n')[1].splitlines()
+		self.assertEqual(len(heaviest), 2)
+		self.assertIn('question 1', heaviest[0])
+		self.assertIn('question 2', heaviest[1])
+
+	def test_meta_is_persisted(self):
+		context = self.make_context()
+		restored = Context(context.to_json())
+		self.assertEqual(restored[2].meta, context[2].meta)
+		self.assertNotIn('meta', Context('').to_json())
+
+	def test_empty(self):
+		self.assertEqual(summarize(Context('')), 'No usage recorded in the current context.')
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -1,6 +1,6 @@
 from abc import ABC, abstractmethod
 import logging
-from typing import Any, Mapping, NamedTuple, Optional, Sequence, Type
+from typing import Any, AsyncGenerator, Callable, Generator, Mapping, NamedTuple, Optional, Sequence, Type
 
 
 JsonValue = str | int | float | bool | None | Mapping[str, 'JsonValue'] | Sequence['JsonValue']
@@ -12,21 +12,64 @@ class ToolDefinition(NamedTuple):
 	instructions: Optional[str] = None
 
 
+class Progress(NamedTuple):
+	'''Partial output of a long-running tool; shown to the user as it arrives, but never sent to the model.'''
+	text: str
+
+
+# A long-running tool yields Progress items; the other items, or the value a generator returns, make up the result
+ToolStream = Generator[Progress | JsonValue, None, JsonValue] | AsyncGenerator[Progress | JsonValue, None]
+
+
 class Tool(ABC):
+	# Seconds the tool may run; set from the remaining deadline before each call (None means no limit)
+	timeout: Optional[float] = None
+
 	@staticmethod
 	@abstractmethod
 	def definition() -> ToolDefinition:
 		raise NotImplementedError()
 
 	@abstractmethod
-	def execute(self, *args: Any, **kwargs: Any) -> JsonValue:
+	def execute(self, *args: Any, **kwargs: Any) -> JsonValue | ToolStream:
+		"""Run the tool and return its result.
+
+		A long-running tool can instead be a generator or an async generator that yields `Progress` items.
+		Its result is the value the generator returns or, as async generators can't return one, the last
+		item it yields that is not `Progress`. A generator is closed if the deadline expires or the user
+		presses Ctrl-C, so a `finally` block in it runs the cleanup.
+		"""
 		raise NotImplementedError()
 
 
 # TODO 8: Add instantiation strategies for tools (singleton, per-use, etc.)
 
-class ToolRegistry(dict[str, Type[Tool]]):
-	def register(self, name: str, tool_cls: Type[Tool]) -> None:
+class LazyTool:
+	"""Stand-in for a tool class that imports the tool's module only when the tool is first called.
+
+	The definition is known up front (see `plugins.discover`), so listing and describing the tool costs
+	no import.
+	"""
+
+	def __init__(self, definition: ToolDefinition, load: Callable[[], Type[Tool]]):
+		self._definition = definition
+		self._load = load
+		self._cls: Optional[Type[Tool]] = None
+
+	def definition(self) -> ToolDefinition:
+		return self._definition
+
+	def load(self) -> Type[Tool]:
+		if self._cls is None:
+			self._cls = self._load()
+		return self._cls
+
+	def __call__(self) -> Tool:
+		return self.load()()
+
+
+class ToolRegistry(dict[str, Type[Tool] | LazyTool]):
+	def register(self, name: str, tool_cls: Type[Tool] | LazyTool) -> None:
 		self[name] = tool_cls
 		logging.info(f'Registered tool: {name} -> {tool_cls}')
 